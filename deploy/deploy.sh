@@ -68,6 +68,7 @@ echo "Установка systemd сервисов..."
 sudo cp deploy/learning-platform.service /etc/systemd/system/
 sudo cp deploy/celery-worker.service /etc/systemd/system/
 sudo cp deploy/celery-beat.service /etc/systemd/system/
+sudo cp deploy/outbox-relay.service /etc/systemd/system/
 
 # Перезагрузка systemd
 sudo systemctl daemon-reload
@@ -77,10 +78,12 @@ echo "Запуск сервисов..."
 sudo systemctl enable learning-platform.service
 sudo systemctl enable celery-worker.service
 sudo systemctl enable celery-beat.service
+sudo systemctl enable outbox-relay.service
 
 sudo systemctl restart learning-platform.service
 sudo systemctl restart celery-worker.service
 sudo systemctl restart celery-beat.service
+sudo systemctl restart outbox-relay.service
 
 # Настройка Nginx
 if [ ! -f "/etc/nginx/sites-available/learning-platform" ]; then
@@ -96,3 +99,4 @@ echo "Проверьте статус сервисов:"
 echo "  sudo systemctl status learning-platform.service"
 echo "  sudo systemctl status celery-worker.service"
 echo "  sudo systemctl status celery-beat.service"
+echo "  sudo systemctl status outbox-relay.service"
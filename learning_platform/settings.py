@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -140,7 +141,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.RoleClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -159,10 +160,19 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
+    # Access-токены содержат роли пользователя (is_moderator, groups)
+    'TOKEN_OBTAIN_SERIALIZER': 'users.tokens.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.tokens.RoleTokenRefreshSerializer',
 }
 
+# Проверять пользователя и роли по БД для изменяющих запросов, даже если они есть в токене
+JWT_ROLE_CLAIMS_DB_CHECK_UNSAFE = os.getenv('JWT_ROLE_CLAIMS_DB_CHECK_UNSAFE', 'True').lower() == 'true'
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Время жизни кэша ролей пользователя (секунды); сбрасывается при изменении групп
+ROLES_CACHE_TIMEOUT = int(os.getenv('ROLES_CACHE_TIMEOUT', '60'))
+
 # Настройки drf-spectacular (генерация OpenAPI схемы и документации)
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Learning Platform API',
@@ -176,11 +186,56 @@ SPECTACULAR_SETTINGS = {
 # Настройки Stripe (используются тестовые значения)
 STRIPE_PUBLISHABLE_KEY = 'pk_test_your_publishable_key_here'  # Замените на ваш ключ
 STRIPE_SECRET_KEY = 'sk_test_your_secret_key_here'  # Замените на ваш ключ
-STRIPE_WEBHOOK_SECRET = 'whsec_your_webhook_secret_here'  # Замените на ваш webhook secret
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', 'whsec_your_webhook_secret_here')  # Замените на ваш webhook secret
+
+# Адрес Stripe API (для тестов можно указать локальный mock-сервер)
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+# Таймауты соединения и чтения ответа Stripe (секунды)
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '3'))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', '10'))
+# Повторы при сетевых ошибках (с экспоненциальной задержкой)
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# Размер пула keep-alive соединений к Stripe в одном процессе
+STRIPE_POOL_MAXSIZE = int(os.getenv('STRIPE_POOL_MAXSIZE', '10'))
+# Circuit breaker: после стольких сбоев подряд запросы к Stripe отклоняются на STRIPE_CIRCUIT_RESET_TIMEOUT секунд
+STRIPE_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('STRIPE_CIRCUIT_FAILURE_THRESHOLD', '5'))
+STRIPE_CIRCUIT_RESET_TIMEOUT = float(os.getenv('STRIPE_CIRCUIT_RESET_TIMEOUT', '30'))
+# Время хранения в кэше неконечного статуса сессии оплаты (секунды)
+STRIPE_STATUS_CACHE_TIMEOUT = int(os.getenv('STRIPE_STATUS_CACHE_TIMEOUT', '5'))
+# Время хранения ответа create_session по заголовку Idempotency-Key (секунды, Stripe хранит ключи 24 часа)
+STRIPE_IDEMPOTENCY_KEY_TTL = int(os.getenv('STRIPE_IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+# Время хранения в кэше активной цены курса (секунды, сбрасывается при смене цены)
+STRIPE_ACTIVE_PRICE_CACHE_TIMEOUT = int(os.getenv('STRIPE_ACTIVE_PRICE_CACHE_TIMEOUT', '3600'))
+# Массовая синхронизация каталога (sync_stripe_catalog): потоки, лимит запросов в секунду, размер пачки
+STRIPE_CATALOG_SYNC_WORKERS = int(os.getenv('STRIPE_CATALOG_SYNC_WORKERS', '8'))
+STRIPE_CATALOG_SYNC_RATE_LIMIT = float(os.getenv('STRIPE_CATALOG_SYNC_RATE_LIMIT', '20'))
+STRIPE_CATALOG_SYNC_BATCH_SIZE = int(os.getenv('STRIPE_CATALOG_SYNC_BATCH_SIZE', '100'))
+# Сверка незавершенных сессий оплаты: возраст сессии (минуты), размер пачки, параллельные запросы к Stripe
+PAYMENT_RECONCILE_AFTER_MINUTES = int(os.getenv('PAYMENT_RECONCILE_AFTER_MINUTES', '30'))
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.getenv('PAYMENT_RECONCILE_BATCH_SIZE', '100'))
+PAYMENT_RECONCILE_CONCURRENCY = int(os.getenv('PAYMENT_RECONCILE_CONCURRENCY', '5'))
 
 # Настройки Celery/Redis
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+}
+
+# В тестах используем локальный кэш, чтобы результаты не зависели от состояния Redis
+if 'test' in sys.argv:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Время хранения закэшированных ответов API курсов и уроков (секунды)
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', '300'))
+
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
@@ -191,13 +246,40 @@ CELERY_ENABLE_UTC = True
 
 # Расписание Celery Beat (периодические задачи)
 from datetime import timedelta as _celery_timedelta
+from celery.schedules import crontab as _celery_crontab
 CELERY_BEAT_SCHEDULE = {
     'deactivate-inactive-users-daily': {
         'task': 'lms.tasks.deactivate_inactive_users',
         'schedule': _celery_timedelta(days=1),
     },
+    'reconcile-payment-sessions': {
+        'task': 'lms.tasks.reconcile_payment_sessions',
+        'schedule': _celery_timedelta(minutes=15),
+    },
+    'send-daily-course-digests': {
+        'task': 'lms.tasks.send_course_digests',
+        'schedule': _celery_crontab(hour=8, minute=0),
+        'args': ('daily',),
+    },
+    'send-weekly-course-digests': {
+        'task': 'lms.tasks.send_course_digests',
+        'schedule': _celery_crontab(hour=8, minute=0, day_of_week='monday'),
+        'args': ('weekly',),
+    },
 }
 
+# Количество подписчиков в одной задаче рассылки об обновлении курса
+COURSE_UPDATE_EMAIL_CHUNK_SIZE = int(os.getenv('COURSE_UPDATE_EMAIL_CHUNK_SIZE', '500'))
+
+# Изменения курса за это время (секунды) объединяются в одно уведомление; 0 - отправлять сразу
+COURSE_UPDATE_DEBOUNCE_SECONDS = int(os.getenv('COURSE_UPDATE_DEBOUNCE_SECONDS', '60'))
+
+# Размер пачки серверного курсора при выгрузке платежей (?format=ndjson / csv)
+PAYMENT_EXPORT_CHUNK_SIZE = int(os.getenv('PAYMENT_EXPORT_CHUNK_SIZE', '2000'))
+
+# Количество пользователей в одной транзакции deactivate_inactive_users
+DEACTIVATE_USERS_BATCH_SIZE = int(os.getenv('DEACTIVATE_USERS_BATCH_SIZE', '1000'))
+
 # Настройки e-mail (консольный backend для разработки)
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@example.com')
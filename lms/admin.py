@@ -31,8 +31,8 @@ class CourseSubscriptionAdmin(admin.ModelAdmin):
 
 @admin.register(StripeProduct)
 class StripeProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'course', 'stripe_product_id', 'created_at')
-    list_filter = ('created_at', 'course')
+    list_display = ('name', 'course', 'stripe_product_id', 'sync_status', 'created_at')
+    list_filter = ('sync_status', 'created_at', 'course')
     search_fields = ('name', 'description', 'course__title', 'stripe_product_id')
     readonly_fields = ('stripe_product_id', 'created_at', 'updated_at')
     ordering = ('-created_at',)
@@ -40,8 +40,8 @@ class StripeProductAdmin(admin.ModelAdmin):
 
 @admin.register(StripePrice)
 class StripePriceAdmin(admin.ModelAdmin):
-    list_display = ('product', 'amount', 'currency', 'is_active', 'created_at')
-    list_filter = ('is_active', 'currency', 'created_at', 'product__course')
+    list_display = ('product', 'amount', 'currency', 'is_active', 'sync_status', 'created_at')
+    list_filter = ('is_active', 'sync_status', 'currency', 'created_at', 'product__course')
     search_fields = ('product__name', 'stripe_price_id')
     readonly_fields = ('stripe_price_id', 'created_at', 'updated_at')
     ordering = ('-created_at',)
@@ -0,0 +1,131 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from users.roles import get_request_roles
+
+CATALOG_VERSION_KEY = 'lms:version:catalog'
+COURSE_VERSION_KEY = 'lms:version:course:{}'
+RESPONSE_CACHE_KEY = 'lms:response:{}'
+
+
+def _increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def bump_course_versions(*course_ids):
+    """
+    Инвалидирует закэшированные ответы по курсам: увеличивает версию каждого
+    курса и общую версию каталога, от которой зависят списки
+    """
+    for course_id in set(course_ids):
+        if course_id is not None:
+            _increment(COURSE_VERSION_KEY.format(course_id))
+    _increment(CATALOG_VERSION_KEY)
+
+
+def get_versions(*keys):
+    versions = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+class CachedResponseMixin:
+    """
+    Кэширование ответов list/retrieve с сильными ETag.
+
+    ETag строится по пользователю, его ролям, параметрам запроса, версиям
+    курса/каталога и updated_at записей, поэтому проверка If-None-Match
+    стоит одного легкого запроса к БД и не затрагивает сериализаторы.
+    Вьюсет должен реализовать get_base_queryset() - queryset с учетом прав,
+    но без аннотаций и prefetch.
+    """
+    cache_course_field = 'id'
+
+    def get_base_queryset(self):
+        raise NotImplementedError
+
+    def get_list_validator(self):
+        queryset = self.filter_queryset(self.get_base_queryset()).order_by()
+        stats = queryset.aggregate(last_updated=Max('updated_at'), total=Count('id'))
+        version, = get_versions(CATALOG_VERSION_KEY)
+        return [version, stats['last_updated'], stats['total']]
+
+    def get_detail_validator(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            row = (
+                self.get_base_queryset()
+                .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                .values_list('updated_at', self.cache_course_field)
+                .first()
+            )
+        except (TypeError, ValueError, ValidationError):
+            # Некорректный id: ответ 404 сформирует обычный retrieve()
+            return None
+        if row is None:
+            return None
+        updated_at, course_id = row
+        version, = get_versions(COURSE_VERSION_KEY.format(course_id))
+        return [version, updated_at]
+
+    def get_etag(self, validator):
+        request = self.request
+        parts = [
+            self.basename,
+            self.action,
+            request.user.pk,
+            ','.join(sorted(get_request_roles(request))),
+            request.GET.urlencode(),
+            *validator,
+        ]
+        digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        return f'"{digest}"'
+
+    def cached_response(self, validator, build_response):
+        if validator is None:
+            return build_response()
+
+        etag = self.get_etag(validator)
+        if etag in parse_etags(self.request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = RESPONSE_CACHE_KEY.format(etag.strip('"'))
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = build_response()
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            self.get_list_validator(),
+            lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            self.get_detail_validator(),
+            lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs)
+        )
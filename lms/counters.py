@@ -0,0 +1,54 @@
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Course, CourseSubscription, Lesson
+
+
+def _apply_deltas(field, deltas):
+    # Одинаковые изменения объединяются в один UPDATE; при рассинхронизации
+    # счетчик не уходит ниже нуля, точное значение восстановит recount_course_counters
+    by_delta = {}
+    for course_id, delta in Counter(deltas).items():
+        if course_id is not None and delta:
+            by_delta.setdefault(delta, []).append(course_id)
+    for delta, course_ids in by_delta.items():
+        Course.objects.filter(pk__in=course_ids).update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def change_lessons_count(deltas):
+    """
+    Изменяет Course.lessons_count. deltas - {id курса: изменение}.
+    Вызывается в той же транзакции, что и изменение уроков.
+    """
+    _apply_deltas('lessons_count', deltas)
+
+
+def change_subscribers_count(deltas):
+    """
+    Изменяет Course.active_subscribers_count. deltas - {id курса: изменение}.
+    Вызывается в той же транзакции, что и изменение подписок.
+    """
+    _apply_deltas('active_subscribers_count', deltas)
+
+
+def recount_course_counters(queryset=None):
+    """
+    Пересчитывает счетчики курсов по фактическим данным одним UPDATE.
+    Возвращает количество обновленных курсов.
+    """
+    if queryset is None:
+        queryset = Course.objects.all()
+    lessons = (
+        Lesson.objects.filter(course=OuterRef('pk'))
+        .order_by().values('course').annotate(total=Count('id')).values('total')
+    )
+    subscribers = (
+        CourseSubscription.objects.filter(course=OuterRef('pk'), is_active=True)
+        .order_by().values('course').annotate(total=Count('id')).values('total')
+    )
+    return queryset.order_by().update(
+        lessons_count=Coalesce(Subquery(lessons), Value(0)),
+        active_subscribers_count=Coalesce(Subquery(subscribers), Value(0)),
+    )
@@ -0,0 +1,95 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+
+def _parse_list(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseFieldsetsMixin:
+    """
+    Миксин сериализатора для выборочных полей.
+
+    ?fields=id,title оставляет в ответе только перечисленные поля.
+    Поля из Meta.expandable_fields (например, вложенные уроки) в списках
+    не выводятся, пока их не запросят через ?expand=lessons или ?fields=.
+    Работает только для чтения и только для корневого сериализатора.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS or not self._is_root():
+            return fields
+
+        requested = _parse_list(request.query_params.get(self.fields_query_param))
+        expanded = _parse_list(request.query_params.get(self.expand_query_param)) | requested
+        view = self.context.get('view')
+        if getattr(view, 'action', None) == 'list':
+            for name in getattr(self.Meta, 'expandable_fields', ()):
+                if name not in expanded:
+                    fields.pop(name, None)
+
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    def _is_root(self):
+        if self.parent is None:
+            return True
+        return isinstance(self.parent, ListSerializer) and self.parent.parent is None
+
+
+def get_serializer_columns(serializer_fields, model):
+    """
+    Возвращает (колонки для only(), связи для select_related()), которые
+    нужны полям сериализатора. Поля-методы (source='*') колонок не требуют:
+    они должны читать аннотации queryset.
+    """
+    columns = set()
+    relations = set()
+    for field in serializer_fields.values():
+        if field.source == '*':
+            continue
+        parts = field.source.split('.')
+        name = parts[0]
+        if name.startswith('get_') and name.endswith('_display'):
+            name = name[len('get_'):-len('_display')]
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.concrete:
+            # Обратные связи (например, уроки курса) подгружаются отдельно
+            continue
+        if model_field.is_relation and len(parts) > 1:
+            # user.email -> JOIN users_user и только колонка email
+            relations.add(name)
+            columns.add(f'{name}__{parts[1]}')
+        else:
+            columns.add(name)
+    return columns, relations
+
+
+class SparseFieldsetsViewMixin:
+    """
+    Миксин вьюсета: при ?fields= выбирает из БД только колонки,
+    которые нужны оставшимся полям сериализатора
+    """
+    sparse_required_fields = ('id',)
+
+    def get_response_fields(self):
+        return self.get_serializer().fields
+
+    def apply_sparse_fields(self, queryset):
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        if not self.request.query_params.get(SparseFieldsetsMixin.fields_query_param):
+            return queryset
+        columns, relations = get_serializer_columns(self.get_response_fields(), queryset.model)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*self.sparse_required_fields, *columns)
@@ -0,0 +1,252 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from lms.models import (
+    Course, Lesson, CourseSubscription, PaymentSession, StripePrice, StripeProduct, STRIPE_SYNC_SYNCED
+)
+from lms.paginators import KeysetPagination
+from lms.stripe_service import PENDING_STATUSES
+from lms.stripe_views import PaymentSessionViewSet
+from lms.views import CourseViewSet, LessonViewSet, CourseSubscriptionViewSet
+from users.models import User, Payment
+from users.roles import MODERATORS_GROUP
+from users.views import PaymentViewSet
+
+# Индексы, которые планировщик должен выбрать для каждого запроса (достаточно одного из списка)
+EXPECTED_INDEXES = {
+    'courses': ['lms_course_owner_created_idx'],
+    'courses_cursor': ['lms_course_owner_created_idx'],
+    # Составного индекса (owner, created_at) у уроков нет: уроки владельца сортируются в памяти
+    'lessons': ['lms_lesson_owner_id_c2b36340'],
+    'lessons_cursor': ['lms_lesson_owner_id_c2b36340'],
+    # Уроки курса выбираются целиком (без LIMIT), планировщик может отсортировать их после чтения
+    'course_lessons': ['lms_lesson_course_created_idx', 'lms_lesson_course_id_18265279'],
+    'subscriptions': ['lms_sub_user_active_idx'],
+    'subscriptions_cursor': ['lms_sub_user_active_idx'],
+    'course_subscribers': ['lms_sub_course_active_idx'],
+    'payments': ['users_payment_user_date_idx'],
+    'payments_cursor': ['users_payment_user_date_idx'],
+    'payment_sessions': ['lms_session_user_created_idx', 'lms_paymentsession_user_id_0dcd1f6d'],
+    'pending_sessions': ['lms_session_pending_idx'],
+    'active_prices': ['lms_price_one_active_per_product'],
+    'inactive_users': ['users_active_last_login_idx'],
+}
+
+# Таблицы, статистика которых обновляется перед проверкой
+ANALYZE_MODELS = [User, Course, Lesson, CourseSubscription, Payment, PaymentSession, StripeProduct, StripePrice]
+
+
+def collect_nodes(plan):
+    """Все узлы плана EXPLAIN (FORMAT JSON)"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from collect_nodes(child)
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет через EXPLAIN, что основные запросы API выбирают ожидаемые индексы. '
+        'Перед проверкой добавляет реалистичный объем данных и обновляет статистику '
+        '(ANALYZE); все изменения откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=2000,
+            help='Количество пользователей в тестовых данных (по умолчанию 2000)'
+        )
+        parser.add_argument(
+            '--no-seed',
+            action='store_true',
+            help='Проверять на данных, уже имеющихся в базе (например, на копии production)'
+        )
+
+    def seed(self, users_count):
+        """
+        Добавляет пользователей с курсами, уроками, подписками, платежами и ценами.
+        Распределения близки к рабочим: большинство пользователей недавно заходили,
+        большинство подписок активны, незавершенных сессий оплаты мало.
+        """
+        now = timezone.now()
+        users = User.objects.bulk_create([
+            User(
+                email=f'query-plan-{i}@example.com',
+                password='!',
+                last_login=now - timedelta(days=90 if i % 10 == 0 else i % 7),
+            )
+            for i in range(users_count)
+        ])
+        courses = Course.objects.bulk_create([
+            Course(title=f'Course {i}', description='Description', owner=users[i // 3])
+            for i in range(users_count * 3)
+        ])
+        Lesson.objects.bulk_create([
+            Lesson(
+                title=f'Lesson {i}',
+                description='Description',
+                video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                course=courses[i // 4],
+                owner=courses[i // 4].owner,
+            )
+            for i in range(len(courses) * 4)
+        ])
+        CourseSubscription.objects.bulk_create([
+            CourseSubscription(user=user, course=courses[(i * 7 + j * 13) % len(courses)], is_active=j != 0)
+            for i, user in enumerate(users)
+            for j in range(5)
+        ], ignore_conflicts=True)
+        Payment.objects.bulk_create([
+            Payment(
+                user=user, payment_date=now - timedelta(days=j), paid_course=courses[(i + j) % len(courses)],
+                amount=100, payment_method='card'
+            )
+            for i, user in enumerate(users)
+            for j in range(5)
+        ])
+        PaymentSession.objects.bulk_create([
+            PaymentSession(
+                user=user, course=courses[(i + j) % len(courses)], stripe_session_id=f'cs_query_plan_{i}_{j}',
+                amount=100, status='pending' if (i + j) % 50 == 0 else 'paid'
+            )
+            for i, user in enumerate(users)
+            for j in range(5)
+        ])
+        products = StripeProduct.objects.bulk_create([
+            StripeProduct(
+                course=course, stripe_product_id=f'prod_query_plan_{course.pk}', name=course.title,
+                sync_status=STRIPE_SYNC_SYNCED
+            )
+            for course in courses
+        ])
+        # У каждого продукта одна активная цена и несколько старых
+        StripePrice.objects.bulk_create([
+            StripePrice(
+                product=product, stripe_price_id=f'price_query_plan_{product.pk}_{j}', amount=100,
+                is_active=j == 0, sync_status=STRIPE_SYNC_SYNCED
+            )
+            for product in products
+            for j in range(3)
+        ])
+        # Проверяются запросы активного пользователя с длинными списками и большого курса:
+        # именно для них составные индексы избавляют от сортировки всех записей
+        heavy_user, heavy_course = users[0], courses[0]
+        heavy_count = max(users_count // 4, 1)
+        extra_courses = Course.objects.bulk_create([
+            Course(title=f'Heavy course {i}', description='Description', owner=heavy_user)
+            for i in range(heavy_count)
+        ])
+        Lesson.objects.bulk_create([
+            Lesson(
+                title=f'Heavy lesson {i}',
+                description='Description',
+                video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                course=heavy_course,
+                owner=heavy_user,
+            )
+            for i in range(heavy_count)
+        ])
+        CourseSubscription.objects.bulk_create([
+            CourseSubscription(user=heavy_user, course=course, is_active=i % 5 != 0)
+            for i, course in enumerate(courses[3:3 + heavy_count])
+        ], ignore_conflicts=True)
+        Payment.objects.bulk_create([
+            Payment(
+                user=heavy_user, payment_date=now - timedelta(hours=i), paid_course=course,
+                amount=100, payment_method='card'
+            )
+            for i, course in enumerate(extra_courses)
+        ])
+        return heavy_user, heavy_course
+
+    def build_view(self, viewset_class, user, params=None):
+        """Вьюсет в состоянии обработки GET-запроса списка от пользователя user"""
+        view = viewset_class(action_map={'get': 'list'}, args=(), kwargs={}, format_kwarg=None)
+        view.request = view.initialize_request(RequestFactory().get('/', params or {}))
+        view.request.user = user
+        return view
+
+    def get_list_query(self, viewset_class, user, params=None):
+        """
+        Запрос страницы списка в том виде, в каком его выполняет вьюсет:
+        get_queryset(), фильтры и сортировка filter_queryset() и пагинация
+        """
+        view = self.build_view(viewset_class, user, params)
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        if paginator is None:
+            return queryset
+        if isinstance(paginator, KeysetPagination):
+            return paginator.get_page_queryset(queryset, view.request)
+        # PageNumberPagination: первая страница
+        return queryset[:paginator.get_page_size(view.request)]
+
+    def get_queries(self, user, course):
+        cutoff = timezone.now() - timedelta(days=30)
+        cursor = {'pagination': 'cursor'}
+        return {
+            'courses': self.get_list_query(CourseViewSet, user),
+            'courses_cursor': self.get_list_query(CourseViewSet, user, cursor),
+            'lessons': self.get_list_query(LessonViewSet, user),
+            'lessons_cursor': self.get_list_query(LessonViewSet, user, cursor),
+            # CourseViewSet.lessons: уроки курса
+            'course_lessons': course.lessons.all(),
+            'subscriptions': self.get_list_query(CourseSubscriptionViewSet, user),
+            'subscriptions_cursor': self.get_list_query(CourseSubscriptionViewSet, user, cursor),
+            # send_course_update_email: подписчики курса
+            'course_subscribers': CourseSubscription.objects.filter(course_id=course.pk, is_active=True),
+            'payments': self.get_list_query(PaymentViewSet, user),
+            'payments_cursor': self.get_list_query(PaymentViewSet, user, cursor),
+            'payment_sessions': self.get_list_query(PaymentSessionViewSet, user),
+            # reconcile_payment_sessions: незавершенные сессии пачками по id
+            'pending_sessions': PaymentSession.objects.filter(
+                status__in=PENDING_STATUSES, created_at__lt=timezone.now(), id__gt=0
+            ).order_by('id')[:100],
+            # lms.prices.get_active_prices: активные цены курсов при промахе кэша
+            'active_prices': StripePrice.objects.filter(
+                product__course_id__in=[course.pk], is_active=True, sync_status=STRIPE_SYNC_SYNCED
+            ).order_by(),
+            # deactivate_inactive_users: давно не заходившие пользователи
+            'inactive_users': User.objects.filter(is_active=True).filter(
+                models.Q(last_login__lt=cutoff) | models.Q(last_login__isnull=True)
+            ),
+        }
+
+    def handle(self, *args, **options):
+        failed = []
+        with transaction.atomic():
+            if options['no_seed']:
+                # Модераторы видят все записи, поэтому проверяются запросы обычного пользователя
+                user = User.objects.exclude(groups__name=MODERATORS_GROUP).order_by('pk').first() or User(pk=0)
+                course = Course.objects.order_by('pk').first() or Course(pk=0)
+            else:
+                user, course = self.seed(options['users'])
+            with connection.cursor() as cursor:
+                for model in ANALYZE_MODELS:
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+            for name, queryset in self.get_queries(user, course).items():
+                plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+                nodes = list(collect_nodes(plan))
+                used = {node['Index Name'] for node in nodes if 'Index Name' in node}
+                seq_scans = sorted({node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan'})
+                expected = EXPECTED_INDEXES[name]
+                description = f'{name}: {", ".join(sorted(used)) or "без индексов"}'
+                if seq_scans:
+                    description += f'; Seq Scan: {", ".join(seq_scans)}'
+                if seq_scans or not used.intersection(expected):
+                    failed.append(name)
+                    self.stdout.write(self.style.ERROR(f'{description} (ожидается {" или ".join(expected)})'))
+                else:
+                    self.stdout.write(description)
+            # Тестовые данные и обновленная статистика не сохраняются
+            transaction.set_rollback(True)
+
+        if failed:
+            raise CommandError(f'Запросы без ожидаемых индексов: {", ".join(failed)}')
+        self.stdout.write(self.style.SUCCESS('Все запросы используют ожидаемые индексы'))
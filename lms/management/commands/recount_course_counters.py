@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from lms.counters import recount_course_counters
+from lms.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики уроков и подписчиков курсов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество курсов в одном UPDATE (по умолчанию 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        
+        # Курсы обрабатываются пачками по id, чтобы не держать блокировки на всей таблице
+        while True:
+            ids = list(
+                Course.objects.filter(id__gt=last_id)
+                .order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += recount_course_counters(Course.objects.filter(id__in=ids))
+            last_id = ids[-1]
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитаны счетчики {total} курсов')
+        )
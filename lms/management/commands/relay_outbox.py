@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from lms.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = 'Отправляет задачи из outbox в брокер Celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Количество событий в одной пачке (по умолчанию 100)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.5,
+            help='Пауза в секундах, когда outbox пуст (по умолчанию 0.5)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Отправить накопленные события и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        try:
+            while True:
+                sent = relay_outbox(batch_size)
+                total += sent
+                if sent < batch_size:
+                    # Outbox разобран полностью или брокер недоступен
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Отправлено событий: {total}')
+        )
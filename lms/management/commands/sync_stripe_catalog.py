@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lms.models import StripePrice
+from lms.stripe_catalog import sync_stripe_catalog
+
+
+class Command(BaseCommand):
+    help = 'Создает в Stripe продукты и цены для всех курсов без продукта'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--amount',
+            type=Decimal,
+            required=True,
+            help='Цена курса'
+        )
+        parser.add_argument(
+            '--currency',
+            choices=[code for code, _ in StripePrice.CURRENCY_CHOICES],
+            default='usd',
+            help='Валюта цены (по умолчанию usd)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.STRIPE_CATALOG_SYNC_WORKERS,
+            help=f'Количество параллельных запросов к Stripe (по умолчанию {settings.STRIPE_CATALOG_SYNC_WORKERS})'
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            default=settings.STRIPE_CATALOG_SYNC_RATE_LIMIT,
+            help=(
+                'Максимум запросов к Stripe в секунду, 0 - без ограничения '
+                f'(по умолчанию {settings.STRIPE_CATALOG_SYNC_RATE_LIMIT:g})'
+            )
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.STRIPE_CATALOG_SYNC_BATCH_SIZE,
+            help=f'Количество курсов в одной пачке (по умолчанию {settings.STRIPE_CATALOG_SYNC_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--celery',
+            action='store_true',
+            help='Поставить синхронизацию в очередь Celery вместо выполнения в этом процессе'
+        )
+
+    def handle(self, *args, **options):
+        if options['amount'] <= 0:
+            raise CommandError('Цена должна быть больше нуля')
+        if options['celery']:
+            from lms.tasks import sync_stripe_catalog as sync_stripe_catalog_task
+            result = sync_stripe_catalog_task.delay(str(options['amount']), options['currency'])
+            self.stdout.write(self.style.SUCCESS(f'Синхронизация поставлена в очередь: {result.id}'))
+            return
+
+        stats = sync_stripe_catalog(
+            options['amount'],
+            options['currency'],
+            workers=options['workers'],
+            rate_limit=options['rate_limit'],
+            batch_size=options['batch_size']
+        )
+        message = (
+            f"Курсов добавлено: {stats['courses']}, создано продуктов: {stats['products']}, "
+            f"цен: {stats['prices']}, ошибок: {stats['failed']}, "
+            f"запросов к Stripe: {stats['api_calls']} ({stats['per_second']}/с)"
+        )
+        if stats['interrupted']:
+            raise CommandError(f'Stripe недоступен, запустите команду повторно. {message}')
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Course = apps.get_model('lms', 'Course')
+    Lesson = apps.get_model('lms', 'Lesson')
+    CourseSubscription = apps.get_model('lms', 'CourseSubscription')
+    lessons = (
+        Lesson.objects.filter(course=OuterRef('pk'))
+        .order_by().values('course').annotate(total=Count('id')).values('total')
+    )
+    subscribers = (
+        CourseSubscription.objects.filter(course=OuterRef('pk'), is_active=True)
+        .order_by().values('course').annotate(total=Count('id')).values('total')
+    )
+    Course.objects.update(
+        lessons_count=Coalesce(Subquery(lessons), Value(0)),
+        active_subscribers_count=Coalesce(Subquery(subscribers), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0003_stripe_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='active_subscribers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='lessons_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество уроков'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
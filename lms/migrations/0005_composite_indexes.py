@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:03
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицы
+    atomic = False
+
+    dependencies = [
+        ('lms', '0004_course_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='course',
+            index=models.Index(fields=['owner', '-created_at'], name='lms_course_owner_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='coursesubscription',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['course'], name='lms_sub_course_active_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='coursesubscription',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', '-created_at'], name='lms_sub_user_active_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='lesson',
+            index=models.Index(fields=['course', 'created_at'], name='lms_lesson_course_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='paymentsession',
+            index=models.Index(fields=['user', '-created_at'], name='lms_session_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0005_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursesubscription',
+            name='delivery_mode',
+            field=models.CharField(choices=[('immediate', 'Сразу'), ('daily', 'Ежедневный дайджест'), ('weekly', 'Еженедельный дайджест')], db_default='immediate', default='immediate', max_length=10, verbose_name='Способ уведомления'),
+        ),
+        migrations.AddField(
+            model_name='coursesubscription',
+            name='last_digest_sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата последнего дайджеста'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0007_outbox_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='ID события в Stripe')),
+                ('type', models.CharField(max_length=100, verbose_name='Тип события')),
+                ('payload', models.JSONField(verbose_name='Данные события')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки')),
+            ],
+            options={
+                'verbose_name': 'Событие Stripe',
+                'verbose_name_plural': 'События Stripe',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:25
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индекс строится без блокировки записи в таблицу
+    atomic = False
+
+    dependencies = [
+        ('lms', '0008_stripe_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='paymentsession',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'unpaid'])), fields=['id'], name='lms_session_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0009_payment_session_pending_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentsession',
+            name='checkout_url',
+            field=models.URLField(blank=True, max_length=2048, verbose_name='Ссылка на оплату'),
+        ),
+        migrations.AddField(
+            model_name='paymentsession',
+            name='error',
+            field=models.TextField(blank=True, verbose_name='Ошибка'),
+        ),
+        migrations.AddField(
+            model_name='stripeprice',
+            name='sync_error',
+            field=models.TextField(blank=True, verbose_name='Ошибка синхронизации'),
+        ),
+        migrations.AddField(
+            model_name='stripeprice',
+            name='sync_status',
+            field=models.CharField(choices=[('pending', 'Создается в Stripe'), ('synced', 'Создан в Stripe'), ('failed', 'Ошибка создания в Stripe')], default='synced', max_length=20, verbose_name='Синхронизация со Stripe'),
+        ),
+        migrations.AddField(
+            model_name='stripeproduct',
+            name='sync_error',
+            field=models.TextField(blank=True, verbose_name='Ошибка синхронизации'),
+        ),
+        migrations.AddField(
+            model_name='stripeproduct',
+            name='sync_status',
+            field=models.CharField(choices=[('pending', 'Создается в Stripe'), ('synced', 'Создан в Stripe'), ('failed', 'Ошибка создания в Stripe')], default='synced', max_length=20, verbose_name='Синхронизация со Stripe'),
+        ),
+        migrations.AlterField(
+            model_name='paymentsession',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='ID сессии в Stripe'),
+        ),
+        migrations.AlterField(
+            model_name='stripeprice',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='ID цены в Stripe'),
+        ),
+        migrations.AlterField(
+            model_name='stripeproduct',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='ID продукта в Stripe'),
+        ),
+    ]
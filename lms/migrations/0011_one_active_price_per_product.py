@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:40
+
+from django.db import migrations, models
+from django.db.models import Case, Exists, IntegerField, OuterRef, Subquery, Value, When
+
+
+def deactivate_duplicate_prices(apps, schema_editor):
+    """
+    Оставляет у каждого продукта одну активную цену: самую новую из созданных
+    в Stripe (если таких нет - самую новую), остальные деактивирует
+    """
+    StripePrice = apps.get_model('lms', 'StripePrice')
+    active = StripePrice.objects.filter(is_active=True)
+    keep = (
+        active.filter(product=OuterRef('product'))
+        .annotate(synced=Case(When(sync_status='synced', then=Value(1)), default=Value(0), output_field=IntegerField()))
+        .order_by('-synced', '-created_at', '-id')
+        .values('id')[:1]
+    )
+    duplicates = active.filter(
+        Exists(active.filter(product=OuterRef('product')).exclude(id=OuterRef('id')))
+    ).exclude(id=Subquery(keep))
+    duplicates.update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0010_async_stripe_objects'),
+    ]
+
+    operations = [
+        migrations.RunPython(deactivate_duplicate_prices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='stripeprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('product',), name='lms_price_one_active_per_product'),
+        ),
+    ]
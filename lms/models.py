@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import connection, models
 from django.core.exceptions import ValidationError
 from users.models import User
 
@@ -10,11 +10,17 @@ class Course(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Владелец')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    # Денормализованные счетчики, см. lms.counters и команду recount_course_counters
+    lessons_count = models.PositiveIntegerField(default=0, verbose_name='Количество уроков')
+    active_subscribers_count = models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков')
     
     class Meta:
         verbose_name = 'Курс'
         verbose_name_plural = 'Курсы'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['owner', '-created_at'], name='lms_course_owner_created_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -34,25 +40,128 @@ class Lesson(models.Model):
         verbose_name = 'Урок'
         verbose_name_plural = 'Уроки'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['course', 'created_at'], name='lms_lesson_course_created_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
 
+class CourseSubscriptionManager(models.Manager):
+    """
+    Подписка и отписка одним SQL-запросом на любое количество курсов
+    """
+    
+    def subscribe(self, user, course_ids):
+        """
+        Подписывает пользователя на курсы через INSERT ... ON CONFLICT.
+        Несуществующие и собственные курсы пропускаются, активные подписки
+        не меняются, неактивные восстанавливаются.
+        Возвращает список пар (подписка, создана ли).
+        """
+        table = self.model._meta.db_table
+        course_table = Course._meta.db_table
+        # Счетчик подписчиков курса обновляется в том же запросе
+        sql = f'''
+            WITH upserted AS (
+                INSERT INTO {table} (user_id, course_id, is_active, created_at)
+                SELECT %s, course.id, TRUE, NOW()
+                FROM {course_table} course
+                WHERE course.id = ANY(%s) AND course.owner_id <> %s
+                ON CONFLICT (user_id, course_id) DO UPDATE SET is_active = TRUE
+                WHERE {table}.is_active = FALSE
+                RETURNING id, course_id, created_at, delivery_mode, last_digest_sent_at, (xmax = 0) AS created
+            ), counted AS (
+                UPDATE {course_table} course
+                SET active_subscribers_count = course.active_subscribers_count + 1
+                FROM upserted WHERE course.id = upserted.course_id
+            )
+            SELECT id, course_id, created_at, delivery_mode, last_digest_sent_at, created FROM upserted
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, list(course_ids), user.pk])
+            rows = cursor.fetchall()
+        # Значения в порядке полей модели
+        field_names = ['id', 'user_id', 'course_id', 'created_at', 'is_active', 'delivery_mode', 'last_digest_sent_at']
+        return [
+            (
+                self.model.from_db(
+                    self.db, field_names,
+                    [pk, user.pk, course_id, created_at, True, delivery_mode, last_digest_sent_at]
+                ),
+                created
+            )
+            for pk, course_id, created_at, delivery_mode, last_digest_sent_at, created in rows
+        ]
+    
+    def unsubscribe(self, user, course_ids):
+        """
+        Деактивирует активные подписки пользователя на курсы.
+        Возвращает id курсов, от которых пользователь отписался.
+        """
+        course_table = Course._meta.db_table
+        sql = f'''
+            WITH deactivated AS (
+                UPDATE {self.model._meta.db_table} SET is_active = FALSE
+                WHERE user_id = %s AND course_id = ANY(%s) AND is_active
+                RETURNING course_id
+            ), counted AS (
+                UPDATE {course_table} course
+                SET active_subscribers_count = GREATEST(course.active_subscribers_count - 1, 0)
+                FROM deactivated WHERE course.id = deactivated.course_id
+            )
+            SELECT course_id FROM deactivated
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, list(course_ids)])
+            return [course_id for course_id, in cursor.fetchall()]
+
+
 class CourseSubscription(models.Model):
     """
     Модель подписки на обновления курса
     """
+    DELIVERY_IMMEDIATE = 'immediate'
+    DELIVERY_DAILY = 'daily'
+    DELIVERY_WEEKLY = 'weekly'
+    DELIVERY_MODE_CHOICES = [
+        (DELIVERY_IMMEDIATE, 'Сразу'),
+        (DELIVERY_DAILY, 'Ежедневный дайджест'),
+        (DELIVERY_WEEKLY, 'Еженедельный дайджест'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='subscriptions', verbose_name='Курс')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата подписки')
     is_active = models.BooleanField(default=True, verbose_name='Активна')
+    # db_default нужен для INSERT в CourseSubscriptionManager.subscribe
+    delivery_mode = models.CharField(
+        max_length=10,
+        choices=DELIVERY_MODE_CHOICES,
+        default=DELIVERY_IMMEDIATE,
+        db_default=DELIVERY_IMMEDIATE,
+        verbose_name='Способ уведомления'
+    )
+    last_digest_sent_at = models.DateTimeField(blank=True, null=True, verbose_name='Дата последнего дайджеста')
+    
+    objects = CourseSubscriptionManager()
     
     class Meta:
         verbose_name = 'Подписка на курс'
         verbose_name_plural = 'Подписки на курсы'
-        unique_together = ('user', 'course')  # Один пользователь может подписаться на курс только один раз
+        # Один пользователь может подписаться на курс только один раз
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'course'), name='unique_user_course_subscription'),
+        ]
         ordering = ['-created_at']
+        # Запросы почти всегда идут по активным подпискам
+        indexes = [
+            models.Index(fields=['course'], condition=models.Q(is_active=True), name='lms_sub_course_active_idx'),
+            models.Index(
+                fields=['user', '-created_at'], condition=models.Q(is_active=True), name='lms_sub_user_active_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.email} подписан на {self.course.title}"
@@ -63,14 +172,32 @@ class CourseSubscription(models.Model):
             raise ValidationError('Нельзя подписаться на собственный курс')
 
 
+# Состояние синхронизации записи со Stripe: pending - объект еще создается в Stripe задачей Celery
+STRIPE_SYNC_PENDING = 'pending'
+STRIPE_SYNC_SYNCED = 'synced'
+STRIPE_SYNC_FAILED = 'failed'
+STRIPE_SYNC_STATUS_CHOICES = [
+    (STRIPE_SYNC_PENDING, 'Создается в Stripe'),
+    (STRIPE_SYNC_SYNCED, 'Создан в Stripe'),
+    (STRIPE_SYNC_FAILED, 'Ошибка создания в Stripe'),
+]
+
+
 class StripeProduct(models.Model):
     """
     Модель для хранения информации о продуктах Stripe
     """
     course = models.OneToOneField(Course, on_delete=models.CASCADE, related_name='stripe_product', verbose_name='Курс')
-    stripe_product_id = models.CharField(max_length=255, unique=True, verbose_name='ID продукта в Stripe')
+    stripe_product_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True, verbose_name='ID продукта в Stripe'
+    )
     name = models.CharField(max_length=255, verbose_name='Название продукта')
     description = models.TextField(blank=True, verbose_name='Описание продукта')
+    sync_status = models.CharField(
+        max_length=20, choices=STRIPE_SYNC_STATUS_CHOICES, default=STRIPE_SYNC_SYNCED,
+        verbose_name='Синхронизация со Stripe'
+    )
+    sync_error = models.TextField(blank=True, verbose_name='Ошибка синхронизации')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -94,10 +221,17 @@ class StripePrice(models.Model):
     ]
     
     product = models.ForeignKey(StripeProduct, on_delete=models.CASCADE, related_name='prices', verbose_name='Продукт')
-    stripe_price_id = models.CharField(max_length=255, unique=True, verbose_name='ID цены в Stripe')
+    stripe_price_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True, verbose_name='ID цены в Stripe'
+    )
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма')
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='usd', verbose_name='Валюта')
     is_active = models.BooleanField(default=True, verbose_name='Активна')
+    sync_status = models.CharField(
+        max_length=20, choices=STRIPE_SYNC_STATUS_CHOICES, default=STRIPE_SYNC_SYNCED,
+        verbose_name='Синхронизация со Stripe'
+    )
+    sync_error = models.TextField(blank=True, verbose_name='Ошибка синхронизации')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -105,6 +239,12 @@ class StripePrice(models.Model):
         verbose_name = 'Цена Stripe'
         verbose_name_plural = 'Цены Stripe'
         ordering = ['-created_at']
+        constraints = [
+            # У продукта не больше одной активной цены: ее берет оформление оплаты
+            models.UniqueConstraint(
+                fields=['product'], condition=models.Q(is_active=True), name='lms_price_one_active_per_product'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.amount} {self.currency} (Stripe ID: {self.stripe_price_id})"
@@ -116,10 +256,15 @@ class PaymentSession(models.Model):
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='Курс')
-    stripe_session_id = models.CharField(max_length=255, unique=True, verbose_name='ID сессии в Stripe')
+    # Пусто, пока сессия создается в Stripe задачей Celery (статус creating)
+    stripe_session_id = models.CharField(
+        max_length=255, unique=True, null=True, blank=True, verbose_name='ID сессии в Stripe'
+    )
+    checkout_url = models.URLField(max_length=2048, blank=True, verbose_name='Ссылка на оплату')
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Сумма')
     currency = models.CharField(max_length=3, default='usd', verbose_name='Валюта')
     status = models.CharField(max_length=50, default='pending', verbose_name='Статус')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -127,6 +272,54 @@ class PaymentSession(models.Model):
         verbose_name = 'Сессия оплаты'
         verbose_name_plural = 'Сессии оплаты'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='lms_session_user_created_idx'),
+            # Сверка незавершенных сессий в reconcile_payment_sessions
+            models.Index(
+                fields=['id'], condition=models.Q(status__in=['pending', 'unpaid']), name='lms_session_pending_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"Session {self.stripe_session_id} - {self.user.email} - {self.course.title}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Задача Celery, записанная в той же транзакции, что и изменение данных.
+    Отправляется в брокер командой relay_outbox после коммита.
+    """
+    task_name = models.CharField(max_length=255, verbose_name='Задача')
+    args = models.JSONField(default=list, verbose_name='Аргументы')
+    kwargs = models.JSONField(default=dict, verbose_name='Именованные аргументы')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    
+    class Meta:
+        verbose_name = 'Событие outbox'
+        verbose_name_plural = 'События outbox'
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.task_name} {self.args}"
+
+
+class StripeEvent(models.Model):
+    """
+    Событие webhook Stripe. Уникальный event_id защищает от повторной обработки
+    при повторной доставке события.
+    """
+    event_id = models.CharField(max_length=255, unique=True, verbose_name='ID события в Stripe')
+    type = models.CharField(max_length=100, verbose_name='Тип события')
+    payload = models.JSONField(verbose_name='Данные события')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')
+    processed_at = models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки')
+    
+    class Meta:
+        verbose_name = 'Событие Stripe'
+        verbose_name_plural = 'События Stripe'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.type} ({self.event_id})"
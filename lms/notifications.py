@@ -0,0 +1,70 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .tasks import flush_course_updates, send_course_update_email
+
+# Изменения курса, накопленные за окно: 'course' и 'lesson:<id>'
+PENDING_KEY = 'lms:notify:course:{}:pending'
+# Флаг открытого окна: пока он есть, задача отправки уже запланирована
+WINDOW_KEY = 'lms:notify:course:{}:window'
+# Блокировка чтения-изменения накопленных изменений курса
+PENDING_LOCK_KEY = 'lms:notify:course:{}:lock'
+# Накопленные изменения не должны жить вечно, если задача отправки потерялась
+PENDING_TTL = 24 * 60 * 60
+# Блокировка снимается сама, если процесс, захвативший ее, упал
+PENDING_LOCK_TIMEOUT = 5
+
+
+@contextmanager
+def pending_lock(course_id):
+    """Блокировка накопленных изменений курса на общем кэше (cache.add атомарен)"""
+    lock_key = PENDING_LOCK_KEY.format(course_id)
+    while not cache.add(lock_key, 1, PENDING_LOCK_TIMEOUT):
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        cache.delete(lock_key)
+
+
+def notify_course_update(course_id, lesson_ids=()):
+    """
+    Сообщает подписчикам об изменении курса или его уроков.
+    Изменения одного курса за COURSE_UPDATE_DEBOUNCE_SECONDS объединяются
+    в одно письмо со списком всех измененных уроков.
+    """
+    window = settings.COURSE_UPDATE_DEBOUNCE_SECONDS
+    lesson_ids = sorted(set(lesson_ids))
+    if not window:
+        if lesson_ids:
+            send_course_update_email.delay(course_id, 'lessons', lesson_ids)
+        else:
+            send_course_update_email.delay(course_id, 'course', course_id)
+        return
+
+    members = [f'lesson:{lesson_id}' for lesson_id in lesson_ids] or ['course']
+    pending_key = PENDING_KEY.format(course_id)
+    with pending_lock(course_id):
+        pending = cache.get(pending_key, set())
+        cache.set(pending_key, pending | set(members), PENDING_TTL)
+    if cache.add(WINDOW_KEY.format(course_id), 1, window):
+        # Первое изменение в окне планирует отправку на его конец
+        flush_course_updates.apply_async((course_id,), countdown=window)
+
+
+def take_pending_updates(course_id):
+    """
+    Забирает накопленные изменения курса. Возвращает пару
+    (изменен ли сам курс, список id измененных уроков).
+    """
+    pending_key = PENDING_KEY.format(course_id)
+    # Сначала закрываем окно: изменения, пришедшие после этого, запланируют новую отправку
+    cache.delete(WINDOW_KEY.format(course_id))
+    with pending_lock(course_id):
+        members = cache.get(pending_key, set())
+        cache.delete(pending_key)
+    lesson_ids = sorted(int(member.split(':')[1]) for member in members if member.startswith('lesson:'))
+    return 'course' in members, lesson_ids
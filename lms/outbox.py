@@ -0,0 +1,43 @@
+import logging
+
+from django.db import transaction
+
+from learning_platform.celery import app
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task_name, *args, **kwargs):
+    """
+    Записывает задачу Celery в outbox. Вызывается внутри transaction.atomic
+    вместе с изменением данных: задача уйдет в брокер, только если транзакция
+    зафиксирована, и воркер увидит закоммиченные данные.
+    """
+    return OutboxEvent.objects.create(task_name=task_name, args=list(args), kwargs=kwargs)
+
+
+def relay_outbox(batch_size=100):
+    """
+    Отправляет в брокер пачку событий outbox через одно соединение и удаляет
+    отправленные. Параллельные диспетчеры не мешают друг другу (SKIP LOCKED).
+    Доставка "хотя бы один раз": если коммит не удался после публикации,
+    событие будет отправлено повторно. Возвращает количество отправленных событий.
+    """
+    with transaction.atomic():
+        events = list(OutboxEvent.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        sent_ids = []
+        with app.producer_or_acquire() as producer:
+            for event in events:
+                try:
+                    app.send_task(event.task_name, args=event.args, kwargs=event.kwargs, producer=producer)
+                except Exception as e:
+                    # Брокер недоступен: остальные события пачки отправим в следующий раз
+                    logger.exception('Не удалось отправить событие outbox %s', event.id)
+                    OutboxEvent.objects.filter(id=event.id).update(
+                        attempts=event.attempts + 1, last_error=str(e)
+                    )
+                    break
+                sent_ids.append(event.id)
+        OutboxEvent.objects.filter(id__in=sent_ids).delete()
+    return len(sent_ids)
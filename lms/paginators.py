@@ -1,4 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CoursePagination(PageNumberPagination):
@@ -26,3 +35,163 @@ class SubscriptionPagination(PageNumberPagination):
     page_size = 20  # Количество подписок на странице
     page_size_query_param = 'page_size'  # Параметр для изменения размера страницы
     max_page_size = 100  # Максимальный размер страницы
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по паре (поле даты, id).
+
+    Следующая страница выбирается условием по значениям последней записи,
+    поэтому не нужны ни OFFSET, ни COUNT(*). Общее количество записей
+    возвращается только по запросу: ?count=exact или ?count=estimate
+    (оценка планировщика PostgreSQL).
+    """
+    ordering_field = 'created_at'
+    descending = True
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = self.get_count(queryset, request)
+        results = list(self.get_page_queryset(queryset, request))
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_queryset(self, queryset, request):
+        """Запрос страницы: сортировка с id для однозначности, условие курсора и лимит"""
+        prefix = '-' if self.descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.ordering_field}', f'{prefix}id')
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, pk = cursor
+            lookup = 'lt' if self.descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.ordering_field}__{lookup}': value})
+                | Q(**{self.ordering_field: value, f'id__{lookup}': pk})
+            )
+
+        # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        return queryset[:self.get_page_size(request) + 1]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        return None
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            value = parse_datetime(value)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def encode_cursor(self, instance):
+        value = getattr(instance, self.ordering_field)
+        data = json.dumps([value.isoformat(), instance.pk])
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {
+                    'type': 'integer',
+                    'description': 'Только при ?count=exact или ?count=estimate',
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+
+class CourseKeysetPagination(KeysetPagination):
+    """
+    Курсорная пагинация для курсов
+    """
+    page_size = CoursePagination.page_size
+    max_page_size = CoursePagination.max_page_size
+
+
+class LessonKeysetPagination(KeysetPagination):
+    """
+    Курсорная пагинация для уроков
+    """
+    descending = False  # Уроки идут в порядке создания
+    page_size = LessonPagination.page_size
+    max_page_size = LessonPagination.max_page_size
+
+
+class SubscriptionKeysetPagination(KeysetPagination):
+    """
+    Курсорная пагинация для подписок
+    """
+    page_size = SubscriptionPagination.page_size
+    max_page_size = SubscriptionPagination.max_page_size
+
+
+class KeysetPaginationMixin:
+    """
+    Позволяет включить курсорную пагинацию параметром ?pagination=cursor,
+    по умолчанию используется pagination_class вьюсета
+    """
+    keyset_pagination_class = None
+    pagination_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            use_keyset = (
+                self.keyset_pagination_class is not None
+                and self.request is not None
+                and self.request.query_params.get(self.pagination_query_param) == 'cursor'
+            )
+            if use_keyset:
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = None if self.pagination_class is None else self.pagination_class()
+        return self._paginator
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import bump_course_versions
+from .models import StripePrice, STRIPE_SYNC_SYNCED
+
+ACTIVE_PRICE_CACHE_KEY = 'lms:stripe:active_price:{}'
+# Значение в кэше для курса без активной цены (None кэш не отличает от промаха)
+NO_PRICE = {}
+
+
+def get_active_prices(course_ids) -> dict:
+    """
+    Активные цены курсов: {id курса: {'id', 'stripe_price_id', 'amount', 'currency'} или None}.
+    Цены берутся из кэша одним запросом, промахи догружаются одним запросом к БД
+    по частичному уникальному индексу (product WHERE is_active).
+    """
+    keys = {ACTIVE_PRICE_CACHE_KEY.format(course_id): course_id for course_id in set(course_ids)}
+    cached = cache.get_many(keys)
+    prices = {keys[key]: value or None for key, value in cached.items()}
+    missing = [course_id for key, course_id in keys.items() if key not in cached]
+    if missing:
+        rows = StripePrice.objects.filter(
+            product__course_id__in=missing, is_active=True, sync_status=STRIPE_SYNC_SYNCED
+        ).order_by().values_list('product__course_id', 'id', 'stripe_price_id', 'amount', 'currency')
+        found = {
+            course_id: {'id': price_id, 'stripe_price_id': stripe_price_id, 'amount': amount, 'currency': currency}
+            for course_id, price_id, stripe_price_id, amount, currency in rows
+        }
+        cache.set_many(
+            {ACTIVE_PRICE_CACHE_KEY.format(course_id): found.get(course_id, NO_PRICE) for course_id in missing},
+            settings.STRIPE_ACTIVE_PRICE_CACHE_TIMEOUT
+        )
+        prices.update({course_id: found.get(course_id) for course_id in missing})
+    return prices
+
+
+def get_active_price(course_id):
+    """Активная цена курса (см. get_active_prices) или None"""
+    return get_active_prices([course_id])[course_id]
+
+
+def invalidate_active_prices(*course_ids):
+    """
+    Сбрасывает закэшированные активные цены курсов и ответы API по этим курсам.
+    Вызывается после создания, активации или деактивации цены.
+    """
+    cache.delete_many([ACTIVE_PRICE_CACHE_KEY.format(course_id) for course_id in set(course_ids)])
+    bump_course_versions(*course_ids)
@@ -1,29 +1,44 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Course, Lesson, CourseSubscription, StripeProduct, StripePrice, PaymentSession
 from .validators import validate_youtube_url, YouTubeURLValidator
+from .fieldsets import SparseFieldsetsMixin
+from .prices import get_active_price, get_active_prices
 
 
-class LessonListSerializer(serializers.ModelSerializer):
+class LessonListSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     
     class Meta:
         model = Lesson
         fields = ('id', 'title', 'preview', 'course', 'created_at')
 
 
-class CourseSerializer(serializers.ModelSerializer):
-    lessons_count = serializers.SerializerMethodField()
+class CourseListSerializer(serializers.ListSerializer):
+    """Цены всех курсов страницы загружаются одним обращением к кэшу (lms.prices)"""
+    
+    def to_representation(self, data):
+        courses = list(data.all() if hasattr(data, 'all') else data)
+        if 'price' in self.child.fields:
+            self.child.active_prices = get_active_prices([course.id for course in courses])
+        return super().to_representation(courses)
+
+
+class CourseSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     lessons = LessonListSerializer(many=True, read_only=True)
     is_subscribed = serializers.SerializerMethodField()
+    price = serializers.SerializerMethodField()
     
     class Meta:
         model = Course
         fields = '__all__'
-        read_only_fields = ('owner', 'created_at', 'updated_at')
-    
-    def get_lessons_count(self, obj):
-        return obj.lessons.count()
+        # Счетчики поддерживаются в lms.counters, через API не меняются
+        read_only_fields = ('owner', 'created_at', 'updated_at', 'lessons_count', 'active_subscribers_count')
+        expandable_fields = ('lessons',)  # В списке курсов только по ?expand=lessons
+        list_serializer_class = CourseListSerializer
     
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return CourseSubscription.objects.filter(
@@ -32,9 +47,54 @@ class CourseSerializer(serializers.ModelSerializer):
                 is_active=True
             ).exists()
         return False
-
-
-class LessonSerializer(serializers.ModelSerializer):
+    
+    def get_price(self, obj):
+        active_prices = getattr(self, 'active_prices', None)
+        if active_prices is not None and obj.id in active_prices:
+            price = active_prices[obj.id]
+        else:
+            price = get_active_price(obj.id)
+        if price is None:
+            return None
+        return {'amount': str(price['amount']), 'currency': price['currency']}
+
+
+class LessonBulkListSerializer(serializers.ListSerializer):
+    """
+    Массовое создание (bulk_create) и обновление (bulk_update) уроков.
+    Для обновления instance - словарь {id: урок}, каждый элемент данных
+    должен содержать id урока.
+    """
+    
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            try:
+                self.child.instance = self.instance[int(data['id'])]
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError({'id': 'Урок не найден'})
+            self.child.initial_data = data
+        return super().run_child_validation(data)
+    
+    def create(self, validated_data):
+        return Lesson.objects.bulk_create([Lesson(**attrs) for attrs in validated_data])
+    
+    def update(self, instance, validated_data):
+        # bulk_update не заполняет auto_now, поэтому updated_at выставляем сами
+        now = timezone.now()
+        update_fields = {'updated_at'}
+        lessons = []
+        for item, attrs in zip(self.initial_data, validated_data):
+            lesson = instance[int(item['id'])]
+            for attr, value in attrs.items():
+                setattr(lesson, attr, value)
+            lesson.updated_at = now
+            update_fields.update(attrs)
+            lessons.append(lesson)
+        Lesson.objects.bulk_update(lessons, sorted(update_fields))
+        return lessons
+
+
+class LessonSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     video_url = serializers.URLField(validators=[validate_youtube_url])
     
     class Meta:
@@ -42,14 +102,27 @@ class LessonSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('owner', 'created_at', 'updated_at')
         validators = [YouTubeURLValidator(field='video_url')]
+        list_serializer_class = LessonBulkListSerializer
+
+
+class CourseIdsSerializer(serializers.Serializer):
+    """Сериализатор для массовой подписки и отписки"""
+    course_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=100
+    )
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    """Сериализатор для массового удаления"""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=200)
 
 
-class CourseSubscriptionSerializer(serializers.ModelSerializer):
+class CourseSubscriptionSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     
     class Meta:
         model = CourseSubscription
-        fields = ('id', 'course', 'user', 'created_at', 'is_active')
-        read_only_fields = ('user', 'created_at')
+        fields = ('id', 'course', 'user', 'created_at', 'is_active', 'delivery_mode', 'last_digest_sent_at')
+        read_only_fields = ('user', 'created_at', 'last_digest_sent_at')
     
     def create(self, validated_data):
         # Устанавливаем пользователя из контекста запроса
@@ -57,28 +130,37 @@ class CourseSubscriptionSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class StripeProductSerializer(serializers.ModelSerializer):
+class StripeProductSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     
     class Meta:
         model = StripeProduct
-        fields = ('id', 'course', 'stripe_product_id', 'name', 'description', 'created_at', 'updated_at')
-        read_only_fields = ('stripe_product_id', 'created_at', 'updated_at')
+        fields = (
+            'id', 'course', 'stripe_product_id', 'name', 'description', 'sync_status', 'sync_error',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = ('stripe_product_id', 'sync_status', 'sync_error', 'created_at', 'updated_at')
 
 
-class StripePriceSerializer(serializers.ModelSerializer):
+class StripePriceSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     
     class Meta:
         model = StripePrice
-        fields = ('id', 'product', 'stripe_price_id', 'amount', 'currency', 'is_active', 'created_at', 'updated_at')
-        read_only_fields = ('stripe_price_id', 'created_at', 'updated_at')
+        fields = (
+            'id', 'product', 'stripe_price_id', 'amount', 'currency', 'is_active', 'sync_status', 'sync_error',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = ('stripe_price_id', 'sync_status', 'sync_error', 'created_at', 'updated_at')
 
 
-class PaymentSessionSerializer(serializers.ModelSerializer):
+class PaymentSessionSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     
     class Meta:
         model = PaymentSession
-        fields = ('id', 'user', 'course', 'stripe_session_id', 'amount', 'currency', 'status', 'created_at', 'updated_at')
-        read_only_fields = ('user', 'stripe_session_id', 'status', 'created_at', 'updated_at')
+        fields = (
+            'id', 'user', 'course', 'stripe_session_id', 'checkout_url', 'amount', 'currency', 'status', 'error',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = ('user', 'stripe_session_id', 'checkout_url', 'status', 'error', 'created_at', 'updated_at')
 
 
 class CreateProductSerializer(serializers.Serializer):
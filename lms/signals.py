@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import StripePrice, StripeProduct
+from .prices import invalidate_active_prices
+
+
+@receiver(post_save, sender=StripePrice)
+@receiver(post_delete, sender=StripePrice)
+def reset_active_price(sender, instance, **kwargs):
+    # Изменения через queryset.update() сигналов не вызывают,
+    # там invalidate_active_prices вызывается явно (StripeService)
+    if StripePrice.product.is_cached(instance):
+        course_id = instance.product.course_id
+    else:
+        course_id = StripeProduct.objects.filter(pk=instance.product_id).values_list('course_id', flat=True).first()
+    if course_id is not None:
+        invalidate_active_prices(course_id)
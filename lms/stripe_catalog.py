@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Course, StripeProduct, StripePrice, STRIPE_SYNC_PENDING, STRIPE_SYNC_SYNCED
+from .stripe_client import StripeUnavailable
+from .stripe_service import StripeService
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Ограничивает частоту запросов к Stripe: не больше rate запросов в секунду
+    на все потоки вместе. rate = 0 отключает ограничение.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(self._next_at, now) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def create_pending_catalog(amount, currency, batch_size) -> int:
+    """
+    Сохраняет продукт и неактивную цену со статусом синхронизации pending
+    для каждого курса без продукта Stripe. Эти записи и служат контрольной точкой: прерванная
+    синхронизация продолжится с них. Возвращает количество новых продуктов.
+    """
+    created = 0
+    last_id = 0
+    while True:
+        courses = list(
+            Course.objects.filter(stripe_product__isnull=True, id__gt=last_id)
+            .order_by('id').values_list('id', 'title', 'description')[:batch_size]
+        )
+        if not courses:
+            return created
+        last_id = courses[-1][0]
+        with transaction.atomic():
+            # Продукт мог одновременно создаться через API, такой курс пропускаем
+            StripeProduct.objects.bulk_create(
+                [
+                    StripeProduct(course_id=course_id, name=title, description=description,
+                                  sync_status=STRIPE_SYNC_PENDING)
+                    for course_id, title, description in courses
+                ],
+                ignore_conflicts=True
+            )
+            product_ids = list(StripeProduct.objects.filter(
+                course_id__in=[course_id for course_id, _, _ in courses],
+                sync_status=STRIPE_SYNC_PENDING,
+                prices__isnull=True
+            ).values_list('id', flat=True))
+            StripePrice.objects.bulk_create([
+                StripePrice(
+                    product_id=product_id, amount=amount, currency=currency,
+                    is_active=False, sync_status=STRIPE_SYNC_PENDING
+                )
+                for product_id in product_ids
+            ])
+        created += len(product_ids)
+
+
+def sync_stripe_catalog(amount, currency='usd', workers=None, rate_limit=None, batch_size=None) -> dict:
+    """
+    Создает в Stripe продукты и цены (amount, currency) для всех курсов без продукта.
+    Курсы сначала сохраняются как pending-записи, затем отправляются в Stripe
+    пачками в workers потоков с общим лимитом rate_limit запросов в секунду.
+    Ключи идемпотентности привязаны к записям, поэтому повторный запуск после
+    сбоя продолжает с незавершенных записей и не создает дублей в Stripe.
+    Возвращает статистику запуска: courses - курсов поставлено в очередь,
+    products/prices - создано в Stripe, failed - отклонено Stripe.
+    """
+    workers = workers or settings.STRIPE_CATALOG_SYNC_WORKERS
+    rate_limit = settings.STRIPE_CATALOG_SYNC_RATE_LIMIT if rate_limit is None else rate_limit
+    batch_size = batch_size or settings.STRIPE_CATALOG_SYNC_BATCH_SIZE
+
+    started = time.monotonic()
+    stats = {
+        'courses': create_pending_catalog(amount, currency, batch_size),
+        'products': 0, 'prices': 0, 'failed': 0, 'api_calls': 0
+    }
+    limiter = RateLimiter(rate_limit)
+    unavailable = threading.Event()
+    stats_lock = threading.Lock()
+
+    def count(key):
+        with stats_lock:
+            stats[key] += 1
+
+    def push(model_key, push_method, pk):
+        limiter.acquire()
+        if unavailable.is_set():
+            return False
+        count('api_calls')
+        try:
+            obj = push_method(pk)
+        except StripeUnavailable:
+            unavailable.set()
+            return False
+        except stripe.error.StripeError:
+            logger.exception('Stripe отклонил создание объекта %s %s', model_key, pk)
+            count('failed')
+            return False
+        if obj.sync_status != STRIPE_SYNC_SYNCED:
+            count('failed')
+            return False
+        count(model_key)
+        return True
+
+    def sync_product(item):
+        try:
+            sync_product_prices(*item)
+        finally:
+            # У каждого потока свое соединение с БД, закрываем его сразу
+            connection.close()
+
+    def sync_product_prices(product_pk, product_pending, price_pks):
+        if product_pending and not push('products', StripeService.push_product, product_pk):
+            if not unavailable.is_set():
+                # Цены продукта, который Stripe отклонил, создать уже не получится
+                for price_pk in price_pks:
+                    StripeService.mark_sync_failed(StripePrice, price_pk, 'Продукт не удалось создать в Stripe')
+                    count('failed')
+            return
+        for price_pk in price_pks:
+            if not push('prices', StripeService.push_price, price_pk) and unavailable.is_set():
+                return
+
+    pending = StripeProduct.objects.filter(
+        Q(sync_status=STRIPE_SYNC_PENDING) | Q(prices__sync_status=STRIPE_SYNC_PENDING)
+    ).distinct()
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while not unavailable.is_set():
+            products = list(
+                pending.filter(id__gt=last_id).order_by('id').values_list('id', 'sync_status')[:batch_size]
+            )
+            if not products:
+                break
+            last_id = products[-1][0]
+            price_pks = defaultdict(list)
+            for price_pk, product_pk in StripePrice.objects.filter(
+                product_id__in=[product_pk for product_pk, _ in products], sync_status=STRIPE_SYNC_PENDING
+            ).order_by('id').values_list('id', 'product_id'):
+                price_pks[product_pk].append(price_pk)
+            list(executor.map(sync_product, [
+                (product_pk, sync_status == STRIPE_SYNC_PENDING, price_pks[product_pk])
+                for product_pk, sync_status in products
+            ]))
+            logger.info('Синхронизация каталога Stripe: продукты до id %s, %s', last_id, stats)
+
+    elapsed = time.monotonic() - started
+    stats['interrupted'] = unavailable.is_set()
+    stats['seconds'] = round(elapsed, 2)
+    stats['per_second'] = round(stats['api_calls'] / elapsed, 1) if elapsed else 0
+    if unavailable.is_set():
+        logger.warning('Синхронизация каталога Stripe прервана: Stripe недоступен, повторите запуск позже')
+    logger.info('Синхронизация каталога Stripe завершена: %s', stats)
+    return stats
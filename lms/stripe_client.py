@@ -0,0 +1,108 @@
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+class StripeUnavailable(Exception):
+    """Stripe недоступен: ошибка соединения, таймаут или открытый circuit breaker"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для вызовов внешнего API (в пределах процесса).
+    После failure_threshold сбоев подряд вызовы сразу отклоняются
+    в течение reset_timeout секунд, затем пропускается один пробный вызов.
+    """
+    
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+    
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+    
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_in_progress:
+                raise StripeUnavailable('Stripe временно недоступен, повторите попытку позже')
+            # Полуоткрытое состояние: пропускаем один пробный вызов
+            self._trial_in_progress = True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+# Сбои, говорящие о деградации Stripe, а не об ошибке в запросе
+UPSTREAM_ERRORS = (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError)
+
+breaker = CircuitBreaker(
+    failure_threshold=settings.STRIPE_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.STRIPE_CIRCUIT_RESET_TIMEOUT,
+)
+
+
+def configure_stripe():
+    """
+    Настраивает библиотеку stripe: общий пул keep-alive соединений, таймауты
+    (connect, read), ограниченное число повторов с экспоненциальной задержкой
+    и адрес API (STRIPE_API_BASE позволяет подключить mock-сервер).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = stripe.RequestsClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+        session=session,
+    )
+
+
+def stripe_call(method, *args, **kwargs):
+    """
+    Вызывает метод Stripe API через circuit breaker.
+    Сбои соединения и ошибки на стороне Stripe превращаются в StripeUnavailable.
+    """
+    breaker.before_call()
+    try:
+        result = method(*args, **kwargs)
+    except UPSTREAM_ERRORS as e:
+        breaker.record_failure()
+        raise StripeUnavailable(f'Stripe недоступен: {e.user_message or e}') from e
+    except Exception:
+        # Ошибки запроса (неверные параметры и т.п.) не говорят о деградации Stripe
+        breaker.record_success()
+        raise
+    breaker.record_success()
+    return result
+
+
+configure_stripe()
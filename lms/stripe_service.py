@@ -1,20 +1,48 @@
+import hashlib
+import time
+
 import stripe
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from .models import Course, StripeProduct, StripePrice, PaymentSession
+from django.db import transaction
+from django.utils import timezone
+from .models import (
+    Course, StripeProduct, StripePrice, PaymentSession,
+    STRIPE_SYNC_PENDING, STRIPE_SYNC_SYNCED, STRIPE_SYNC_FAILED
+)
+from .outbox import enqueue
+from .prices import get_active_price, invalidate_active_prices
+# Импорт настраивает клиент stripe: пул соединений, таймауты, повторы
+from .stripe_client import StripeUnavailable, stripe_call
+
+# Статусы сессии оплаты, которые больше не меняются
+# (failed - асинхронная оплата отклонена или сессию не удалось создать в Stripe)
+TERMINAL_STATUSES = ('paid', 'expired', 'failed')
+# Сессия оплаты сохранена, но еще создается в Stripe задачей Celery
+CHECKOUT_CREATING = 'creating'
+# Статусы незавершенной оплаты, которые сверяются с Stripe
+PENDING_STATUSES = ('pending', 'unpaid')
+SESSION_STATUS_CACHE_KEY = 'lms:stripe:session_status:{}'
+SESSION_STATUS_LOCK_KEY = 'lms:stripe:session_status:{}:lock'
+CHECKOUT_IDEMPOTENCY_CACHE_KEY = 'lms:stripe:checkout:{}:{}'
+CHECKOUT_IDEMPOTENCY_LOCK_KEY = 'lms:stripe:checkout:{}:{}:lock'
+
+
+class IdempotencyKeyInUse(Exception):
+    """Запрос с тем же ключом идемпотентности еще выполняется"""
 
-# Настройка Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+class StripeObjectNotReady(Exception):
+    """Связанный объект еще не создан в Stripe, задачу нужно повторить позже"""
 
 
 class StripeService:
     """Сервис для работы с Stripe API"""
     
     @staticmethod
-    def create_product(course_id, name, description=""):
-        """
-        Создает продукт в Stripe и сохраняет его в базе данных
-        """
+    def _get_course_for_product(course_id):
+        """Курс, для которого можно создать продукт"""
         try:
             course = Course.objects.get(id=course_id)
         except Course.DoesNotExist:
@@ -23,15 +51,30 @@ class StripeService:
         # Проверяем, не создан ли уже продукт для этого курса
         if hasattr(course, 'stripe_product'):
             raise ValidationError("Продукт для этого курса уже создан")
-        
-        # Создаем продукт в Stripe
-        stripe_product = stripe.Product.create(
-            name=name,
-            description=description,
-            metadata={
+        return course
+    
+    @staticmethod
+    def _product_params(course_id, name, description):
+        """Параметры создания продукта в Stripe"""
+        return {
+            'name': name,
+            'description': description,
+            'metadata': {
                 'course_id': course_id,
                 'type': 'course'
             }
+        }
+    
+    @staticmethod
+    def create_product(course_id, name, description=""):
+        """
+        Создает продукт в Stripe и сохраняет его в базе данных
+        """
+        course = StripeService._get_course_for_product(course_id)
+        
+        # Создаем продукт в Stripe
+        stripe_product = stripe_call(
+            stripe.Product.create, **StripeService._product_params(course_id, name, description)
         )
         
         # Сохраняем продукт в базе данных
@@ -45,87 +88,229 @@ class StripeService:
         return product
     
     @staticmethod
-    def create_price(product_id, amount, currency='usd'):
+    def create_product_async(course_id, name, description=""):
         """
-        Создает цену в Stripe и сохраняет ее в базе данных
+        Сохраняет продукт со статусом синхронизации pending и ставит
+        его создание в Stripe в очередь (задача push_stripe_product)
+        """
+        course = StripeService._get_course_for_product(course_id)
+        with transaction.atomic():
+            product = StripeProduct.objects.create(
+                course=course,
+                name=name,
+                description=description,
+                sync_status=STRIPE_SYNC_PENDING
+            )
+            enqueue('lms.tasks.push_stripe_product', product.pk)
+        return product
+    
+    @staticmethod
+    def push_product(product_pk):
+        """
+        Создает в Stripe продукт, сохраненный create_product_async.
+        Ключ идемпотентности привязан к записи, поэтому повтор задачи не создаст дубль
         """
+        product = StripeProduct.objects.get(pk=product_pk)
+        if product.sync_status != STRIPE_SYNC_PENDING:
+            return product
         try:
-            product = StripeProduct.objects.get(id=product_id)
+            stripe_product = stripe_call(
+                stripe.Product.create,
+                idempotency_key=f'lms-product-{product.pk}',
+                **StripeService._product_params(product.course_id, product.name, product.description)
+            )
+        except stripe.error.StripeError as e:
+            StripeService.mark_sync_failed(StripeProduct, product.pk, str(e))
+            raise
+        StripeProduct.objects.filter(pk=product.pk, sync_status=STRIPE_SYNC_PENDING).update(
+            stripe_product_id=stripe_product.id, sync_status=STRIPE_SYNC_SYNCED, sync_error='',
+            updated_at=timezone.now()
+        )
+        product.refresh_from_db()
+        return product
+    
+    @staticmethod
+    def _get_product(product_id):
+        try:
+            return StripeProduct.objects.get(id=product_id)
         except StripeProduct.DoesNotExist:
             raise ValidationError("Продукт не найден")
-        
+    
+    @staticmethod
+    def _price_params(product, amount, currency):
+        """Параметры создания цены в Stripe"""
         # Конвертируем сумму в центы (Stripe работает с центами)
         amount_cents = int(float(amount) * 100)
+        return {
+            'product': product.stripe_product_id,
+            'unit_amount': amount_cents,
+            'currency': currency,
+            'metadata': {
+                'product_id': product.id,
+                'course_id': product.course_id
+            }
+        }
+    
+    @staticmethod
+    def create_price(product_id, amount, currency='usd'):
+        """
+        Создает цену в Stripe и сохраняет ее в базе данных
+        """
+        product = StripeService._get_product(product_id)
+        if product.sync_status != STRIPE_SYNC_SYNCED:
+            raise ValidationError("Продукт еще не создан в Stripe")
         
         # Создаем цену в Stripe
-        stripe_price = stripe.Price.create(
-            product=product.stripe_product_id,
-            unit_amount=amount_cents,
-            currency=currency,
-            metadata={
-                'product_id': product_id,
-                'course_id': product.course.id
-            }
-        )
+        stripe_price = stripe_call(stripe.Price.create, **StripeService._price_params(product, amount, currency))
         
-        # Сохраняем цену в базе данных
-        price = StripePrice.objects.create(
-            product=product,
-            stripe_price_id=stripe_price.id,
-            amount=amount,
-            currency=currency
-        )
+        # Сохраняем цену в базе данных, прежняя активная цена деактивируется
+        with transaction.atomic():
+            StripeService._lock_product(product.pk)
+            product.prices.filter(is_active=True).update(is_active=False, updated_at=timezone.now())
+            price = StripePrice.objects.create(
+                product=product,
+                stripe_price_id=stripe_price.id,
+                amount=amount,
+                currency=currency
+            )
+        invalidate_active_prices(product.course_id)
         
         return price
     
     @staticmethod
-    def create_checkout_session(user, course_id, success_url, cancel_url):
+    def _lock_product(product_pk):
+        """Блокирует продукт: смены его активной цены выполняются по очереди"""
+        StripeProduct.objects.select_for_update().filter(pk=product_pk).values_list('pk', flat=True).get()
+    
+    @staticmethod
+    def create_price_async(product_id, amount, currency='usd'):
         """
-        Создает сессию оплаты в Stripe
+        Сохраняет неактивную цену со статусом синхронизации pending и ставит
+        ее создание в Stripe в очередь (задача push_stripe_price). Продукт при этом
+        может еще создаваться. Активной цена станет после создания в Stripe
         """
+        product = StripeService._get_product(product_id)
+        if product.sync_status == STRIPE_SYNC_FAILED:
+            raise ValidationError("Продукт не удалось создать в Stripe")
+        with transaction.atomic():
+            price = StripePrice.objects.create(
+                product=product,
+                amount=amount,
+                currency=currency,
+                is_active=False,
+                sync_status=STRIPE_SYNC_PENDING
+            )
+            enqueue('lms.tasks.push_stripe_price', price.pk)
+        return price
+    
+    @staticmethod
+    def push_price(price_pk):
+        """
+        Создает в Stripe цену, сохраненную create_price_async, и делает ее
+        активной вместо прежней. Если продукт еще создается, выбрасывает StripeObjectNotReady
+        """
+        price = StripePrice.objects.select_related('product').get(pk=price_pk)
+        if price.sync_status != STRIPE_SYNC_PENDING:
+            return price
+        if price.product.sync_status == STRIPE_SYNC_PENDING:
+            raise StripeObjectNotReady(f'Продукт {price.product_id} еще создается в Stripe')
+        if price.product.sync_status == STRIPE_SYNC_FAILED:
+            StripeService.mark_sync_failed(StripePrice, price.pk, 'Продукт не удалось создать в Stripe')
+            return price
         try:
-            course = Course.objects.get(id=course_id)
-        except Course.DoesNotExist:
+            stripe_price = stripe_call(
+                stripe.Price.create,
+                idempotency_key=f'lms-price-{price.pk}',
+                **StripeService._price_params(price.product, price.amount, price.currency)
+            )
+        except stripe.error.StripeError as e:
+            StripeService.mark_sync_failed(StripePrice, price.pk, str(e))
+            raise
+        with transaction.atomic():
+            StripeService._lock_product(price.product_id)
+            if StripePrice.objects.filter(pk=price.pk, sync_status=STRIPE_SYNC_PENDING).exists():
+                now = timezone.now()
+                price.product.prices.filter(is_active=True).update(is_active=False, updated_at=now)
+                StripePrice.objects.filter(pk=price.pk).update(
+                    stripe_price_id=stripe_price.id, sync_status=STRIPE_SYNC_SYNCED, sync_error='',
+                    is_active=True, updated_at=now
+                )
+        invalidate_active_prices(price.product.course_id)
+        price.refresh_from_db()
+        return price
+    
+    @staticmethod
+    def mark_sync_failed(model, pk, error):
+        """Отмечает продукт или цену, которые не удалось создать в Stripe"""
+        model.objects.filter(pk=pk, sync_status=STRIPE_SYNC_PENDING).update(
+            sync_status=STRIPE_SYNC_FAILED, sync_error=error, updated_at=timezone.now()
+        )
+    
+    @staticmethod
+    def _get_checkout_price(course_id):
+        """
+        Активная цена курса (словарь из lms.prices, обычно из кэша).
+        Если цены нет, БД проверяется только для понятного текста ошибки
+        """
+        price = get_active_price(course_id)
+        if price is not None:
+            return price
+        
+        course = Course.objects.filter(id=course_id).select_related('stripe_product').first()
+        if course is None:
             raise ValidationError("Курс не найден")
         
         # Проверяем, есть ли продукт для курса
         if not hasattr(course, 'stripe_product'):
             raise ValidationError("Для курса не создан продукт в Stripe")
-        
-        # Получаем активную цену для продукта
-        try:
-            price = course.stripe_product.prices.filter(is_active=True).first()
-            if not price:
-                raise ValidationError("Для продукта не найдена активная цена")
-        except StripeProduct.DoesNotExist:
-            raise ValidationError("Продукт не найден")
-        
-        # Создаем сессию в Stripe
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price': price.stripe_price_id,
+        raise ValidationError("Для продукта не найдена активная цена")
+    
+    @staticmethod
+    def _checkout_params(user, course_id, price, success_url, cancel_url):
+        """Параметры создания сессии оплаты в Stripe (price - словарь с id и stripe_price_id)"""
+        return {
+            'payment_method_types': ['card'],
+            'line_items': [{
+                'price': price['stripe_price_id'],
                 'quantity': 1,
             }],
-            mode='payment',
-            success_url=success_url,
-            cancel_url=cancel_url,
-            customer_email=user.email,
-            metadata={
+            'mode': 'payment',
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+            'customer_email': user.email,
+            'metadata': {
                 'course_id': course_id,
                 'user_id': user.id,
-                'price_id': price.id
+                'price_id': price['id']
             }
+        }
+    
+    @staticmethod
+    def create_checkout_session(user, course_id, success_url, cancel_url, idempotency_key=None):
+        """
+        Создает сессию оплаты в Stripe.
+        idempotency_key передается в Stripe: повтор с тем же ключом вернет ту же сессию
+        """
+        price = StripeService._get_checkout_price(course_id)
+        
+        # Создаем сессию в Stripe
+        session = stripe_call(
+            stripe.checkout.Session.create,
+            idempotency_key=idempotency_key,
+            **StripeService._checkout_params(user, course_id, price, success_url, cancel_url)
         )
         
-        # Сохраняем сессию в базе данных
-        payment_session = PaymentSession.objects.create(
-            user=user,
-            course=course,
+        # Сохраняем сессию в базе данных; повтор с тем же ключом не создает вторую запись
+        payment_session, _ = PaymentSession.objects.get_or_create(
             stripe_session_id=session.id,
-            amount=price.amount,
-            currency=price.currency,
-            status='pending'
+            defaults={
+                'user': user,
+                'course_id': course_id,
+                'checkout_url': session.url,
+                'amount': price['amount'],
+                'currency': price['currency'],
+                'status': 'pending'
+            }
         )
         
         return {
@@ -134,26 +319,180 @@ class StripeService:
             'payment_session_id': payment_session.id
         }
     
+    @staticmethod
+    def create_checkout_session_async(user, course_id, success_url, cancel_url, idempotency_key=None):
+        """
+        Сохраняет сессию оплаты со статусом creating и ставит ее создание
+        в Stripe в очередь (задача push_checkout_session). Ссылка на оплату
+        появится в сессии после выполнения задачи.
+        idempotency_key здесь не нужен: задача использует ключ, привязанный к записи
+        """
+        price = StripeService._get_checkout_price(course_id)
+        with transaction.atomic():
+            payment_session = PaymentSession.objects.create(
+                user=user,
+                course_id=course_id,
+                amount=price['amount'],
+                currency=price['currency'],
+                status=CHECKOUT_CREATING
+            )
+            enqueue('lms.tasks.push_checkout_session', payment_session.pk, price['id'], success_url, cancel_url)
+        return {
+            'session_id': None,
+            'url': None,
+            'payment_session_id': payment_session.id,
+            'status': CHECKOUT_CREATING
+        }
+    
+    @staticmethod
+    def push_checkout_session(payment_session_pk, price_pk, success_url, cancel_url):
+        """
+        Создает в Stripe сессию оплаты, сохраненную create_checkout_session_async
+        """
+        payment_session = PaymentSession.objects.select_related('user').get(pk=payment_session_pk)
+        if payment_session.status != CHECKOUT_CREATING:
+            return payment_session
+        price = StripePrice.objects.values('id', 'stripe_price_id').get(pk=price_pk)
+        try:
+            session = stripe_call(
+                stripe.checkout.Session.create,
+                idempotency_key=f'lms-checkout-{payment_session.pk}',
+                **StripeService._checkout_params(
+                    payment_session.user, payment_session.course_id, price, success_url, cancel_url
+                )
+            )
+        except stripe.error.StripeError as e:
+            StripeService.mark_checkout_failed(payment_session.pk, str(e))
+            raise
+        PaymentSession.objects.filter(pk=payment_session.pk, status=CHECKOUT_CREATING).update(
+            stripe_session_id=session.id, checkout_url=session.url, status='pending', updated_at=timezone.now()
+        )
+        payment_session.refresh_from_db()
+        return payment_session
+    
+    @staticmethod
+    def mark_checkout_failed(payment_session_pk, error):
+        """Отмечает сессию оплаты, которую не удалось создать в Stripe"""
+        PaymentSession.objects.filter(pk=payment_session_pk, status=CHECKOUT_CREATING).update(
+            status='failed', error=error, updated_at=timezone.now()
+        )
+    
+    @staticmethod
+    def create_checkout_session_idempotent(user, idempotency_key, course_id, success_url, cancel_url,
+                                           async_mode=False):
+        """
+        Создает сессию оплаты с ключом идемпотентности клиента
+        (в асинхронном режиме - через create_checkout_session_async).
+        Результат хранится в кэше STRIPE_IDEMPOTENCY_KEY_TTL секунд: повтор запроса
+        с тем же ключом получает исходный ответ без обращения к Stripe.
+        Пока первый запрос выполняется, повтор отклоняется с IdempotencyKeyInUse.
+        Возвращает пару (результат, повтор ли это).
+        """
+        params = {'course_id': course_id, 'success_url': success_url, 'cancel_url': cancel_url}
+        create = StripeService.create_checkout_session
+        if async_mode:
+            create = StripeService.create_checkout_session_async
+        key_hash = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        cache_key = CHECKOUT_IDEMPOTENCY_CACHE_KEY.format(user.id, key_hash)
+        lock_key = CHECKOUT_IDEMPOTENCY_LOCK_KEY.format(user.id, key_hash)
+        
+        cached = cache.get(cache_key)
+        if cached is None:
+            lock_timeout = (
+                (settings.STRIPE_CONNECT_TIMEOUT + settings.STRIPE_READ_TIMEOUT)
+                * (settings.STRIPE_MAX_NETWORK_RETRIES + 1)
+            )
+            if not cache.add(lock_key, 1, lock_timeout):
+                raise IdempotencyKeyInUse('Запрос с этим ключом идемпотентности еще выполняется')
+            try:
+                # Первый запрос мог завершиться между чтением кэша и захватом блокировки
+                cached = cache.get(cache_key)
+                if cached is None:
+                    result = create(user=user, idempotency_key=f'checkout:{user.id}:{key_hash}', **params)
+                    cache.set(
+                        cache_key,
+                        {'params': params, 'async_mode': async_mode, 'result': result},
+                        settings.STRIPE_IDEMPOTENCY_KEY_TTL
+                    )
+                    return result, False
+            finally:
+                cache.delete(lock_key)
+        
+        if cached['params'] != params or cached.get('async_mode', False) != async_mode:
+            raise ValidationError("Ключ идемпотентности уже использован с другими параметрами")
+        return cached['result'], True
+    
     @staticmethod
     def get_session_status(session_id):
         """
         Получает статус сессии оплаты из Stripe
         """
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = stripe_call(stripe.checkout.Session.retrieve, session_id)
+            # Истекшая сессия так и остается неоплаченной, поэтому expired важнее payment_status
+            if session.status == 'expired':
+                return 'expired'
             return session.payment_status
         except stripe.error.StripeError as e:
             raise ValidationError(f"Ошибка при получении статуса сессии: {str(e)}")
     
+    @staticmethod
+    def get_cached_session_status(payment_session):
+        """
+        Статус сессии оплаты для частого опроса клиентом.
+        Конечные статусы берутся из БД, остальные - из кэша на
+        STRIPE_STATUS_CACHE_TIMEOUT секунд. Одновременные запросы по одной сессии
+        ждут один общий запрос к Stripe. Возвращает пару (статус, источник):
+        источник - 'db', 'cache' или 'stripe'.
+        """
+        # Сессия еще не создана в Stripe или ее создание завершилось ошибкой
+        if payment_session.status in TERMINAL_STATUSES or not payment_session.stripe_session_id:
+            return payment_session.status, 'db'
+        
+        session_id = payment_session.stripe_session_id
+        cache_key = SESSION_STATUS_CACHE_KEY.format(session_id)
+        lock_key = SESSION_STATUS_LOCK_KEY.format(session_id)
+        lock_timeout = settings.STRIPE_CONNECT_TIMEOUT + settings.STRIPE_READ_TIMEOUT
+        deadline = time.monotonic() + lock_timeout
+        while True:
+            session_status = cache.get(cache_key)
+            if session_status is not None:
+                return session_status, 'cache'
+            if cache.add(lock_key, 1, lock_timeout):
+                break
+            if time.monotonic() > deadline:
+                raise StripeUnavailable('Stripe не ответил вовремя, повторите попытку позже')
+            # Запрос к Stripe уже выполняет другой процесс, ждем его результат
+            time.sleep(0.05)
+        
+        try:
+            session_status = StripeService.get_session_status(session_id)
+            cache.set(cache_key, session_status, settings.STRIPE_STATUS_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        if session_status in TERMINAL_STATUSES and session_status != payment_session.status:
+            # Следующие запросы получат статус из БД
+            StripeService.update_payment_status(session_id, session_status)
+            payment_session.status = session_status
+        return session_status, 'stripe'
+    
     @staticmethod
     def update_payment_status(session_id, status):
         """
         Обновляет статус платежа в базе данных
         """
-        try:
-            payment_session = PaymentSession.objects.get(stripe_session_id=session_id)
+        with transaction.atomic():
+            try:
+                payment_session = PaymentSession.objects.select_for_update().get(stripe_session_id=session_id)
+            except PaymentSession.DoesNotExist:
+                raise ValidationError("Сессия оплаты не найдена")
+            previous_status = payment_session.status
+            if previous_status in TERMINAL_STATUSES:
+                # Поздние события webhook и опросы Stripe не перезаписывают конечный статус
+                return payment_session
             payment_session.status = status
             payment_session.save()
+            # Событие оплаты уйдет в Celery только вместе с коммитом нового статуса
+            if status != previous_status:
+                enqueue('lms.tasks.process_payment_event', payment_session.id, status)
             return payment_session
-        except PaymentSession.DoesNotExist:
-            raise ValidationError("Сессия оплаты не найдена")
@@ -1,10 +1,18 @@
+import json
+
+import stripe
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.views import APIView
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from .models import StripeProduct, StripePrice, PaymentSession
+from django.urls import reverse
+from .models import StripeProduct, StripePrice, PaymentSession, StripeEvent
+from .outbox import enqueue
 from .serializers import (
     StripeProductSerializer, 
     StripePriceSerializer, 
@@ -13,7 +21,35 @@ from .serializers import (
     CreatePriceSerializer,
     CreatePaymentSessionSerializer
 )
-from .stripe_service import StripeService
+from .stripe_service import StripeService, IdempotencyKeyInUse
+from .stripe_client import StripeUnavailable
+
+ASYNC_PARAMETER = OpenApiParameter(
+    name='async',
+    type=bool,
+    location=OpenApiParameter.QUERY,
+    required=False,
+    description=(
+        "Асинхронный режим: запись сохраняется сразу, обращение к Stripe выполняет задача Celery. "
+        "Ответ 202 со ссылкой status_url для проверки результата. То же включает заголовок Prefer: respond-async"
+    )
+)
+
+
+def is_async_request(request):
+    """Запрошен ли асинхронный режим (?async=true или Prefer: respond-async)"""
+    return (
+        request.query_params.get('async', '').lower() in ('1', 'true')
+        or 'respond-async' in request.headers.get('Prefer', '')
+    )
+
+
+def accepted_response(request, data, status_view_name, pk):
+    """Ответ 202 со ссылкой на ресурс, по которому клиент узнает результат"""
+    status_url = request.build_absolute_uri(reverse(status_view_name, kwargs={'pk': pk}))
+    response = Response({**data, 'status_url': status_url}, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = status_url
+    return response
 
 
 @extend_schema_view(
@@ -39,6 +75,7 @@ class StripeProductViewSet(viewsets.ReadOnlyModelViewSet):
     @extend_schema(
         summary="Создать продукт в Stripe",
         description="Создает новый продукт в Stripe для курса",
+        parameters=[ASYNC_PARAMETER],
         tags=["Stripe"]
     )
     @action(detail=False, methods=['post'])
@@ -46,14 +83,22 @@ class StripeProductViewSet(viewsets.ReadOnlyModelViewSet):
         """Создает продукт в Stripe"""
         serializer = CreateProductSerializer(data=request.data)
         if serializer.is_valid():
+            params = {
+                'course_id': serializer.validated_data['course_id'],
+                'name': serializer.validated_data['name'],
+                'description': serializer.validated_data.get('description', '')
+            }
             try:
-                product = StripeService.create_product(
-                    course_id=serializer.validated_data['course_id'],
-                    name=serializer.validated_data['name'],
-                    description=serializer.validated_data.get('description', '')
-                )
+                if is_async_request(request):
+                    product = StripeService.create_product_async(**params)
+                    return accepted_response(
+                        request, StripeProductSerializer(product).data, 'stripeproduct-detail', product.pk
+                    )
+                product = StripeService.create_product(**params)
                 response_serializer = StripeProductSerializer(product)
                 return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+            except StripeUnavailable as e:
+                return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             except Exception as e:
                 return Response(
                     {'error': str(e)}, 
@@ -85,6 +130,7 @@ class StripePriceViewSet(viewsets.ReadOnlyModelViewSet):
     @extend_schema(
         summary="Создать цену в Stripe",
         description="Создает новую цену для продукта в Stripe",
+        parameters=[ASYNC_PARAMETER],
         tags=["Stripe"]
     )
     @action(detail=False, methods=['post'])
@@ -92,14 +138,22 @@ class StripePriceViewSet(viewsets.ReadOnlyModelViewSet):
         """Создает цену в Stripe"""
         serializer = CreatePriceSerializer(data=request.data)
         if serializer.is_valid():
+            params = {
+                'product_id': serializer.validated_data['product_id'],
+                'amount': serializer.validated_data['amount'],
+                'currency': serializer.validated_data['currency']
+            }
             try:
-                price = StripeService.create_price(
-                    product_id=serializer.validated_data['product_id'],
-                    amount=serializer.validated_data['amount'],
-                    currency=serializer.validated_data['currency']
-                )
+                if is_async_request(request):
+                    price = StripeService.create_price_async(**params)
+                    return accepted_response(
+                        request, StripePriceSerializer(price).data, 'stripeprice-detail', price.pk
+                    )
+                price = StripeService.create_price(**params)
                 response_serializer = StripePriceSerializer(price)
                 return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+            except StripeUnavailable as e:
+                return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             except Exception as e:
                 return Response(
                     {'error': str(e)}, 
@@ -133,22 +187,63 @@ class PaymentSessionViewSet(viewsets.ReadOnlyModelViewSet):
     
     @extend_schema(
         summary="Создать сессию оплаты",
-        description="Создает новую сессию оплаты для курса",
+        description=(
+            "Создает новую сессию оплаты для курса. Повтор запроса с тем же заголовком "
+            "Idempotency-Key возвращает исходный ответ без создания новой сессии. "
+            "В асинхронном режиме ссылка на оплату (checkout_url) появляется в сессии по status_url."
+        ),
+        parameters=[
+            ASYNC_PARAMETER,
+            OpenApiParameter(
+                name='Idempotency-Key',
+                location=OpenApiParameter.HEADER,
+                required=False,
+                description="Уникальный ключ запроса для безопасных повторов (до 255 символов)"
+            )
+        ],
         tags=["Stripe"]
     )
     @action(detail=False, methods=['post'])
     def create_session(self, request):
         """Создает сессию оплаты"""
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+            return Response(
+                {'error': 'Заголовок Idempotency-Key должен содержать от 1 до 255 символов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         serializer = CreatePaymentSessionSerializer(data=request.data)
         if serializer.is_valid():
+            params = {
+                'user': request.user,
+                'course_id': serializer.validated_data['course_id'],
+                'success_url': serializer.validated_data['success_url'],
+                'cancel_url': serializer.validated_data['cancel_url']
+            }
+            async_mode = is_async_request(request)
             try:
-                result = StripeService.create_checkout_session(
-                    user=request.user,
-                    course_id=serializer.validated_data['course_id'],
-                    success_url=serializer.validated_data['success_url'],
-                    cancel_url=serializer.validated_data['cancel_url']
-                )
-                return Response(result, status=status.HTTP_201_CREATED)
+                if idempotency_key is None:
+                    create = StripeService.create_checkout_session
+                    if async_mode:
+                        create = StripeService.create_checkout_session_async
+                    result, replayed = create(**params), False
+                else:
+                    result, replayed = StripeService.create_checkout_session_idempotent(
+                        idempotency_key=idempotency_key, async_mode=async_mode, **params
+                    )
+                if async_mode:
+                    response = accepted_response(
+                        request, result, 'paymentsession-detail', result['payment_session_id']
+                    )
+                else:
+                    response = Response(result, status=status.HTTP_201_CREATED)
+                if replayed:
+                    response['Idempotent-Replayed'] = 'true'
+                return response
+            except IdempotencyKeyInUse as e:
+                return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+            except StripeUnavailable as e:
+                return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             except Exception as e:
                 return Response(
                     {'error': str(e)}, 
@@ -158,7 +253,10 @@ class PaymentSessionViewSet(viewsets.ReadOnlyModelViewSet):
     
     @extend_schema(
         summary="Получить статус сессии",
-        description="Получает актуальный статус сессии оплаты",
+        description=(
+            "Получает статус сессии оплаты. Конечные статусы (paid, expired) берутся из БД, "
+            "остальные кэшируются на несколько секунд. Поле source: db, cache или stripe."
+        ),
         tags=["Stripe"]
     )
     @action(detail=True, methods=['get'])
@@ -166,14 +264,51 @@ class PaymentSessionViewSet(viewsets.ReadOnlyModelViewSet):
         """Получает статус сессии оплаты"""
         payment_session = self.get_object()
         try:
-            status = StripeService.get_session_status(payment_session.stripe_session_id)
+            session_status, source = StripeService.get_cached_session_status(payment_session)
             return Response({
                 'session_id': payment_session.stripe_session_id,
-                'status': status,
-                'local_status': payment_session.status
+                'status': session_status,
+                'local_status': payment_session.status,
+                'source': source
             })
+        except StripeUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+
+class StripeWebhookView(APIView):
+    """
+    Прием webhook Stripe. Событие проверяется по подписи, сохраняется
+    и передается в Celery через outbox; ответ возвращается сразу.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    
+    @extend_schema(
+        summary="Webhook Stripe",
+        description="Принимает события Stripe (checkout.session.*) с проверкой подписи",
+        tags=["Stripe"]
+    )
+    def post(self, request):
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+                settings.STRIPE_WEBHOOK_SECRET
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response({'error': 'Неверная подпись или данные события'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            stripe_event, created = StripeEvent.objects.get_or_create(
+                event_id=event['id'],
+                defaults={'type': event['type'], 'payload': json.loads(request.body)}
+            )
+            # Повторная доставка того же события повторно не обрабатывается
+            if created:
+                enqueue('lms.tasks.process_stripe_event', stripe_event.pk)
+        return Response({'received': True})
@@ -1,29 +1,73 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from decimal import Decimal
+
+import stripe
 from django.utils import timezone
-from django.core.mail import send_mail
-from celery import shared_task
+from django.core.mail import EmailMessage, get_connection
+from celery import chord, shared_task
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from .cache import bump_course_versions
+from .models import Course, Lesson, CourseSubscription, PaymentSession, StripeEvent, StripeProduct, StripePrice
+from .outbox import enqueue
+from users.models import User, Payment
+from users.revocation import revoke_user_tokens
+
+logger = logging.getLogger(__name__)
 
-from .models import Course, Lesson, CourseSubscription
-from users.models import User
+# Прогресс deactivate_inactive_users: граница даты и последний обработанный id
+DEACTIVATE_USERS_CHECKPOINT_KEY = 'lms:deactivate_inactive_users:checkpoint'
+# Заметно короче суточного интервала запуска: упавшая задача продолжит работу при повторе,
+# а устаревший прогресс не достанется следующему плановому запуску
+DEACTIVATE_USERS_CHECKPOINT_TIMEOUT = 6 * 60 * 60
+# Блокировка от одновременных запусков; снимается сама, если воркер упал
+DEACTIVATE_USERS_LOCK_KEY = 'lms:deactivate_inactive_users:lock'
+DEACTIVATE_USERS_LOCK_TIMEOUT = 60 * 60
+
+
+def get_subscription_ranges(course_id: int, chunk_size: int) -> list:
+    """
+    Делит активные подписки курса с немедленными уведомлениями на диапазоны id
+    по chunk_size подписок. Одновременно в памяти находится не больше chunk_size id.
+    """
+    subscriptions = CourseSubscription.objects.filter(
+        course_id=course_id, is_active=True, delivery_mode=CourseSubscription.DELIVERY_IMMEDIATE
+    ).order_by('id')
+    ranges = []
+    last_id = 0
+    while True:
+        ids = list(subscriptions.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+        ranges.append((ids[0], ids[-1]))
+        last_id = ids[-1]
+    return ranges
 
 
 @shared_task
-def send_course_update_email(course_id: int, updated_object_type: str, updated_object_id: int) -> int:
+def send_course_update_email(course_id: int, updated_object_type: str, updated_object_id) -> int:
+    """
+    Рассылает подписчикам уведомление об обновлении курса.
+    Для updated_object_type='lessons' updated_object_id - список id измененных уроков.
+    Подписчики делятся на диапазоны id, каждый диапазон отправляется отдельной задачей,
+    итог собирает summarize_course_update_email. Возвращает количество диапазонов.
+    """
     try:
         course = Course.objects.get(id=course_id)
     except Course.DoesNotExist:
         return 0
 
-    # Собираем e-mail адреса активных подписчиков
-    emails = list(
-        CourseSubscription.objects.filter(course=course, is_active=True)
-        .select_related('user')
-        .values_list('user__email', flat=True)
-    )
-
-    if not emails:
+    ranges = get_subscription_ranges(course_id, settings.COURSE_UPDATE_EMAIL_CHUNK_SIZE)
+    if not ranges:
         return 0
 
     subject = f'Обновление материалов курса: {course.title}'
@@ -35,30 +79,472 @@ def send_course_update_email(course_id: int, updated_object_type: str, updated_o
             body = f'В курсе "{course.title}" обновлен урок: {lesson.title}.'
         except Lesson.DoesNotExist:
             body = f'В курсе "{course.title}" были обновлены материалы.'
+    elif updated_object_type == 'lessons':
+        titles = list(
+            Lesson.objects.filter(course=course, id__in=updated_object_id)
+            .order_by('created_at').values_list('title', flat=True)
+        )
+        if titles:
+            body = f'В курсе "{course.title}" обновлены уроки: ' + ', '.join(titles) + '.'
+        else:
+            body = f'В курсе "{course.title}" были обновлены материалы.'
     else:
         body = f'В курсе "{course.title}" были обновлены материалы.'
 
-    # Отправляем письмо каждому подписчику отдельно для надежности
-    sent_count = 0
-    for email in emails:
+    chord(
+        send_course_update_chunk.s(course_id, start_id, end_id, subject, body)
+        for start_id, end_id in ranges
+    )(summarize_course_update_email.s(course_id))
+    return len(ranges)
+
+
+@shared_task
+def send_course_update_chunk(course_id: int, start_id: int, end_id: int, subject: str, body: str) -> dict:
+    """
+    Отправляет письма подписчикам из диапазона id через одно SMTP-соединение.
+    Возвращает количество отправленных и неотправленных писем.
+    """
+    emails = (
+        CourseSubscription.objects.filter(
+            course_id=course_id,
+            is_active=True,
+            delivery_mode=CourseSubscription.DELIVERY_IMMEDIATE,
+            id__gte=start_id,
+            id__lte=end_id
+        )
+        .order_by('id')
+        .values_list('user__email', flat=True)
+        .iterator(chunk_size=200)
+    )
+    sent = failed = 0
+    connection = get_connection()
+    with connection:
+        for email in emails:
+            message = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [email], connection=connection)
+            # Письма отправляются по одному, чтобы ошибка одного адреса не отменяла остальные
+            try:
+                sent += connection.send_messages([message]) or 0
+            except Exception:
+                logger.exception('Не удалось отправить уведомление курса %s на %s', course_id, email)
+                failed += 1
+    logger.info(
+        'Уведомления курса %s, подписки %s-%s: отправлено %s, ошибок %s',
+        course_id, start_id, end_id, sent, failed
+    )
+    return {'sent': sent, 'failed': failed}
+
+
+@shared_task
+def summarize_course_update_email(results: list, course_id: int) -> dict:
+    """Суммирует результаты отправки по всем диапазонам"""
+    summary = {
+        'sent': sum(result['sent'] for result in results),
+        'failed': sum(result['failed'] for result in results),
+        'chunks': len(results),
+    }
+    logger.info('Уведомления курса %s: %s', course_id, summary)
+    return summary
+
+
+@shared_task
+def record_course_update(course_id: int, lesson_ids: list = ()) -> None:
+    """Передает изменение курса из outbox в notify_course_update"""
+    from .notifications import notify_course_update
+
+    notify_course_update(course_id, lesson_ids)
+
+
+@shared_task
+def flush_course_updates(course_id: int) -> int:
+    """
+    Отправляет одно уведомление по изменениям курса, накопленным notify_course_update.
+    Возвращает количество измененных уроков в уведомлении.
+    """
+    from .notifications import take_pending_updates
+
+    course_changed, lesson_ids = take_pending_updates(course_id)
+    if lesson_ids:
+        send_course_update_email.delay(course_id, 'lessons', lesson_ids)
+    elif course_changed:
+        send_course_update_email.delay(course_id, 'course', course_id)
+    return len(lesson_ids)
+
+
+def build_digests(subscriptions, until) -> dict:
+    """
+    Собирает изменения курсов для дайджестов двумя запросами на всю пачку подписок.
+    Изменения берутся с последнего дайджеста (или с момента подписки) до until.
+    Возвращает {id пользователя: (email, {название курса: [названия уроков]})}.
+    """
+    subscriptions = subscriptions.annotate(since=Coalesce('last_digest_sent_at', 'created_at'))
+    digests = {}
+
+    def add(user_id, email, course_title):
+        courses = digests.setdefault(user_id, (email, {}))[1]
+        return courses.setdefault(course_title, [])
+
+    # Курсы, измененные с последнего дайджеста
+    changed_courses = subscriptions.filter(
+        course__updated_at__gt=F('since'), course__updated_at__lte=until
+    ).values_list('user_id', 'user__email', 'course__title')
+    for user_id, email, course_title in changed_courses:
+        add(user_id, email, course_title)
+
+    # Уроки, созданные или измененные с последнего дайджеста
+    changed_lessons = subscriptions.filter(
+        course__lessons__updated_at__gt=F('since'), course__lessons__updated_at__lte=until
+    ).order_by('course__lessons__created_at').values_list(
+        'user_id', 'user__email', 'course__title', 'course__lessons__title'
+    )
+    for user_id, email, course_title, lesson_title in changed_lessons:
+        add(user_id, email, course_title).append(lesson_title)
+    return digests
+
+
+def format_digest(courses: dict) -> str:
+    lines = ['Обновления курсов, на которые вы подписаны:']
+    for course_title, lesson_titles in sorted(courses.items()):
+        if lesson_titles:
+            lines.append(f'- "{course_title}": обновлены уроки: ' + ', '.join(lesson_titles))
+        else:
+            lines.append(f'- "{course_title}": курс обновлен')
+    return '\n'.join(lines)
+
+
+@shared_task
+def send_course_digests(delivery_mode: str) -> dict:
+    """
+    Отправляет каждому пользователю с режимом delivery_mode один дайджест
+    по всем его подпискам. Пользователи обрабатываются пачками по id.
+    """
+    now = timezone.now()
+    batch_size = settings.COURSE_UPDATE_EMAIL_CHUNK_SIZE
+    subscriptions = CourseSubscription.objects.filter(is_active=True, delivery_mode=delivery_mode)
+    sent = failed = 0
+    last_user_id = 0
+    connection = get_connection()
+    with connection:
+        while True:
+            user_ids = list(
+                subscriptions.filter(user_id__gt=last_user_id)
+                .order_by('user_id').values_list('user_id', flat=True).distinct()[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+            batch = subscriptions.filter(user_id__in=user_ids)
+            delivered = []
+            for user_id, (email, courses) in build_digests(batch, now).items():
+                message = EmailMessage(
+                    'Дайджест обновлений курсов', format_digest(courses),
+                    settings.DEFAULT_FROM_EMAIL, [email], connection=connection
+                )
+                try:
+                    connection.send_messages([message])
+                except Exception:
+                    logger.exception('Не удалось отправить дайджест на %s', email)
+                    failed += 1
+                    continue
+                delivered.append(user_id)
+                sent += 1
+            # Неотправленные дайджесты попадут в следующую рассылку
+            batch.filter(user_id__in=delivered).update(last_digest_sent_at=now)
+    logger.info('Дайджесты (%s): отправлено %s, ошибок %s', delivery_mode, sent, failed)
+    return {'sent': sent, 'failed': failed}
+
+
+@shared_task
+def process_payment_event(payment_session_id: int, status: str) -> bool:
+    """
+    Обрабатывает смену статуса сессии оплаты: оплаченный курс записывается
+    в историю платежей пользователя, а пользователь подписывается на курс.
+    Повторная обработка события дубля не создает.
+    Возвращает True, если платеж создан.
+    """
+    if status != 'paid':
+        return False
+    try:
+        payment_session = PaymentSession.objects.select_related('user', 'course').get(id=payment_session_id)
+    except PaymentSession.DoesNotExist:
+        return False
+    # Уникальная связь с сессией защищает от дублей при повторной доставке
+    # события и при одновременной обработке одного сообщения двумя воркерами
+    _, created = Payment.objects.get_or_create(
+        payment_session=payment_session,
+        defaults={
+            'user': payment_session.user,
+            'paid_course': payment_session.course,
+            'payment_date': timezone.now(),
+            'amount': payment_session.amount,
+            'payment_method': 'card',
+        }
+    )
+    # Открываем доступ к обновлениям оплаченного курса
+    if CourseSubscription.objects.subscribe(payment_session.user, [payment_session.course_id]):
+        bump_course_versions(payment_session.course_id)
+    return created
+
+
+# Статус сессии оплаты для событий checkout.session.*
+STRIPE_EVENT_STATUSES = {
+    'checkout.session.async_payment_succeeded': 'paid',
+    'checkout.session.async_payment_failed': 'failed',
+    'checkout.session.expired': 'expired',
+}
+
+
+@shared_task
+def process_stripe_event(event_pk: int) -> bool:
+    """
+    Обрабатывает сохраненное событие webhook Stripe и обновляет статус
+    сессии оплаты. Каждое событие обрабатывается один раз.
+    Возвращает True, если событие обработано сейчас.
+    """
+    from .stripe_service import StripeService
+
+    with transaction.atomic():
+        try:
+            event = StripeEvent.objects.select_for_update().get(pk=event_pk)
+        except StripeEvent.DoesNotExist:
+            return False
+        if event.processed_at:
+            return False
+
+        session = event.payload['data']['object']
+        if event.type == 'checkout.session.completed':
+            status = session.get('payment_status')
+        else:
+            status = STRIPE_EVENT_STATUSES.get(event.type)
+        if status:
+            try:
+                StripeService.update_payment_status(session['id'], status)
+            except ValidationError:
+                logger.warning('Событие Stripe %s: сессия оплаты %s не найдена', event.event_id, session['id'])
+
+        event.processed_at = timezone.now()
+        event.save(update_fields=['processed_at'])
+    return True
+
+
+def run_stripe_push(task, push, give_up, *args) -> bool:
+    """
+    Выполняет создание объекта в Stripe (StripeService.push_*) из задачи Celery.
+    Если Stripe недоступен или связанный объект еще создается, задача повторяется
+    с растущей задержкой; после последней попытки вызывается give_up(текст ошибки).
+    Ошибки запроса к Stripe уже записаны в объект и не повторяются.
+    """
+    from .stripe_client import StripeUnavailable
+    from .stripe_service import StripeObjectNotReady
+
+    try:
+        push(*args)
+    except ObjectDoesNotExist:
+        return False
+    except (StripeUnavailable, StripeObjectNotReady) as exc:
+        if task.request.retries >= task.max_retries:
+            give_up(str(exc))
+            return False
+        raise task.retry(exc=exc, countdown=10 * 2 ** task.request.retries)
+    except stripe.error.StripeError:
+        logger.exception('Stripe отклонил создание объекта (%s)', task.name)
+        return False
+    return True
+
+
+@shared_task(bind=True, max_retries=5)
+def push_stripe_product(self, product_pk: int) -> bool:
+    """Создает в Stripe продукт, сохраненный в асинхронном режиме"""
+    from .stripe_service import StripeService
+
+    return run_stripe_push(
+        self, StripeService.push_product,
+        lambda error: StripeService.mark_sync_failed(StripeProduct, product_pk, error), product_pk
+    )
+
+
+@shared_task(bind=True, max_retries=5)
+def push_stripe_price(self, price_pk: int) -> bool:
+    """Создает в Stripe цену, сохраненную в асинхронном режиме"""
+    from .stripe_service import StripeService
+
+    return run_stripe_push(
+        self, StripeService.push_price,
+        lambda error: StripeService.mark_sync_failed(StripePrice, price_pk, error), price_pk
+    )
+
+
+@shared_task(bind=True, max_retries=5)
+def push_checkout_session(self, payment_session_pk: int, price_pk: int, success_url: str, cancel_url: str) -> bool:
+    """Создает в Stripe сессию оплаты, сохраненную в асинхронном режиме"""
+    from .stripe_service import StripeService
+
+    return run_stripe_push(
+        self, StripeService.push_checkout_session,
+        lambda error: StripeService.mark_checkout_failed(payment_session_pk, error),
+        payment_session_pk, price_pk, success_url, cancel_url
+    )
+
+
+@shared_task
+def sync_stripe_catalog(amount: str, currency: str = 'usd') -> dict:
+    """
+    Создает в Stripe продукты и цены для всех курсов без продукта.
+    Повторный запуск продолжает прерванную синхронизацию
+    """
+    from .stripe_catalog import sync_stripe_catalog as sync_catalog
+
+    return sync_catalog(Decimal(amount), currency)
+
+
+def fetch_session_statuses(session_ids: list, concurrency: int) -> tuple:
+    """
+    Запрашивает статусы сессий в Stripe параллельно, не более concurrency запросов
+    одновременно. Возвращает ({id сессии в Stripe: статус или None при ошибке},
+    число запросов к Stripe, признак того, что Stripe недоступен).
+    """
+    from .stripe_client import StripeUnavailable
+    from .stripe_service import StripeService
+
+    unavailable = threading.Event()
+    calls = []
+
+    def fetch(session_id):
+        if unavailable.is_set():
+            return None
+        calls.append(session_id)
         try:
-            send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [email], fail_silently=True)
-            sent_count += 1
+            return StripeService.get_session_status(session_id)
+        except StripeUnavailable:
+            unavailable.set()
         except Exception:
-            # Игнорируем ошибки отправки для отдельных адресов
-            pass
+            logger.exception('Не удалось получить статус сессии %s', session_id)
+        return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = dict(zip(session_ids, executor.map(fetch, session_ids)))
+    return statuses, len(calls), unavailable.is_set()
+
 
-    return sent_count
+@shared_task
+def reconcile_payment_sessions() -> dict:
+    """
+    Сверяет с Stripe незавершенные сессии оплаты старше PAYMENT_RECONCILE_AFTER_MINUTES.
+    Сессии обрабатываются пачками по id, статусы запрашиваются параллельно,
+    изменения сохраняются одним bulk_update на пачку.
+    Возвращает статистику: проверено, запросов к Stripe, ошибок, обновлено, время.
+    """
+    from .stripe_service import PENDING_STATUSES
+
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(minutes=settings.PAYMENT_RECONCILE_AFTER_MINUTES)
+    pending = PaymentSession.objects.filter(status__in=PENDING_STATUSES, created_at__lt=cutoff)
+    stats = {'checked': 0, 'api_calls': 0, 'errors': 0, 'updated': 0}
+    last_id = 0
+    unavailable = False
+    while not unavailable:
+        sessions = list(
+            pending.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'stripe_session_id', 'status')[:settings.PAYMENT_RECONCILE_BATCH_SIZE]
+        )
+        if not sessions:
+            break
+        last_id = sessions[-1][0]
+        statuses, api_calls, unavailable = fetch_session_statuses(
+            [session_id for _, session_id, _ in sessions], settings.PAYMENT_RECONCILE_CONCURRENCY
+        )
+        stats['checked'] += len(sessions)
+        stats['api_calls'] += api_calls
+        stats['errors'] += sum(session_status is None for session_status in statuses.values())
+        changes = {
+            pk: statuses[session_id]
+            for pk, session_id, current_status in sessions
+            if statuses[session_id] not in (None, current_status)
+        }
+        if not changes:
+            continue
+        with transaction.atomic():
+            # Статус мог измениться через webhook, пока шли запросы к Stripe
+            locked = PaymentSession.objects.select_for_update().filter(
+                id__in=changes, status__in=PENDING_STATUSES
+            )
+            now = timezone.now()
+            updated = []
+            for payment_session in locked:
+                payment_session.status = changes[payment_session.id]
+                payment_session.updated_at = now
+                updated.append(payment_session)
+            PaymentSession.objects.bulk_update(updated, ['status', 'updated_at'])
+            for payment_session in updated:
+                enqueue('lms.tasks.process_payment_event', payment_session.id, payment_session.status)
+        stats['updated'] += len(updated)
+
+    elapsed = time.monotonic() - started
+    stats['seconds'] = round(elapsed, 2)
+    stats['per_second'] = round(stats['checked'] / elapsed, 1) if elapsed else 0
+    if unavailable:
+        logger.warning('Сверка сессий оплаты прервана: Stripe недоступен')
+    logger.info('Сверка сессий оплаты: %s', stats)
+    return stats
 
 
 @shared_task
 def deactivate_inactive_users() -> int:
-    cutoff = timezone.now() - timedelta(days=30)
+    """
+    Деактивирует пользователей, которые не заходили дольше 30 дней или не входили
+    ни разу. Пользователи обрабатываются пачками по id в коротких транзакциях,
+    после каждой пачки прогресс сохраняется в кэше: после падения задача
+    продолжит с того же места и с той же границей даты. Одновременно
+    выполняется только один запуск.
+    Возвращает количество деактивированных пользователей.
+    """
+    if not cache.add(DEACTIVATE_USERS_LOCK_KEY, 1, DEACTIVATE_USERS_LOCK_TIMEOUT):
+        logger.info('Деактивация пользователей уже выполняется, запуск пропущен')
+        return 0
+    try:
+        return _deactivate_inactive_users()
+    finally:
+        cache.delete(DEACTIVATE_USERS_LOCK_KEY)
+
+
+def _deactivate_inactive_users() -> int:
+    started = time.monotonic()
+    batch_size = settings.DEACTIVATE_USERS_BATCH_SIZE
+    checkpoint = cache.get(DEACTIVATE_USERS_CHECKPOINT_KEY)
+    if checkpoint:
+        cutoff, last_id = checkpoint['cutoff'], checkpoint['last_id']
+        logger.info('Деактивация пользователей продолжается с id %s', last_id)
+    else:
+        cutoff, last_id = timezone.now() - timedelta(days=30), 0
+
     # Пользователи, которые никогда не входили (last_login = None) или не заходили дольше 30 дней
-    qs = User.objects.filter(is_active=True).filter(
+    inactive = User.objects.filter(is_active=True).filter(
         models.Q(last_login__lt=cutoff) | models.Q(last_login__isnull=True)
     )
-    updated = qs.update(is_active=False)
-    return updated
+    total = 0
+    while True:
+        ids = list(inactive.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            # Условие проверяется повторно: пользователь мог войти после выборки
+            updated = inactive.filter(id__in=ids).update(is_active=False)
+        # update() не отправляет post_save, поэтому токены отзываются здесь
+        revoke_user_tokens(User.objects.filter(id__in=ids, is_active=False).values_list('id', flat=True))
+        total += updated
+        last_id = ids[-1]
+        cache.set(
+            DEACTIVATE_USERS_CHECKPOINT_KEY,
+            {'cutoff': cutoff, 'last_id': last_id},
+            DEACTIVATE_USERS_CHECKPOINT_TIMEOUT
+        )
+        # Долгий запуск продлевает блокировку, пока делает успехи
+        cache.touch(DEACTIVATE_USERS_LOCK_KEY, DEACTIVATE_USERS_LOCK_TIMEOUT)
+        logger.info('Деактивировано пользователей: %s (до id %s)', updated, last_id)
+
+    cache.delete(DEACTIVATE_USERS_CHECKPOINT_KEY)
+    logger.info(
+        'Деактивация пользователей завершена: %s за %.2f с', total, time.monotonic() - started
+    )
+    return total
 
 
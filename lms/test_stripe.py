@@ -0,0 +1,808 @@
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import stripe
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from unittest.mock import patch, MagicMock
+from .models import Course, StripeProduct, StripePrice, PaymentSession, StripeEvent, OutboxEvent, CourseSubscription
+from .tasks import (
+    process_stripe_event, process_payment_event, reconcile_payment_sessions,
+    push_stripe_product, push_stripe_price, push_checkout_session
+)
+from users.models import Payment
+from .stripe_service import StripeService, StripeObjectNotReady, CHECKOUT_IDEMPOTENCY_LOCK_KEY
+from .prices import get_active_price
+from .stripe_catalog import RateLimiter
+from .stripe_client import StripeUnavailable, breaker, configure_stripe
+
+User = get_user_model()
+
+
+class StripeServiceTest(TestCase):
+    """Тесты для StripeService"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            title='Test Course',
+            description='Test Description',
+            owner=self.user
+        )
+    
+    @patch('stripe.Product.create')
+    def test_create_product_success(self, mock_stripe_create):
+        """Тест успешного создания продукта"""
+        mock_stripe_create.return_value = MagicMock(id='prod_test123')
+        
+        product = StripeService.create_product(
+            course_id=self.course.id,
+            name='Test Product',
+            description='Test Description'
+        )
+        
+        self.assertIsInstance(product, StripeProduct)
+        self.assertEqual(product.course, self.course)
+        self.assertEqual(product.name, 'Test Product')
+        self.assertEqual(product.stripe_product_id, 'prod_test123')
+    
+    def test_create_product_course_not_found(self):
+        """Тест создания продукта для несуществующего курса"""
+        with self.assertRaises(Exception):
+            StripeService.create_product(
+                course_id=999,
+                name='Test Product',
+                description='Test Description'
+            )
+    
+    @patch('stripe.Price.create')
+    def test_create_price_success(self, mock_stripe_create):
+        """Тест успешного создания цены"""
+        # Создаем продукт
+        product = StripeProduct.objects.create(
+            course=self.course,
+            stripe_product_id='prod_test123',
+            name='Test Product',
+            description='Test Description'
+        )
+        
+        mock_stripe_create.return_value = MagicMock(id='price_test123')
+        
+        price = StripeService.create_price(
+            product_id=product.id,
+            amount=100.00,
+            currency='usd'
+        )
+        
+        self.assertIsInstance(price, StripePrice)
+        self.assertEqual(price.product, product)
+        self.assertEqual(price.amount, 100.00)
+        self.assertEqual(price.currency, 'usd')
+        self.assertEqual(price.stripe_price_id, 'price_test123')
+    
+    def test_create_price_product_not_found(self):
+        """Тест создания цены для несуществующего продукта"""
+        with self.assertRaises(Exception):
+            StripeService.create_price(
+                product_id=999,
+                amount=100.00,
+                currency='usd'
+            )
+
+
+class StripeAPITest(APITestCase):
+    """Тесты для Stripe API эндпоинтов"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            title='Test Course',
+            description='Test Description',
+            owner=self.user
+        )
+        self.product = StripeProduct.objects.create(
+            course=self.course,
+            stripe_product_id='prod_test123',
+            name='Test Product',
+            description='Test Description'
+        )
+        self.price = StripePrice.objects.create(
+            product=self.product,
+            stripe_price_id='price_test123',
+            amount=100.00,
+            currency='usd'
+        )
+    
+    def test_create_product_api(self):
+        """Тест API создания продукта"""
+        self.client.force_authenticate(user=self.user)
+        
+        with patch('lms.stripe_service.StripeService.create_product') as mock_create:
+            mock_create.return_value = self.product
+            
+            url = reverse('stripeproduct-create-product')
+            data = {
+                'course_id': self.course.id,
+                'name': 'Test Product',
+                'description': 'Test Description'
+            }
+            response = self.client.post(url, data)
+            
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            mock_create.assert_called_once()
+    
+    def test_create_price_api(self):
+        """Тест API создания цены"""
+        self.client.force_authenticate(user=self.user)
+        
+        with patch('lms.stripe_service.StripeService.create_price') as mock_create:
+            mock_create.return_value = self.price
+            
+            url = reverse('stripeprice-create-price')
+            data = {
+                'product_id': self.product.id,
+                'amount': 100.00,
+                'currency': 'usd'
+            }
+            response = self.client.post(url, data)
+            
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            mock_create.assert_called_once()
+    
+    def test_create_payment_session_api(self):
+        """Тест API создания сессии оплаты"""
+        self.client.force_authenticate(user=self.user)
+        
+        with patch('lms.stripe_service.StripeService.create_checkout_session') as mock_create:
+            mock_create.return_value = {
+                'session_id': 'cs_test123',
+                'url': 'https://checkout.stripe.com/test',
+                'payment_session_id': 1
+            }
+            
+            url = reverse('paymentsession-create-session')
+            data = {
+                'course_id': self.course.id,
+                'success_url': 'https://example.com/success',
+                'cancel_url': 'https://example.com/cancel'
+            }
+            response = self.client.post(url, data)
+            
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            mock_create.assert_called_once()
+    
+    def test_get_payment_session_status(self):
+        """Тест получения статуса сессии оплаты"""
+        self.client.force_authenticate(user=self.user)
+        
+        payment_session = PaymentSession.objects.create(
+            user=self.user,
+            course=self.course,
+            stripe_session_id='cs_test123',
+            amount=100.00,
+            currency='usd',
+            status='pending'
+        )
+        
+        with patch('lms.stripe_service.StripeService.get_session_status') as mock_get_status:
+            mock_get_status.return_value = 'paid'
+            
+            url = reverse('paymentsession-get-status', kwargs={'pk': payment_session.id})
+            response = self.client.get(url)
+            
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['status'], 'paid')
+            mock_get_status.assert_called_once()
+    
+    def test_unauthorized_access(self):
+        """Тест доступа без авторизации"""
+        url = reverse('stripeproduct-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CheckoutIdempotencyTest(APITestCase):
+    """Тесты повторов создания сессии оплаты с заголовком Idempotency-Key"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', owner=self.user)
+        self.product = StripeProduct.objects.create(course=self.course, stripe_product_id='prod_test123', name='Test Product')
+        StripePrice.objects.create(product=self.product, stripe_price_id='price_test123', amount=100.00, currency='usd')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('paymentsession-create-session')
+        self.data = {
+            'course_id': self.course.id,
+            'success_url': 'https://example.com/success',
+            'cancel_url': 'https://example.com/cancel'
+        }
+    
+    def post(self, key='key-1', data=None):
+        return self.client.post(self.url, data or self.data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    @patch('stripe.checkout.Session.create')
+    def test_retry_returns_original_response(self, mock_create):
+        """Повтор с тем же ключом возвращает исходный ответ без запроса к Stripe"""
+        mock_create.return_value = MagicMock(id='cs_test_1', url='https://checkout.stripe.com/1')
+        first = self.post()
+        second = self.post()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        mock_create.assert_called_once()
+        self.assertTrue(mock_create.call_args.kwargs['idempotency_key'])
+        self.assertEqual(PaymentSession.objects.count(), 1)
+        
+        mock_create.return_value = MagicMock(id='cs_test_2', url='https://checkout.stripe.com/2')
+        self.assertEqual(self.post('key-2').data['session_id'], 'cs_test_2')
+    
+    @patch('stripe.checkout.Session.create')
+    def test_expired_cache_reuses_payment_session(self, mock_create):
+        """Без кэша Stripe возвращает ту же сессию, а запись в БД не дублируется"""
+        mock_create.return_value = MagicMock(id='cs_test_1', url='https://checkout.stripe.com/1')
+        first = self.post()
+        cache.clear()
+        second = self.post()
+        self.assertEqual(mock_create.call_count, 2)
+        self.assertEqual(second.data['payment_session_id'], first.data['payment_session_id'])
+        self.assertEqual(PaymentSession.objects.count(), 1)
+    
+    @patch('stripe.checkout.Session.create')
+    def test_request_in_progress(self, mock_create):
+        """Повтор во время выполнения первого запроса получает 409"""
+        key_hash = hashlib.sha256(b'key-1').hexdigest()
+        cache.add(CHECKOUT_IDEMPOTENCY_LOCK_KEY.format(self.user.id, key_hash), 1, 60)
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        mock_create.assert_not_called()
+    
+    @patch('stripe.checkout.Session.create')
+    def test_key_reused_with_other_params(self, mock_create):
+        """Ключ нельзя использовать повторно с другими параметрами"""
+        mock_create.return_value = MagicMock(id='cs_test_1', url='https://checkout.stripe.com/1')
+        self.post()
+        response = self.post(data={**self.data, 'success_url': 'https://example.com/other'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_create.assert_called_once()
+    
+    def test_invalid_key(self):
+        """Слишком длинный ключ отклоняется"""
+        self.assertEqual(self.post('x' * 256).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncStripeCreationTest(APITestCase):
+    """Тесты асинхронного режима создания объектов Stripe"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', owner=self.user)
+        self.client.force_authenticate(user=self.user)
+    
+    def run_outbox_task(self, task_name, task):
+        event = OutboxEvent.objects.get(task_name=task_name)
+        event.delete()
+        return task(*event.args)
+    
+    def test_async_product_and_price(self):
+        """Продукт и цена сохраняются сразу, а в Stripe создаются задачами"""
+        response = self.client.post(
+            reverse('stripeproduct-create-product') + '?async=true',
+            {'course_id': self.course.id, 'name': 'Test Product'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Location'], response.data['status_url'])
+        product = StripeProduct.objects.get()
+        self.assertEqual(product.sync_status, 'pending')
+        self.assertIsNone(product.stripe_product_id)
+        
+        response = self.client.post(
+            reverse('stripeprice-create-price'),
+            {'product_id': product.id, 'amount': '100.00', 'currency': 'usd'},
+            format='json', HTTP_PREFER='respond-async'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        price_event = OutboxEvent.objects.get(task_name='lms.tasks.push_stripe_price')
+        # Цена ждет, пока продукт создается в Stripe
+        with self.assertRaises(StripeObjectNotReady):
+            push_stripe_price(*price_event.args)
+        
+        with patch('stripe.Product.create', return_value=MagicMock(id='prod_async')) as mock_create:
+            self.assertTrue(self.run_outbox_task('lms.tasks.push_stripe_product', push_stripe_product))
+        self.assertEqual(mock_create.call_args.kwargs['idempotency_key'], f'lms-product-{product.pk}')
+        with patch('stripe.Price.create', return_value=MagicMock(id='price_async')) as mock_create:
+            self.assertTrue(self.run_outbox_task('lms.tasks.push_stripe_price', push_stripe_price))
+        self.assertEqual(mock_create.call_args.kwargs['product'], 'prod_async')
+        
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.data['sync_status'], 'synced')
+        self.assertEqual(response.data['stripe_price_id'], 'price_async')
+    
+    def create_price(self):
+        product = StripeProduct.objects.create(course=self.course, stripe_product_id='prod_test123', name='Test Product')
+        StripePrice.objects.create(product=product, stripe_price_id='price_test123', amount=100.00, currency='usd')
+    
+    def test_async_checkout_session(self):
+        """Сессия оплаты возвращается со статусом creating, ссылка появляется после задачи"""
+        self.create_price()
+        data = {
+            'course_id': self.course.id,
+            'success_url': 'https://example.com/success',
+            'cancel_url': 'https://example.com/cancel'
+        }
+        with patch('stripe.checkout.Session.create') as mock_create:
+            response = self.client.post(reverse('paymentsession-create-session') + '?async=1', data, format='json')
+            mock_create.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'creating')
+        payment_session = PaymentSession.objects.get()
+        status_response = self.client.get(
+            reverse('paymentsession-get-status', kwargs={'pk': payment_session.pk})
+        )
+        self.assertEqual(status_response.data['status'], 'creating')
+        self.assertEqual(status_response.data['source'], 'db')
+        
+        session = MagicMock(id='cs_async', url='https://checkout.stripe.com/async')
+        with patch('stripe.checkout.Session.create', return_value=session) as mock_create:
+            self.assertTrue(self.run_outbox_task('lms.tasks.push_checkout_session', push_checkout_session))
+        self.assertEqual(mock_create.call_args.kwargs['idempotency_key'], f'lms-checkout-{payment_session.pk}')
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response.data['stripe_session_id'], 'cs_async')
+        self.assertEqual(response.data['checkout_url'], 'https://checkout.stripe.com/async')
+    
+    def test_rejected_checkout_session(self):
+        """Отказ Stripe отмечает сессию оплаты как неудавшуюся"""
+        self.create_price()
+        result = StripeService.create_checkout_session_async(
+            self.user, self.course.id, 'https://example.com/success', 'https://example.com/cancel'
+        )
+        error = stripe.error.InvalidRequestError('Неверный параметр', 'price')
+        with patch('stripe.checkout.Session.create', side_effect=error):
+            with self.assertLogs('lms.tasks', level='ERROR'):
+                self.assertFalse(self.run_outbox_task('lms.tasks.push_checkout_session', push_checkout_session))
+        payment_session = PaymentSession.objects.get(pk=result['payment_session_id'])
+        self.assertEqual(payment_session.status, 'failed')
+        self.assertIn('Неверный параметр', payment_session.error)
+
+
+class ActivePriceTest(APITestCase):
+    """Тесты единственной активной цены продукта и ее кэширования"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', owner=self.user)
+        self.product = StripeProduct.objects.create(course=self.course, stripe_product_id='prod_test123', name='Test Product')
+        self.price = StripePrice.objects.create(
+            product=self.product, stripe_price_id='price_old', amount=100.00, currency='usd'
+        )
+    
+    def test_one_active_price(self):
+        """Вторая активная цена продукта запрещена на уровне БД"""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StripePrice.objects.create(product=self.product, stripe_price_id='price_dup', amount=50, currency='usd')
+    
+    @patch('stripe.Price.create', return_value=MagicMock(id='price_new'))
+    def test_new_price_replaces_active(self, mock_create):
+        """Новая цена становится активной вместо прежней, кэш сбрасывается"""
+        self.assertEqual(get_active_price(self.course.id)['stripe_price_id'], 'price_old')
+        with self.assertNumQueries(0):
+            get_active_price(self.course.id)
+        
+        new_price = StripeService.create_price(self.product.id, Decimal('150.00'))
+        self.price.refresh_from_db()
+        self.assertFalse(self.price.is_active)
+        self.assertEqual(get_active_price(self.course.id)['id'], new_price.id)
+    
+    def test_async_price_activated_after_sync(self):
+        """Асинхронная цена становится активной только после создания в Stripe"""
+        price = StripeService.create_price_async(self.product.id, Decimal('150.00'))
+        self.assertFalse(price.is_active)
+        self.assertEqual(get_active_price(self.course.id)['id'], self.price.id)
+        
+        with patch('stripe.Price.create', return_value=MagicMock(id='price_async')):
+            push_stripe_price(price.pk)
+        price.refresh_from_db()
+        self.price.refresh_from_db()
+        self.assertTrue(price.is_active)
+        self.assertFalse(self.price.is_active)
+        self.assertEqual(get_active_price(self.course.id)['stripe_price_id'], 'price_async')
+    
+    def test_deactivated_price_not_used_for_checkout(self):
+        """Деактивированная вручную цена сразу исчезает из кэша"""
+        get_active_price(self.course.id)
+        self.price.is_active = False
+        self.price.save()
+        self.assertIsNone(get_active_price(self.course.id))
+        with self.assertRaisesMessage(Exception, 'не найдена активная цена'):
+            StripeService.create_checkout_session(
+                self.user, self.course.id, 'https://example.com/success', 'https://example.com/cancel'
+            )
+    
+    def test_course_list_shows_price(self):
+        """Список курсов показывает активную цену"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('course-list'))
+        self.assertEqual(response.data['results'][0]['price'], {'amount': '100.00', 'currency': 'usd'})
+
+
+class MockStripeHandler(BaseHTTPRequestHandler):
+    """Локальный mock Stripe API: отвечает продуктом, при необходимости с задержкой"""
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    delay = 0
+    requests = []
+    idempotent_ids = {}
+    ids = itertools.count(1)
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        type(self).requests.append((self.path, self.client_address[1]))
+        time.sleep(self.delay)
+        # Как и Stripe, повтор с тем же ключом идемпотентности возвращает тот же объект
+        object_id = f'prod_mock{next(self.ids)}'
+        object_id = self.idempotent_ids.setdefault(self.headers.get('Idempotency-Key') or object_id, object_id)
+        body = json.dumps({'id': object_id, 'object': 'product'}).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Клиент не дождался ответа
+    
+    def log_message(self, *args):
+        pass
+
+
+class MockStripeServerMixin:
+    """Запускает локальный mock Stripe API и направляет на него клиент stripe"""
+    
+    def start_mock_stripe(self):
+        MockStripeHandler.delay = 0
+        MockStripeHandler.requests = []
+        MockStripeHandler.idempotent_ids = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockStripeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        
+        settings_override = self.settings(
+            STRIPE_API_BASE=f'http://127.0.0.1:{self.server.server_port}',
+            STRIPE_READ_TIMEOUT=0.2,
+            STRIPE_MAX_NETWORK_RETRIES=0,
+        )
+        settings_override.enable()
+        configure_stripe()
+        # Восстанавливаем настройки клиента после теста
+        self.addCleanup(configure_stripe)
+        self.addCleanup(settings_override.disable)
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+
+
+class StripeClientTest(MockStripeServerMixin, APITestCase):
+    """Тесты HTTP-клиента Stripe против локального mock-сервера"""
+    
+    def setUp(self):
+        self.start_mock_stripe()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.courses = [
+            Course.objects.create(title=f'Course {i}', description='Description', owner=self.user)
+            for i in range(2)
+        ]
+    
+    def test_connection_reuse(self):
+        """Запросы идут через одно keep-alive соединение"""
+        for course in self.courses:
+            product = StripeService.create_product(course.id, course.title)
+            self.assertTrue(product.stripe_product_id.startswith('prod_mock'))
+        paths = [path for path, _ in MockStripeHandler.requests]
+        ports = {port for _, port in MockStripeHandler.requests}
+        self.assertEqual(paths, ['/v1/products', '/v1/products'])
+        self.assertEqual(len(ports), 1)
+    
+    def test_circuit_breaker(self):
+        """После серии таймаутов запросы отклоняются без обращения к Stripe"""
+        MockStripeHandler.delay = 0.5
+        for _ in range(breaker.failure_threshold):
+            with self.assertRaises(StripeUnavailable):
+                StripeService.create_product(self.courses[0].id, 'Course')
+        self.assertTrue(breaker.is_open)
+        
+        calls = len(MockStripeHandler.requests)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(
+            reverse('stripeproduct-create-product'),
+            {'course_id': self.courses[0].id, 'name': 'Course'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(len(MockStripeHandler.requests), calls)
+        self.assertFalse(StripeProduct.objects.exists())
+
+
+class StripeCatalogSyncTest(MockStripeServerMixin, TransactionTestCase):
+    """Тесты массовой синхронизации каталога Stripe против локального mock-сервера"""
+    
+    def setUp(self):
+        self.start_mock_stripe()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.courses = [
+            Course.objects.create(title=f'Course {i}', description='Description', owner=self.user)
+            for i in range(5)
+        ]
+        # Курс, у которого продукт уже есть, синхронизация не трогает
+        StripeProduct.objects.create(course=self.courses[0], stripe_product_id='prod_existing', name='Course 0')
+    
+    def sync(self):
+        call_command(
+            'sync_stripe_catalog', '--amount', '49.90', '--workers', '3', '--rate-limit', '0',
+            '--batch-size', '2', stdout=StringIO()
+        )
+    
+    def assert_synced(self):
+        products = StripeProduct.objects.exclude(stripe_product_id='prod_existing')
+        self.assertEqual(products.count(), 4)
+        self.assertFalse(products.exclude(sync_status='synced').exists())
+        prices = StripePrice.objects.filter(product__in=products)
+        self.assertEqual(prices.count(), 4)
+        self.assertEqual(set(prices.values_list('sync_status', 'amount').distinct()), {('synced', Decimal('49.90'))})
+    
+    def test_sync_catalog(self):
+        """Для каждого курса без продукта создаются продукт и цена"""
+        self.sync()
+        self.assert_synced()
+        paths = sorted(path for path, _ in MockStripeHandler.requests)
+        self.assertEqual(paths, ['/v1/prices'] * 4 + ['/v1/products'] * 4)
+        
+        self.sync()
+        self.assertEqual(len(MockStripeHandler.requests), 8)
+    
+    def test_resume_after_outage(self):
+        """Прерванная синхронизация продолжается без дублей"""
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        with self.assertLogs('lms.stripe_catalog', level='WARNING'):
+            with self.assertRaises(CommandError):
+                self.sync()
+        self.assertEqual(StripeProduct.objects.filter(sync_status='pending').count(), 4)
+        self.assertEqual(MockStripeHandler.requests, [])
+        
+        breaker.reset()
+        self.sync()
+        self.assert_synced()
+        self.assertEqual(len(MockStripeHandler.requests), 8)
+    
+    def test_rate_limiter(self):
+        """Лимитер равномерно распределяет запросы во времени"""
+        limiter = RateLimiter(50)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda _: limiter.acquire(), range(6)))
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTest(APITestCase):
+    """Тесты webhook Stripe"""
+    
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@test.com', password='testpass123')
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', owner=self.owner)
+        self.payment_session = PaymentSession.objects.create(
+            user=self.user, course=self.course, stripe_session_id='cs_test_1', amount='100.00'
+        )
+        self.url = reverse('stripe-webhook')
+    
+    def post_event(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            self.url, payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}'
+        )
+    
+    def completed_event(self, event_id='evt_1'):
+        return {
+            'id': event_id,
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'id': 'cs_test_1', 'object': 'checkout.session', 'payment_status': 'paid'}},
+        }
+    
+    def test_invalid_signature(self):
+        """Событие с неверной подписью отклоняется"""
+        response = self.post_event(self.completed_event(), secret='whsec_wrong')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+    
+    def test_event_is_deduplicated(self):
+        """Повторная доставка события не ставит его в обработку второй раз"""
+        self.assertEqual(self.post_event(self.completed_event()).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.post_event(self.completed_event()).status_code, status.HTTP_200_OK)
+        stripe_event = StripeEvent.objects.get()
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.task_name, 'lms.tasks.process_stripe_event')
+        self.assertEqual(event.args, [stripe_event.pk])
+    
+    def test_processing_grants_access(self):
+        """Обработка события обновляет статус, создает платеж и подписку"""
+        self.post_event(self.completed_event())
+        stripe_event = StripeEvent.objects.get()
+        self.assertTrue(process_stripe_event(stripe_event.pk))
+        self.assertFalse(process_stripe_event(stripe_event.pk))
+        self.payment_session.refresh_from_db()
+        self.assertEqual(self.payment_session.status, 'paid')
+        
+        payment_event = OutboxEvent.objects.get(task_name='lms.tasks.process_payment_event')
+        process_payment_event(*payment_event.args)
+        self.assertTrue(Payment.objects.filter(user=self.user, paid_course=self.course).exists())
+        self.assertTrue(
+            CourseSubscription.objects.filter(user=self.user, course=self.course, is_active=True).exists()
+        )
+
+
+class PaymentStatusCacheTest(APITestCase):
+    """Тесты кэширования статуса сессии оплаты"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', owner=self.user)
+        self.client.force_authenticate(user=self.user)
+    
+    def create_session(self, session_status):
+        payment_session = PaymentSession.objects.create(
+            user=self.user, course=self.course, stripe_session_id=f'cs_{session_status}',
+            amount='100.00', status=session_status
+        )
+        return reverse('paymentsession-get-status', kwargs={'pk': payment_session.pk})
+    
+    @patch('lms.stripe_service.StripeService.get_session_status')
+    def test_terminal_status_from_db(self, mock_get_status):
+        """Конечный статус отдается из БД без запроса к Stripe"""
+        response = self.client.get(self.create_session('paid'))
+        self.assertEqual(response.data['status'], 'paid')
+        self.assertEqual(response.data['source'], 'db')
+        mock_get_status.assert_not_called()
+    
+    @patch('lms.stripe_service.StripeService.get_session_status', return_value='unpaid')
+    def test_failed_status_is_terminal(self, mock_get_status):
+        """Отклоненная оплата не опрашивается и не перезаписывается поздним статусом"""
+        response = self.client.get(self.create_session('failed'))
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['source'], 'db')
+        mock_get_status.assert_not_called()
+        
+        StripeService.update_payment_status('cs_failed', 'unpaid')
+        self.assertEqual(PaymentSession.objects.get().status, 'failed')
+        self.assertFalse(OutboxEvent.objects.exists())
+    
+    @patch('lms.stripe_service.StripeService.get_session_status', return_value='unpaid')
+    def test_pending_status_cached(self, mock_get_status):
+        """Неконечный статус кэшируется"""
+        url = self.create_session('pending')
+        self.assertEqual(self.client.get(url).data['source'], 'stripe')
+        response = self.client.get(url)
+        self.assertEqual(response.data['source'], 'cache')
+        self.assertEqual(response.data['status'], 'unpaid')
+        mock_get_status.assert_called_once()
+    
+    @patch('lms.stripe_service.StripeService.get_session_status', return_value='paid')
+    def test_terminal_status_saved(self, mock_get_status):
+        """Конечный статус из Stripe сохраняется в БД"""
+        url = self.create_session('pending')
+        self.assertEqual(self.client.get(url).data['source'], 'stripe')
+        self.assertEqual(self.client.get(url).data['source'], 'db')
+        self.assertEqual(PaymentSession.objects.get().status, 'paid')
+    
+    def test_single_flight(self):
+        """Одновременные запросы по одной сессии делают один запрос к Stripe"""
+        payment_session = PaymentSession(stripe_session_id='cs_concurrent', status='pending')
+        
+        def slow_status(session_id):
+            time.sleep(0.2)
+            return 'unpaid'
+        
+        with patch('lms.stripe_service.StripeService.get_session_status', side_effect=slow_status) as mock_get_status:
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                results = list(executor.map(
+                    lambda _: StripeService.get_cached_session_status(payment_session), range(5)
+                ))
+        mock_get_status.assert_called_once()
+        self.assertEqual(sorted(source for _, source in results), ['cache'] * 4 + ['stripe'])
+
+
+@override_settings(PAYMENT_RECONCILE_BATCH_SIZE=2, PAYMENT_RECONCILE_AFTER_MINUTES=30)
+class ReconcilePaymentSessionsTest(TestCase):
+    """Тесты сверки незавершенных сессий оплаты"""
+    
+    def setUp(self):
+        breaker.reset()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Test Course', description='Test Description', owner=self.user)
+        self.stripe_statuses = {}
+    
+    def create_session(self, session_id, session_status, stripe_status, minutes_ago=60):
+        payment_session = PaymentSession.objects.create(
+            user=self.user, course=self.course, stripe_session_id=session_id,
+            amount='100.00', status=session_status
+        )
+        PaymentSession.objects.filter(pk=payment_session.pk).update(
+            created_at=timezone.now() - timedelta(minutes=minutes_ago)
+        )
+        self.stripe_statuses[session_id] = stripe_status
+        return payment_session
+    
+    def get_status(self, session_id):
+        if self.stripe_statuses[session_id] is None:
+            raise Exception('Stripe error')
+        return self.stripe_statuses[session_id]
+    
+    def test_reconcile(self):
+        """Старые незавершенные сессии сверяются пачками, оплаченные ставятся в обработку"""
+        paid = self.create_session('cs_paid', 'pending', 'paid')
+        expired = self.create_session('cs_expired', 'unpaid', 'expired')
+        unchanged = self.create_session('cs_unchanged', 'unpaid', 'unpaid')
+        failed = self.create_session('cs_error', 'pending', None)
+        fresh = self.create_session('cs_fresh', 'pending', 'paid', minutes_ago=5)
+        done = self.create_session('cs_done', 'paid', 'paid')
+        
+        with patch('lms.stripe_service.StripeService.get_session_status', side_effect=self.get_status) as mock_get_status:
+            with self.assertLogs('lms.tasks', level='INFO'):
+                stats = reconcile_payment_sessions()
+        
+        self.assertEqual(mock_get_status.call_count, 4)
+        self.assertEqual(
+            {key: stats[key] for key in ('checked', 'api_calls', 'errors', 'updated')},
+            {'checked': 4, 'api_calls': 4, 'errors': 1, 'updated': 2}
+        )
+        expected = {paid: 'paid', expired: 'expired', unchanged: 'unpaid', failed: 'pending', fresh: 'pending', done: 'paid'}
+        for payment_session, expected_status in expected.items():
+            payment_session.refresh_from_db()
+            self.assertEqual(payment_session.status, expected_status)
+        self.assertEqual(
+            sorted(OutboxEvent.objects.values_list('args', flat=True)),
+            sorted([[paid.pk, 'paid'], [expired.pk, 'expired']])
+        )
+    
+    def test_stops_when_stripe_unavailable(self):
+        """Сверка прекращается, если Stripe недоступен"""
+        for index in range(4):
+            self.create_session(f'cs_{index}', 'pending', 'paid')
+        unavailable = StripeUnavailable('Stripe временно недоступен')
+        with patch('lms.stripe_service.StripeService.get_session_status', side_effect=unavailable) as mock_get_status:
+            with self.assertLogs('lms.tasks', level='WARNING'):
+                stats = reconcile_payment_sessions()
+        self.assertLessEqual(mock_get_status.call_count, 2)
+        self.assertEqual(stats['checked'], 2)
+        self.assertEqual(stats['updated'], 0)
+        self.assertFalse(PaymentSession.objects.exclude(status='pending').exists())
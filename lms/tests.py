@@ -1,12 +1,34 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from .models import Course, Lesson, CourseSubscription
+from .models import Course, Lesson, CourseSubscription, OutboxEvent, PaymentSession
+from .counters import recount_course_counters
+from .tasks import (
+    get_subscription_ranges, send_course_update_email, send_course_update_chunk, flush_course_updates,
+    send_course_digests, process_payment_event, deactivate_inactive_users, DEACTIVATE_USERS_CHECKPOINT_KEY,
+    DEACTIVATE_USERS_CHECKPOINT_TIMEOUT, DEACTIVATE_USERS_LOCK_KEY
+)
+from .outbox import enqueue, relay_outbox
+from .stripe_service import StripeService
+from users.models import Payment
+from users.revocation import REVOKED_INACTIVE, get_revocation
+from .notifications import notify_course_update
 from .validators import validate_youtube_url
 from django.core.exceptions import ValidationError
+from unittest.mock import patch
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.core.management import call_command
 
 User = get_user_model()
 
@@ -272,3 +294,754 @@ class PaginationTest(APITestCase):
         response = self.client.get(url, {'page_size': 5})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 5)
+
+
+class CourseQueryCountTest(APITestCase):
+    """Тесты количества запросов при получении списка курсов"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.owner = User.objects.create_user(
+            email='owner@test.com',
+            password='testpass123'
+        )
+        self.subscriber = User.objects.create_user(
+            email='subscriber@test.com',
+            password='testpass123'
+        )
+        Group.objects.create(name='Модераторы').user_set.add(self.subscriber)
+    
+    def create_courses(self, count):
+        for i in range(count):
+            course = Course.objects.create(
+                title=f'Course {i}',
+                description=f'Description {i}',
+                owner=self.owner
+            )
+            for j in range(3):
+                Lesson.objects.create(
+                    title=f'Lesson {i}.{j}',
+                    description='Description',
+                    video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                    course=course,
+                    owner=self.owner
+                )
+            CourseSubscription.objects.create(user=self.subscriber, course=course)
+        recount_course_counters()
+    
+    def test_course_list_query_count_is_constant(self):
+        """Число запросов не зависит от размера страницы"""
+        self.client.force_authenticate(user=self.subscriber)
+        url = reverse('course-list')
+        self.create_courses(2)
+        # роли пользователя, валидатор кэша, count, курсы с аннотациями, уроки,
+        # цены курсов, которых еще нет в кэше
+        with self.assertNumQueries(6):
+            response = self.client.get(url, {'page_size': 50, 'expand': 'lessons'})
+        self.assertEqual(len(response.data['results']), 2)
+        
+        self.create_courses(20)
+        # роли берутся из кэша
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'page_size': 50, 'expand': 'lessons'})
+        self.assertEqual(len(response.data['results']), 22)
+    
+    def test_course_list_uses_annotations(self):
+        """Счетчики берутся из колонок курса, признак подписки из аннотации"""
+        self.create_courses(1)
+        self.client.force_authenticate(user=self.subscriber)
+        response = self.client.get(reverse('course-list'), {'expand': 'lessons'})
+        course_data = response.data['results'][0]
+        self.assertEqual(course_data['lessons_count'], 3)
+        self.assertEqual(course_data['active_subscribers_count'], 1)
+        self.assertTrue(course_data['is_subscribed'])
+        self.assertEqual(len(course_data['lessons']), 3)
+
+
+class KeysetPaginationTest(APITestCase):
+    """Тесты курсорной пагинации"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            title='Course',
+            description='Description',
+            owner=self.user
+        )
+        for i in range(7):
+            Lesson.objects.create(
+                title=f'Lesson {i}',
+                description='Description',
+                video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                course=self.course,
+                owner=self.user
+            )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_walk_all_pages(self):
+        """Обход всех страниц по курсору без пропусков и повторов"""
+        url = reverse('lesson-list')
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 3})
+        self.assertNotIn('count', response.data)
+        titles = [lesson['title'] for lesson in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            titles.extend(lesson['title'] for lesson in response.data['results'])
+        self.assertEqual(titles, [f'Lesson {i}' for i in range(7)])
+    
+    def test_optional_count(self):
+        """Общее количество возвращается только по запросу"""
+        url = reverse('lesson-list')
+        response = self.client.get(url, {'pagination': 'cursor', 'count': 'exact'})
+        self.assertEqual(response.data['count'], 7)
+        response = self.client.get(url, {'pagination': 'cursor', 'count': 'estimate'})
+        self.assertIsInstance(response.data['count'], int)
+    
+    def test_invalid_cursor(self):
+        """Некорректный курсор"""
+        url = reverse('lesson-list')
+        response = self.client.get(url, {'pagination': 'cursor', 'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_page_number_pagination_by_default(self):
+        """Без параметра используется постраничная пагинация"""
+        response = self.client.get(reverse('lesson-list'))
+        self.assertEqual(response.data['count'], 7)
+        self.assertIn('previous', response.data)
+
+
+class ResponseCacheTest(APITestCase):
+    """Тесты кэширования ответов и ETag"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            title='Course',
+            description='Description',
+            owner=self.user
+        )
+        self.lesson = Lesson.objects.create(
+            title='Lesson',
+            description='Description',
+            video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            course=self.course,
+            owner=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('course-detail', kwargs={'pk': self.course.pk})
+    
+    def test_not_modified(self):
+        """Повторный запрос с If-None-Match получает 304 без сериализации"""
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        # только валидатор кэша, роли уже в кэше
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_cached_response(self):
+        """Повторный запрос отдается из кэша"""
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    def test_lesson_update_changes_course_etag(self):
+        """Изменение урока меняет ETag курса и списка курсов"""
+        detail_etag = self.client.get(self.url)['ETag']
+        list_etag = self.client.get(reverse('course-list'))['ETag']
+        response = self.client.patch(
+            reverse('lesson-detail', kwargs={'pk': self.lesson.pk}),
+            {'title': 'Updated lesson'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['lessons'][0]['title'], 'Updated lesson')
+        response = self.client.get(reverse('course-list'), HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_paid_event_changes_cached_course(self):
+        """Обработка оплаты сбрасывает закэшированный ответ курса покупателя"""
+        # Модератор видит чужие курсы, поэтому может быть покупателем в тесте
+        buyer = User.objects.create_user(email='buyer@test.com', password='testpass123')
+        buyer.groups.add(Group.objects.create(name='Модераторы'))
+        self.client.force_authenticate(user=buyer)
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertFalse(response.data['is_subscribed'])
+        self.assertEqual(response.data['active_subscribers_count'], 0)
+        
+        payment_session = PaymentSession.objects.create(
+            user=buyer, course=self.course, stripe_session_id='cs_test_1', amount='100.00', status='paid'
+        )
+        process_payment_event(payment_session.pk, 'paid')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(response.data['active_subscribers_count'], 1)
+    
+    def test_malformed_pk(self):
+        """Некорректный id курса или урока дает 404, а не ошибку сервера"""
+        for basename in ('course', 'lesson'):
+            response = self.client.get(reverse(f'{basename}-detail', kwargs={'pk': 'abc'}))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_etag_depends_on_user(self):
+        """Разные пользователи получают разные ETag"""
+        etag = self.client.get(self.url)['ETag']
+        moderator = User.objects.create_user(email='moderator@test.com', password='testpass123')
+        moderator.groups.add(Group.objects.create(name='Модераторы'))
+        self.client.force_authenticate(user=moderator)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class SparseFieldsetsTest(APITestCase):
+    """Тесты выборочных полей ответа"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            title='Course',
+            description='Long description',
+            owner=self.user
+        )
+        Lesson.objects.create(
+            title='Lesson',
+            description='Description',
+            video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            course=self.course,
+            owner=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_lessons_not_nested_in_list_by_default(self):
+        """В списке курсов уроки выводятся только по ?expand=lessons"""
+        response = self.client.get(reverse('course-list'))
+        self.assertNotIn('lessons', response.data['results'][0])
+        response = self.client.get(reverse('course-detail', kwargs={'pk': self.course.pk}))
+        self.assertEqual(len(response.data['lessons']), 1)
+    
+    def test_fields_limit_response_and_sql(self):
+        """?fields= ограничивает ответ и выбираемые колонки"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('course-list'), {'fields': 'id,title'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+        course_query = context.captured_queries[-1]['sql']
+        self.assertIn('"lms_course"."title"', course_query)
+        self.assertNotIn('"lms_course"."description"', course_query)
+        self.assertNotIn('lms_lesson', course_query)
+
+
+class LessonBulkTest(APITestCase):
+    """Тесты массовых операций с уроками"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.other = User.objects.create_user(
+            email='other@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            title='Course',
+            description='Description',
+            owner=self.user
+        )
+        self.url = reverse('lesson-bulk')
+        self.client.force_authenticate(user=self.user)
+    
+    def lesson_data(self, i):
+        return {
+            'title': f'Lesson {i}',
+            'description': 'Description',
+            'video_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            'course': self.course.pk
+        }
+    
+    def test_bulk_create(self):
+        """Уроки создаются одним запросом, уведомление одно на курс"""
+        data = [self.lesson_data(i) for i in range(50)]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 50)
+        self.assertEqual(Lesson.objects.filter(course=self.course, owner=self.user).count(), 50)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.task_name, 'lms.tasks.record_course_update')
+        course_id, lesson_ids = event.args
+        self.assertEqual(course_id, self.course.pk)
+        self.assertEqual(sorted(lesson_ids), [lesson['id'] for lesson in response.data])
+    
+    def test_bulk_create_is_atomic(self):
+        """Ошибка в одном уроке отменяет создание всех"""
+        data = [self.lesson_data(1), dict(self.lesson_data(2), video_url='https://vimeo.com/1')]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Lesson.objects.count(), 0)
+        self.assertFalse(OutboxEvent.objects.exists())
+    
+    def test_bulk_update(self):
+        """Массовое частичное обновление"""
+        lessons = [Lesson.objects.create(owner=self.user, **dict(self.lesson_data(i), course=self.course)) for i in range(3)]
+        data = [{'id': lesson.pk, 'title': f'Updated {lesson.pk}'} for lesson in lessons]
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for lesson in lessons:
+            lesson.refresh_from_db()
+            self.assertEqual(lesson.title, f'Updated {lesson.pk}')
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+    
+    def test_bulk_update_foreign_lesson(self):
+        """Чужие уроки обновить нельзя"""
+        lesson = Lesson.objects.create(owner=self.other, **dict(self.lesson_data(1), course=self.course))
+        response = self.client.patch(self.url, [{'id': lesson.pk, 'title': 'Hacked'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        lesson.refresh_from_db()
+        self.assertEqual(lesson.title, 'Lesson 1')
+    
+    def test_bulk_delete(self):
+        """Массовое удаление"""
+        lessons = [Lesson.objects.create(owner=self.user, **dict(self.lesson_data(i), course=self.course)) for i in range(3)]
+        response = self.client.delete(self.url, {'ids': [lesson.pk for lesson in lessons[:2]]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Lesson.objects.values_list('pk', flat=True)), [lessons[2].pk])
+
+
+class SubscriptionUpsertTest(APITestCase):
+    """Тесты подписки одним запросом"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.author = User.objects.create_user(
+            email='author@test.com',
+            password='testpass123'
+        )
+        self.courses = [
+            Course.objects.create(title=f'Course {i}', description='Description', owner=self.author)
+            for i in range(3)
+        ]
+        self.own_course = Course.objects.create(title='Own', description='Description', owner=self.user)
+        self.client.force_authenticate(user=self.user)
+    
+    def test_subscribe_single_statement(self):
+        """Подписка выполняется одним запросом"""
+        url = reverse('course-subscribe', kwargs={'pk': self.courses[0].pk})
+        with self.assertNumQueries(1):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['course'], self.courses[0].pk)
+        
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_resubscribe_restores(self):
+        """Повторная подписка восстанавливает неактивную подписку"""
+        CourseSubscription.objects.create(user=self.user, course=self.courses[0], is_active=False)
+        url = reverse('course-subscribe', kwargs={'pk': self.courses[0].pk})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(CourseSubscription.objects.get(user=self.user, course=self.courses[0]).is_active, True)
+    
+    def test_subscribe_missing_course(self):
+        """Подписка на несуществующий курс"""
+        response = self.client.post(reverse('course-subscribe', kwargs={'pk': 999999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_unsubscribe_single_statement(self):
+        """Отписка выполняется одним запросом"""
+        CourseSubscription.objects.create(user=self.user, course=self.courses[0])
+        url = reverse('course-unsubscribe', kwargs={'pk': self.courses[0].pk})
+        with self.assertNumQueries(1):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(reverse('course-unsubscribe', kwargs={'pk': self.courses[1].pk}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_batch_subscribe_and_unsubscribe(self):
+        """Массовая подписка пропускает собственные и несуществующие курсы"""
+        course_ids = [course.pk for course in self.courses] + [self.own_course.pk, 999999]
+        response = self.client.post(reverse('course-subscribe-batch'), {'course_ids': course_ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['subscribed']), [course.pk for course in self.courses])
+        self.assertEqual(sorted(response.data['skipped']), [self.own_course.pk, 999999])
+        self.assertEqual(CourseSubscription.objects.filter(user=self.user, is_active=True).count(), 3)
+        
+        response = self.client.post(
+            reverse('course-unsubscribe-batch'),
+            {'course_ids': [self.courses[0].pk, self.courses[1].pk]},
+            format='json'
+        )
+        self.assertEqual(sorted(response.data['unsubscribed']), [self.courses[0].pk, self.courses[1].pk])
+        self.assertEqual(CourseSubscription.objects.filter(user=self.user, is_active=True).count(), 1)
+
+
+class CourseCountersTest(APITestCase):
+    """Тесты денормализованных счетчиков курса"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.author = User.objects.create_user(
+            email='author@test.com',
+            password='testpass123'
+        )
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(title='Course', description='Description', owner=self.author)
+    
+    def lesson_data(self, i):
+        return {
+            'title': f'Lesson {i}',
+            'description': 'Description',
+            'video_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            'course': self.course.pk
+        }
+    
+    def test_lessons_count(self):
+        """Счетчик уроков меняется при создании и удалении уроков"""
+        self.client.force_authenticate(user=self.author)
+        response = self.client.post(reverse('lesson-list'), self.lesson_data(1))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('lesson-bulk'), [self.lesson_data(i) for i in range(3)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lessons_count, 4)
+        
+        ids = list(Lesson.objects.values_list('pk', flat=True))
+        self.client.delete(reverse('lesson-detail', kwargs={'pk': ids[0]}))
+        self.client.delete(reverse('lesson-bulk'), {'ids': ids[1:3]}, format='json')
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lessons_count, 1)
+    
+    def test_subscribers_count(self):
+        """Счетчик подписчиков меняется при подписке и отписке"""
+        self.client.force_authenticate(user=self.user)
+        self.client.post(reverse('course-subscribe', kwargs={'pk': self.course.pk}))
+        self.client.post(reverse('course-subscribe', kwargs={'pk': self.course.pk}))
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.active_subscribers_count, 1)
+        
+        self.client.delete(reverse('course-unsubscribe', kwargs={'pk': self.course.pk}))
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.active_subscribers_count, 0)
+        
+        course = Course.objects.create(title='Other', description='Description', owner=self.author)
+        response = self.client.post(reverse('coursesubscription-list'), {'course': course.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        course.refresh_from_db()
+        self.assertEqual(course.active_subscribers_count, 1)
+        self.client.delete(reverse('coursesubscription-detail', kwargs={'pk': response.data['id']}))
+        course.refresh_from_db()
+        self.assertEqual(course.active_subscribers_count, 0)
+    
+    def test_recount_command(self):
+        """Команда пересчета исправляет рассинхронизацию"""
+        Lesson.objects.create(owner=self.author, **dict(self.lesson_data(1), course=self.course))
+        CourseSubscription.objects.create(user=self.user, course=self.course)
+        Course.objects.filter(pk=self.course.pk).update(lessons_count=10, active_subscribers_count=10)
+        call_command('recount_course_counters', batch_size=1, stdout=StringIO())
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lessons_count, 1)
+        self.assertEqual(self.course.active_subscribers_count, 1)
+
+
+class QueryPlansTest(TestCase):
+    """Проверка планов основных запросов"""
+    
+    def test_queries_use_expected_indexes(self):
+        """На реалистичных данных запросы выбирают ожидаемые индексы, данные не сохраняются"""
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Все запросы используют ожидаемые индексы', out.getvalue())
+        self.assertNotIn('Seq Scan', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+
+class CourseUpdateEmailTest(TestCase):
+    """Тесты рассылки об обновлении курса"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.owner = User.objects.create_user(email='owner@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Course', description='Description', owner=self.owner)
+        self.subscriptions = [
+            CourseSubscription.objects.create(
+                user=User.objects.create_user(email=f'user{i}@test.com', password='testpass123'),
+                course=self.course
+            )
+            for i in range(5)
+        ]
+    
+    def test_subscription_ranges(self):
+        """Подписки делятся на диапазоны id заданного размера"""
+        ids = [subscription.pk for subscription in self.subscriptions]
+        self.assertEqual(
+            get_subscription_ranges(self.course.pk, 2),
+            [(ids[0], ids[1]), (ids[2], ids[3]), (ids[4], ids[4])]
+        )
+    
+    @override_settings(COURSE_UPDATE_EMAIL_CHUNK_SIZE=2)
+    @patch('lms.tasks.chord')
+    def test_fan_out(self, mock_chord):
+        """Каждый диапазон отправляется отдельной задачей"""
+        self.assertEqual(send_course_update_email(self.course.pk, 'course', self.course.pk), 3)
+        header = list(mock_chord.call_args.args[0])
+        self.assertEqual(len(header), 3)
+        self.assertEqual(header[0].task, 'lms.tasks.send_course_update_chunk')
+    
+    def test_chunk_reports_failures(self):
+        """Ошибка одного адреса не прерывает отправку остальных"""
+        send_messages = mail.get_connection().__class__.send_messages
+        
+        def fail_for_user3(connection, messages):
+            if messages[0].to == ['user3@test.com']:
+                raise ConnectionError('SMTP error')
+            return send_messages(connection, messages)
+        
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', fail_for_user3), \
+                self.assertLogs('lms.tasks', level='ERROR'):
+            result = send_course_update_chunk(
+                self.course.pk, self.subscriptions[0].pk, self.subscriptions[-1].pk, 'Subject', 'Body'
+            )
+        self.assertEqual(result, {'sent': 4, 'failed': 1})
+        self.assertEqual(len(mail.outbox), 4)
+
+
+@override_settings(COURSE_UPDATE_DEBOUNCE_SECONDS=60)
+class CourseUpdateDebounceTest(TestCase):
+    """Тесты объединения уведомлений об изменениях курса"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        owner = User.objects.create_user(email='owner@test.com', password='testpass123')
+        self.course = Course.objects.create(title='Course', description='Description', owner=owner)
+        self.lessons = [
+            Lesson.objects.create(
+                title=f'Lesson {i}',
+                description='Description',
+                video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+                course=self.course,
+                owner=owner
+            )
+            for i in range(3)
+        ]
+        # Окна и накопленные изменения хранятся в кэше (в тестах - локальном)
+        cache.clear()
+    
+    @patch('lms.tasks.send_course_update_email.delay')
+    @patch('lms.notifications.flush_course_updates.apply_async')
+    def test_updates_are_coalesced(self, mock_apply_async, mock_delay):
+        """Изменения за окно превращаются в одно уведомление со списком уроков"""
+        for lesson in self.lessons:
+            notify_course_update(self.course.pk, [lesson.pk])
+        notify_course_update(self.course.pk, [self.lessons[0].pk])
+        notify_course_update(self.course.pk)
+        mock_apply_async.assert_called_once_with((self.course.pk,), countdown=60)
+        
+        self.assertEqual(flush_course_updates(self.course.pk), 3)
+        mock_delay.assert_called_once_with(self.course.pk, 'lessons', [lesson.pk for lesson in self.lessons])
+        
+        # После отправки окно открывается заново
+        self.assertEqual(flush_course_updates(self.course.pk), 0)
+        notify_course_update(self.course.pk)
+        self.assertEqual(mock_apply_async.call_count, 2)
+    
+    @patch('lms.tasks.chord')
+    def test_email_lists_lessons(self, mock_chord):
+        """Письмо перечисляет все измененные уроки"""
+        CourseSubscription.objects.create(
+            user=User.objects.create_user(email='user@test.com', password='testpass123'),
+            course=self.course
+        )
+        send_course_update_email(self.course.pk, 'lessons', [lesson.pk for lesson in self.lessons[:2]])
+        body = list(mock_chord.call_args.args[0])[0].args[4]
+        self.assertIn('Lesson 0, Lesson 1', body)
+
+
+class CourseDigestTest(TestCase):
+    """Тесты дайджестов обновлений курсов"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.owner = User.objects.create_user(email='owner@test.com', password='testpass123')
+        self.reader = User.objects.create_user(email='reader@test.com', password='testpass123')
+        self.courses = [
+            Course.objects.create(title=f'Course {i}', description='Description', owner=self.owner)
+            for i in range(3)
+        ]
+        for course in self.courses:
+            CourseSubscription.objects.create(
+                user=self.reader, course=course, delivery_mode=CourseSubscription.DELIVERY_DAILY
+            )
+        self.immediate = CourseSubscription.objects.create(
+            user=User.objects.create_user(email='user@test.com', password='testpass123'),
+            course=self.courses[0]
+        )
+        Course.objects.update(updated_at=timezone.now() - timedelta(days=3))
+        CourseSubscription.objects.update(created_at=timezone.now() - timedelta(days=2))
+    
+    def test_digest_covers_all_courses(self):
+        """Один дайджест на пользователя по всем измененным курсам"""
+        self.courses[0].save()
+        Lesson.objects.create(
+            title='New lesson',
+            description='Description',
+            video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            course=self.courses[1],
+            owner=self.owner
+        )
+        with self.assertNumQueries(5):
+            # пачка пользователей, курсы, уроки, отметка об отправке, конец списка
+            result = send_course_digests(CourseSubscription.DELIVERY_DAILY)
+        self.assertEqual(result, {'sent': 1, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@test.com'])
+        self.assertIn('"Course 0": курс обновлен', mail.outbox[0].body)
+        self.assertIn('"Course 1": обновлены уроки: New lesson', mail.outbox[0].body)
+        self.assertNotIn('Course 2', mail.outbox[0].body)
+        
+        # Повторно те же изменения не отправляются
+        self.assertEqual(send_course_digests(CourseSubscription.DELIVERY_DAILY), {'sent': 0, 'failed': 0})
+    
+    def test_immediate_fan_out_skips_digest_subscriptions(self):
+        """Немедленная рассылка не затрагивает подписки с дайджестом"""
+        self.assertEqual(
+            get_subscription_ranges(self.courses[0].pk, 10),
+            [(self.immediate.pk, self.immediate.pk)]
+        )
+
+
+class OutboxTest(APITestCase):
+    """Тесты отправки задач через outbox"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+    
+    @patch('lms.outbox.app.send_task')
+    def test_course_update_goes_through_outbox(self, mock_send_task):
+        """Задача записывается в транзакции запроса и отправляется диспетчером"""
+        response = self.client.post(reverse('course-list'), {'title': 'Course', 'description': 'Description'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        mock_send_task.assert_not_called()
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.args, [response.data['id']])
+        
+        call_command('relay_outbox', once=True, stdout=StringIO())
+        mock_send_task.assert_called_once()
+        self.assertEqual(mock_send_task.call_args.args, ('lms.tasks.record_course_update',))
+        self.assertEqual(mock_send_task.call_args.kwargs['args'], [response.data['id']])
+        self.assertFalse(OutboxEvent.objects.exists())
+    
+    @patch('lms.outbox.app.send_task', side_effect=ConnectionError('broker is down'))
+    def test_failed_relay_keeps_event(self, mock_send_task):
+        """При недоступном брокере событие остается в outbox"""
+        enqueue('lms.tasks.record_course_update', 1)
+        with self.assertLogs('lms.outbox', level='ERROR'):
+            self.assertEqual(relay_outbox(), 0)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.last_error, 'broker is down')
+    
+    def test_payment_event(self):
+        """Оплата сессии создает событие, обработка события создает платеж один раз"""
+        course = Course.objects.create(title='Course', description='Description', owner=self.user)
+        payment_session = PaymentSession.objects.create(
+            user=self.user, course=course, stripe_session_id='cs_test_1', amount='100.00'
+        )
+        StripeService.update_payment_status('cs_test_1', 'paid')
+        StripeService.update_payment_status('cs_test_1', 'paid')
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.task_name, 'lms.tasks.process_payment_event')
+        self.assertEqual(event.args, [payment_session.pk, 'paid'])
+        
+        self.assertTrue(process_payment_event(*event.args))
+        # Сессия сохраняется повторно (updated_at меняется) - дубля нет
+        payment_session.save()
+        self.assertFalse(process_payment_event(*event.args))
+        payment = Payment.objects.get()
+        self.assertEqual(payment.paid_course, course)
+        self.assertEqual(payment.payment_session, payment_session)
+        self.assertEqual(payment.payment_method, 'card')
+
+
+@override_settings(DEACTIVATE_USERS_BATCH_SIZE=2)
+class DeactivateInactiveUsersTest(TestCase):
+    """Тесты пакетной деактивации неактивных пользователей"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        cache.delete(DEACTIVATE_USERS_CHECKPOINT_KEY)
+        self.addCleanup(cache.delete, DEACTIVATE_USERS_CHECKPOINT_KEY)
+        old_login = timezone.now() - timedelta(days=60)
+        self.stale = [
+            User.objects.create_user(email=f'stale{i}@test.com', password='testpass123', last_login=old_login)
+            for i in range(4)
+        ]
+        self.never = User.objects.create_user(email='never@test.com', password='testpass123')
+        self.recent = User.objects.create_user(
+            email='recent@test.com', password='testpass123', last_login=timezone.now()
+        )
+    
+    def test_batches(self):
+        """Пользователи деактивируются пачками, активные не затрагиваются"""
+        with self.assertLogs('lms.tasks', level='INFO') as logs:
+            self.assertEqual(deactivate_inactive_users(), 5)
+        self.assertEqual(sum('Деактивировано пользователей' in line for line in logs.output), 3)
+        self.assertIn('завершена: 5', logs.output[-1])
+        self.assertEqual(list(User.objects.filter(is_active=True)), [self.recent])
+        self.assertIsNone(cache.get(DEACTIVATE_USERS_CHECKPOINT_KEY))
+        self.assertIsNone(cache.get(DEACTIVATE_USERS_LOCK_KEY))
+        # Выданные деактивированным пользователям access-токены отозваны
+        self.assertEqual(get_revocation(self.never.pk), REVOKED_INACTIVE)
+        self.assertIsNone(get_revocation(self.recent.pk))
+    
+    def test_concurrent_run_skipped(self):
+        """Пока выполняется один запуск, второй ничего не делает"""
+        cache.set(DEACTIVATE_USERS_LOCK_KEY, 1)
+        self.addCleanup(cache.delete, DEACTIVATE_USERS_LOCK_KEY)
+        with self.assertLogs('lms.tasks', level='INFO'):
+            self.assertEqual(deactivate_inactive_users(), 0)
+        self.assertEqual(User.objects.filter(is_active=False).count(), 0)
+    
+    def test_checkpoint_expires_before_next_run(self):
+        """Прогресс не доживает до следующего планового запуска"""
+        interval = settings.CELERY_BEAT_SCHEDULE['deactivate-inactive-users-daily']['schedule']
+        self.assertLessEqual(DEACTIVATE_USERS_CHECKPOINT_TIMEOUT, interval.total_seconds() / 2)
+    
+    def test_resume_from_checkpoint(self):
+        """После падения задача продолжает с сохраненного id"""
+        cache.set(DEACTIVATE_USERS_CHECKPOINT_KEY, {
+            'cutoff': timezone.now() - timedelta(days=30), 'last_id': self.stale[1].pk
+        })
+        with self.assertLogs('lms.tasks', level='INFO'):
+            self.assertEqual(deactivate_inactive_users(), 3)
+        self.assertTrue(User.objects.get(pk=self.stale[0].pk).is_active)
+        self.assertFalse(User.objects.get(pk=self.stale[2].pk).is_active)
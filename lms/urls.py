@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CourseViewSet, LessonViewSet, CourseSubscriptionViewSet
-from .stripe_views import StripeProductViewSet, StripePriceViewSet, PaymentSessionViewSet
+from .stripe_views import StripeProductViewSet, StripePriceViewSet, PaymentSessionViewSet, StripeWebhookView
 
 router = DefaultRouter()
 router.register(r'courses', CourseViewSet)
@@ -12,5 +12,6 @@ router.register(r'stripe/prices', StripePriceViewSet)
 router.register(r'stripe/sessions', PaymentSessionViewSet)
 
 urlpatterns = [
+    path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
     path('', include(router.urls)),
 ]
@@ -1,15 +1,29 @@
+from collections import Counter
+
 from rest_framework import viewsets, status, generics
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 from users.permissions import IsOwnerOrModerator, IsOwnerOrModeratorForCreate, IsOwnerOrModeratorForDelete
+from users.roles import is_moderator
 from .models import Course, Lesson, CourseSubscription
-from .tasks import send_course_update_email
-from .serializers import CourseSerializer, LessonSerializer, LessonListSerializer, CourseSubscriptionSerializer
-from .paginators import CoursePagination, LessonPagination, SubscriptionPagination
+from .outbox import enqueue
+from .cache import CachedResponseMixin, bump_course_versions
+from .counters import change_lessons_count, change_subscribers_count
+from .fieldsets import SparseFieldsetsViewMixin
+from .serializers import (
+    CourseSerializer, LessonSerializer, LessonListSerializer, CourseSubscriptionSerializer, BulkDeleteSerializer,
+    CourseIdsSerializer
+)
+from .paginators import (
+    CoursePagination, LessonPagination, SubscriptionPagination,
+    CourseKeysetPagination, LessonKeysetPagination, SubscriptionKeysetPagination, KeysetPaginationMixin
+)
 
 
 @extend_schema_view(
@@ -58,33 +72,75 @@ from .paginators import CoursePagination, LessonPagination, SubscriptionPaginati
         description="Отписывает текущего пользователя от обновлений курса",
         tags=["Курсы", "Подписки"]
     ),
+    subscribe_batch=extend_schema(
+        summary="Подписаться на несколько курсов",
+        description="Подписывает текущего пользователя на список курсов одним запросом. "
+                    "Собственные, несуществующие курсы и активные подписки пропускаются.",
+        tags=["Курсы", "Подписки"]
+    ),
+    unsubscribe_batch=extend_schema(
+        summary="Отписаться от нескольких курсов",
+        description="Отписывает текущего пользователя от списка курсов одним запросом",
+        tags=["Курсы", "Подписки"]
+    ),
 )
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(CachedResponseMixin, SparseFieldsetsViewMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrModerator]
     pagination_class = CoursePagination
+    keyset_pagination_class = CourseKeysetPagination
+    sparse_required_fields = ('id', 'created_at')
     
-    def get_queryset(self):
+    def get_base_queryset(self):
         # Пользователи видят только свои курсы, модераторы видят все
-        if self.request.user.groups.filter(name='Модераторы').exists():
+        if is_moderator(self.request):
             return Course.objects.all()
         return Course.objects.filter(owner=self.request.user)
     
+    def get_queryset(self):
+        # Признак подписки считается в SQL, уроки подгружаются одним запросом,
+        # чтобы число запросов не зависело от размера страницы. Счетчики уроков
+        # и подписчиков хранятся в самом курсе (lms.counters).
+        # Невостребованные поля (?fields=, ?expand=) не считаются и не загружаются.
+        fields = self.get_response_fields()
+        queryset = self.get_base_queryset().order_by('-created_at')
+        if 'is_subscribed' in fields:
+            queryset = queryset.annotate(
+                is_subscribed=Exists(
+                    CourseSubscription.objects.filter(
+                        course=OuterRef('pk'),
+                        user=self.request.user,
+                        is_active=True
+                    )
+                )
+            )
+        if 'lessons' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('lessons', queryset=Lesson.objects.only(*LessonListSerializer.Meta.fields))
+            )
+        return self.apply_sparse_fields(queryset)
+    
     def perform_create(self, serializer):
         # Только владельцы могут создавать курсы
-        course = serializer.save(owner=self.request.user)
-        # Уведомим подписчиков (если есть) об изменениях курса
-        send_course_update_email.delay(course.id, 'course', course.id)
+        with transaction.atomic():
+            course = serializer.save(owner=self.request.user)
+            # Уведомим подписчиков (если есть) об изменениях курса
+            enqueue('lms.tasks.record_course_update', course.id)
+        bump_course_versions(course.id)
     
     def perform_update(self, serializer):
         # Проверка прав доступа через permission class
-        course = serializer.save()
-        send_course_update_email.delay(course.id, 'course', course.id)
+        with transaction.atomic():
+            course = serializer.save()
+            enqueue('lms.tasks.record_course_update', course.id)
+        bump_course_versions(course.id)
     
     def perform_destroy(self, instance):
         # Проверка прав доступа через permission class
+        course_id = instance.id
         instance.delete()
+        bump_course_versions(course_id)
     
     @action(detail=True, methods=['get'])
     def lessons(self, request, pk=None):
@@ -98,75 +154,114 @@ class CourseViewSet(viewsets.ModelViewSet):
         """
         Подписка на курс
         """
-        # Для подписки нужно получить курс без фильтрации по владельцу
         try:
-            course = Course.objects.get(pk=pk)
-        except Course.DoesNotExist:
+            course_id = int(pk)
+        except (TypeError, ValueError):
             return Response(
                 {'error': 'Курс не найден'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         user = request.user
         
-        # Проверяем, что пользователь не подписывается на свой курс
-        if course.owner == user:
-            return Response(
-                {'error': 'Нельзя подписаться на собственный курс'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Проверяем, не подписан ли уже пользователь
-        subscription, created = CourseSubscription.objects.get_or_create(
-            user=user,
-            course=course,
-            defaults={'is_active': True}
-        )
-        
-        if not created:
-            if subscription.is_active:
-                return Response(
-                    {'message': 'Вы уже подписаны на этот курс'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            else:
-                subscription.is_active = True
-                subscription.save()
+        # Подписка (или ее восстановление) одним запросом, правило владельца проверяется в SQL
+        rows = CourseSubscription.objects.subscribe(user, [course_id])
+        if rows:
+            subscription, created = rows[0]
+            bump_course_versions(course_id)
+            if not created:
                 return Response(
                     {'message': 'Подписка на курс восстановлена'}, 
                     status=status.HTTP_200_OK
                 )
+            serializer = CourseSubscriptionSerializer(subscription, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         
-        serializer = CourseSubscriptionSerializer(subscription, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Подписка не изменилась - выясняем причину
+        owner_id = Course.objects.filter(pk=course_id).values_list('owner_id', flat=True).first()
+        if owner_id is None:
+            return Response(
+                {'error': 'Курс не найден'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if owner_id == user.pk:
+            return Response(
+                {'error': 'Нельзя подписаться на собственный курс'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {'message': 'Вы уже подписаны на этот курс'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     @action(detail=True, methods=['delete'])
     def unsubscribe(self, request, pk=None):
         """
         Отписка от курса
         """
-        # Для отписки нужно получить курс без фильтрации по владельцу
         try:
-            course = Course.objects.get(pk=pk)
-        except Course.DoesNotExist:
+            course_id = int(pk)
+        except (TypeError, ValueError):
             return Response(
                 {'error': 'Курс не найден'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         user = request.user
         
-        try:
-            subscription = CourseSubscription.objects.get(user=user, course=course)
-            subscription.is_active = False
-            subscription.save()
+        if CourseSubscription.objects.unsubscribe(user, [course_id]):
+            bump_course_versions(course_id)
             return Response(
                 {'message': 'Вы отписались от курса'}, 
                 status=status.HTTP_200_OK
             )
-        except CourseSubscription.DoesNotExist:
+        
+        # Активной подписки нет - выясняем причину
+        if not Course.objects.filter(pk=course_id).exists():
             return Response(
-                {'error': 'Вы не подписаны на этот курс'}, 
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': 'Курс не найден'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if CourseSubscription.objects.filter(user=user, course_id=course_id).exists():
+            return Response(
+                {'message': 'Вы отписались от курса'}, 
+                status=status.HTTP_200_OK
             )
+        return Response(
+            {'error': 'Вы не подписаны на этот курс'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    @action(detail=False, methods=['post'], url_path='batch-subscribe')
+    def subscribe_batch(self, request):
+        """
+        Подписка на несколько курсов одним запросом
+        """
+        serializer = CourseIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        course_ids = serializer.validated_data['course_ids']
+        
+        rows = CourseSubscription.objects.subscribe(request.user, course_ids)
+        subscribed = [subscription.course_id for subscription, created in rows]
+        bump_course_versions(*subscribed)
+        return Response({
+            'subscribed': subscribed,
+            'skipped': [course_id for course_id in course_ids if course_id not in subscribed],
+        })
+    
+    @action(detail=False, methods=['post'], url_path='batch-unsubscribe')
+    def unsubscribe_batch(self, request):
+        """
+        Отписка от нескольких курсов одним запросом
+        """
+        serializer = CourseIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        course_ids = serializer.validated_data['course_ids']
+        
+        unsubscribed = CourseSubscription.objects.unsubscribe(request.user, course_ids)
+        bump_course_versions(*unsubscribed)
+        return Response({
+            'unsubscribed': unsubscribed,
+            'skipped': [course_id for course_id in course_ids if course_id not in unsubscribed],
+        })
 
 
 @extend_schema_view(
@@ -200,32 +295,139 @@ class CourseViewSet(viewsets.ModelViewSet):
         description="Удаляет урок. Доступно только владельцу или модератору.",
         tags=["Уроки"]
     ),
+    bulk_create=extend_schema(
+        summary="Массово создать уроки",
+        description="Создает список уроков одной транзакцией. Подписчики каждого затронутого курса получают одно уведомление.",
+        request=LessonSerializer(many=True),
+        responses=LessonSerializer(many=True),
+        tags=["Уроки"]
+    ),
+    bulk_update=extend_schema(
+        summary="Массово обновить уроки",
+        description="Частично обновляет список уроков одной транзакцией. Каждый элемент должен содержать id урока.",
+        request=LessonSerializer(many=True),
+        responses=LessonSerializer(many=True),
+        tags=["Уроки"]
+    ),
+    bulk_destroy=extend_schema(
+        summary="Массово удалить уроки",
+        description="Удаляет уроки по списку id. Доступно только владельцу.",
+        request=BulkDeleteSerializer,
+        responses={204: None},
+        tags=["Уроки"]
+    ),
 )
-class LessonViewSet(viewsets.ModelViewSet):
+class LessonViewSet(CachedResponseMixin, SparseFieldsetsViewMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrModerator]
     pagination_class = LessonPagination
+    keyset_pagination_class = LessonKeysetPagination
+    cache_course_field = 'course_id'
+    sparse_required_fields = ('id', 'created_at')
+    bulk_max_items = 200
     
-    def get_queryset(self):
+    def get_base_queryset(self):
         # Пользователи видят только свои уроки, модераторы видят все
-        if self.request.user.groups.filter(name='Модераторы').exists():
+        if is_moderator(self.request):
             return Lesson.objects.all()
         return Lesson.objects.filter(owner=self.request.user)
     
+    def get_queryset(self):
+        return self.apply_sparse_fields(self.get_base_queryset())
+    
     def perform_create(self, serializer):
         # Только владельцы могут создавать уроки
-        lesson = serializer.save(owner=self.request.user)
-        send_course_update_email.delay(lesson.course_id, 'lesson', lesson.id)
+        with transaction.atomic():
+            lesson = serializer.save(owner=self.request.user)
+            change_lessons_count({lesson.course_id: 1})
+            enqueue('lms.tasks.record_course_update', lesson.course_id, [lesson.id])
+        bump_course_versions(lesson.course_id)
     
     def perform_update(self, serializer):
         # Проверка прав доступа через permission class
-        lesson = serializer.save()
-        send_course_update_email.delay(lesson.course_id, 'lesson', lesson.id)
+        previous_course_id = serializer.instance.course_id
+        with transaction.atomic():
+            lesson = serializer.save()
+            if lesson.course_id != previous_course_id:
+                change_lessons_count({previous_course_id: -1, lesson.course_id: 1})
+            enqueue('lms.tasks.record_course_update', lesson.course_id, [lesson.id])
+        bump_course_versions(previous_course_id, lesson.course_id)
     
     def perform_destroy(self, instance):
         # Проверка прав доступа через permission class
-        instance.delete()
+        course_id = instance.course_id
+        with transaction.atomic():
+            instance.delete()
+            change_lessons_count({course_id: -1})
+        bump_course_versions(course_id)
+    
+    def get_bulk_instances(self, ids):
+        """
+        Уроки для массовой операции с проверкой прав на каждый из них
+        """
+        lessons = self.get_base_queryset().in_bulk(ids)
+        for lesson in lessons.values():
+            self.check_object_permissions(self.request, lesson)
+        return lessons
+    
+    def notify_courses(self, lessons):
+        # Одно уведомление на курс со списком всех его измененных уроков
+        lesson_ids = {}
+        for lesson in lessons:
+            lesson_ids.setdefault(lesson.course_id, []).append(lesson.id)
+        for course_id, ids in lesson_ids.items():
+            enqueue('lms.tasks.record_course_update', course_id, ids)
+    
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk')
+    def bulk_create(self, request):
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            lessons = serializer.save(owner=request.user)
+            course_ids = [lesson.course_id for lesson in lessons]
+            change_lessons_count(Counter(course_ids))
+            self.notify_courses(lessons)
+        bump_course_versions(*course_ids)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @bulk_create.mapping.patch
+    def bulk_update(self, request):
+        if not isinstance(request.data, list):
+            return Response({'error': 'Ожидается список уроков'}, status=status.HTTP_400_BAD_REQUEST)
+        ids = []
+        for item in request.data:
+            try:
+                ids.append(int(item['id']))
+            except (KeyError, TypeError, ValueError):
+                pass  # Ошибку вернет валидация сериализатора
+        instances = self.get_bulk_instances(ids)
+        serializer = self.get_serializer(
+            instances, data=request.data, many=True, partial=True, max_length=self.bulk_max_items
+        )
+        serializer.is_valid(raise_exception=True)
+        previous_course_ids = [lesson.course_id for lesson in instances.values()]
+        with transaction.atomic():
+            lessons = serializer.save()
+            course_ids = [lesson.course_id for lesson in lessons]
+            deltas = Counter(course_ids)
+            deltas.subtract(previous_course_ids)
+            change_lessons_count(deltas)
+            self.notify_courses(lessons)
+        bump_course_versions(*previous_course_ids, *course_ids)
+        return Response(serializer.data)
+    
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lessons = self.get_bulk_instances(serializer.validated_data['ids'])
+        course_ids = [lesson.course_id for lesson in lessons.values()]
+        with transaction.atomic():
+            Lesson.objects.filter(id__in=lessons.keys()).delete()
+            change_lessons_count({course_id: -count for course_id, count in Counter(course_ids).items()})
+        bump_course_versions(*course_ids)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 @extend_schema_view(
@@ -260,7 +462,7 @@ class LessonViewSet(viewsets.ModelViewSet):
         tags=["Подписки"]
     ),
 )
-class CourseSubscriptionViewSet(viewsets.ModelViewSet):
+class CourseSubscriptionViewSet(SparseFieldsetsViewMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     ViewSet для управления подписками на курсы
     """
@@ -268,10 +470,39 @@ class CourseSubscriptionViewSet(viewsets.ModelViewSet):
     serializer_class = CourseSubscriptionSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = SubscriptionPagination
+    keyset_pagination_class = SubscriptionKeysetPagination
+    sparse_required_fields = ('id', 'created_at')
     
     def get_queryset(self):
         # Пользователи видят только свои подписки
-        return CourseSubscription.objects.filter(user=self.request.user, is_active=True)
+        return self.apply_sparse_fields(
+            CourseSubscription.objects.filter(user=self.request.user, is_active=True)
+        )
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            subscription = serializer.save(user=self.request.user)
+            if subscription.is_active:
+                change_subscribers_count({subscription.course_id: 1})
+        bump_course_versions(subscription.course_id)
+    
+    def perform_update(self, serializer):
+        previous_course_id = serializer.instance.course_id
+        was_active = serializer.instance.is_active
+        with transaction.atomic():
+            subscription = serializer.save()
+            deltas = Counter()
+            if was_active:
+                deltas[previous_course_id] -= 1
+            if subscription.is_active:
+                deltas[subscription.course_id] += 1
+            change_subscribers_count(deltas)
+        bump_course_versions(previous_course_id, subscription.course_id)
+    
+    def perform_destroy(self, instance):
+        course_id = instance.course_id
+        with transaction.atomic():
+            instance.delete()
+            if instance.is_active:
+                change_subscribers_count({course_id: -1})
+        bump_course_versions(course_id)
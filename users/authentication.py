@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import permissions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .revocation import REVOKED_DELETED, get_revocation
+
+
+class RoleClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация, которая для безопасных методов строит пользователя
+    и его роли прямо из проверенного access-токена, без запросов к БД.
+
+    Для изменяющих запросов пользователь загружается из БД как обычно,
+    если включена настройка JWT_ROLE_CLAIMS_DB_CHECK_UNSAFE.
+    Токены деактивированных и удаленных пользователей отклоняются
+    по записи отзыва в кэше (users.revocation).
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if self.can_trust_claims(request, validated_token):
+            return self.get_user_from_claims(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def can_trust_claims(self, request, validated_token):
+        if 'groups' not in validated_token:
+            # Токен выпущен до появления ролей в claims
+            return False
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return not settings.JWT_ROLE_CLAIMS_DB_CHECK_UNSAFE
+
+    def get_user_from_claims(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        # Вместо проверок is_active и существования пользователя по БД
+        revocation = get_revocation(user_id)
+        if revocation == REVOKED_DELETED:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if revocation:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        # Остальные поля пользователя отложены и загрузятся только при обращении к ним
+        user = self.user_model.from_db(DEFAULT_DB_ALIAS, [api_settings.USER_ID_FIELD], [user_id])
+        user._token_roles = frozenset(validated_token['groups'])
+        return user
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from lms.models import Course, Lesson
+from users.roles import MODERATORS_GROUP
 
 
 class Command(BaseCommand):
@@ -9,7 +10,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # Создаем группу модераторов
-        group, created = Group.objects.get_or_create(name='Модераторы')
+        group, created = Group.objects.get_or_create(name=MODERATORS_GROUP)
         
         if created:
             self.stdout.write(
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:03
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицы
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('lms', '0005_composite_indexes'),
+        ('users', '0003_payment'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['user', '-payment_date'], name='users_payment_user_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['last_login'], name='users_active_last_login_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# Поиск PaymentViewSet (search_fields) выполняет UPPER(col::text) LIKE UPPER('%...%'),
+# поэтому индексы строятся по тому же выражению с классом операторов gin_trgm_ops
+TRIGRAM_INDEXES = [
+    ('users_user_email_trgm_idx', 'users_user', 'email'),
+    ('lms_course_title_trgm_idx', 'lms_course', 'title'),
+    ('lms_lesson_title_trgm_idx', 'lms_lesson', 'title'),
+]
+
+
+def pg_trgm_available(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Расширение pg_trgm есть не во всех установках PostgreSQL: без него
+    # поиск работает как раньше, последовательным чтением
+    if not pg_trgm_available(schema_editor):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицы
+    atomic = False
+
+    dependencies = [
+        ('lms', '0011_one_active_price_per_product'),
+        ('users', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
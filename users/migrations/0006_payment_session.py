@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lms', '0011_one_active_price_per_product'),
+        ('users', '0005_payment_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='payment_session',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment', to='lms.paymentsession', verbose_name='Сессия оплаты'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_method',
+            field=models.CharField(choices=[('cash', 'Наличные'), ('transfer', 'Перевод на счет'), ('card', 'Банковская карта')], max_length=10, verbose_name='Способ оплаты'),
+        ),
+    ]
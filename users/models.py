@@ -35,6 +35,10 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        # Поиск неактивных пользователей в deactivate_inactive_users
+        indexes = [
+            models.Index(fields=['last_login'], condition=models.Q(is_active=True), name='users_active_last_login_idx'),
+        ]
     
     def __str__(self):
         return self.email
@@ -44,6 +48,7 @@ class Payment(models.Model):
     PAYMENT_METHOD_CHOICES = [
         ('cash', 'Наличные'),
         ('transfer', 'Перевод на счет'),
+        ('card', 'Банковская карта'),
     ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
@@ -52,12 +57,20 @@ class Payment(models.Model):
     paid_lesson = models.ForeignKey('lms.Lesson', on_delete=models.CASCADE, null=True, blank=True, verbose_name='Оплаченный урок')
     amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name='Сумма оплаты')
     payment_method = models.CharField(max_length=10, choices=PAYMENT_METHOD_CHOICES, verbose_name='Способ оплаты')
+    # Платеж, созданный по оплаченной сессии Stripe: не больше одного на сессию
+    payment_session = models.OneToOneField(
+        'lms.PaymentSession', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='payment', verbose_name='Сессия оплаты'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     
     class Meta:
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['user', '-payment_date'], name='users_payment_user_date_idx'),
+        ]
     
     def __str__(self):
         course_or_lesson = self.paid_course.title if self.paid_course else self.paid_lesson.title if self.paid_lesson else 'Неизвестно'
@@ -0,0 +1,21 @@
+from rest_framework.pagination import PageNumberPagination
+
+from lms.paginators import KeysetPagination
+
+
+class PaymentPagination(PageNumberPagination):
+    """
+    Пагинация для платежей
+    """
+    page_size = 20  # Количество платежей на странице
+    page_size_query_param = 'page_size'  # Параметр для изменения размера страницы
+    max_page_size = 100  # Максимальный размер страницы
+
+
+class PaymentKeysetPagination(KeysetPagination):
+    """
+    Курсорная пагинация для платежей
+    """
+    ordering_field = 'payment_date'
+    page_size = PaymentPagination.page_size
+    max_page_size = PaymentPagination.max_page_size
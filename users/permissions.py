@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from .roles import is_moderator
 
 
 class IsOwnerOrModerator(permissions.BasePermission):
@@ -17,12 +18,12 @@ class IsOwnerOrModerator(permissions.BasePermission):
             return True
         
         # Проверяем, является ли пользователь владельцем объекта
-        if hasattr(obj, 'owner'):
-            if obj.owner == request.user:
+        if hasattr(obj, 'owner_id'):
+            if obj.owner_id == request.user.pk:
                 return True
         
         # Проверяем, является ли пользователь модератором
-        if request.user.groups.filter(name='Модераторы').exists():
+        if is_moderator(request):
             # Модераторы не могут создавать или удалять объекты
             if request.method in ['POST', 'DELETE']:
                 return False
@@ -48,12 +49,12 @@ class IsOwnerOrModeratorForCreate(permissions.BasePermission):
             return True
         
         # Проверяем, является ли пользователь владельцем объекта
-        if hasattr(obj, 'owner'):
-            if obj.owner == request.user:
+        if hasattr(obj, 'owner_id'):
+            if obj.owner_id == request.user.pk:
                 return True
         
         # Проверяем, является ли пользователь модератором
-        if request.user.groups.filter(name='Модераторы').exists():
+        if is_moderator(request):
             # Модераторы не могут создавать или удалять объекты
             if request.method in ['POST', 'DELETE']:
                 return False
@@ -73,12 +74,12 @@ class IsOwnerOrModeratorForDelete(permissions.BasePermission):
             return True
         
         # Проверяем, является ли пользователь владельцем объекта
-        if hasattr(obj, 'owner'):
-            if obj.owner == request.user:
+        if hasattr(obj, 'owner_id'):
+            if obj.owner_id == request.user.pk:
                 return True
         
         # Модераторы не могут удалять объекты
-        if request.user.groups.filter(name='Модераторы').exists():
+        if is_moderator(request):
             if request.method == 'DELETE':
                 return False
             return True
@@ -0,0 +1,57 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Рендерер выгрузки, который умеет отдавать строки по одной (render_rows)
+    для StreamingHttpResponse. render() оформляет обычный ответ
+    (например, ошибку или одну запись) в том же формате.
+    """
+    charset = 'utf-8'
+    file_extension = None
+
+    def render_rows(self, rows, fields):
+        """Генератор фрагментов ответа: rows - словари, fields - порядок колонок"""
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        fields = list(rows[0]) if rows and isinstance(rows[0], dict) else []
+        return ''.join(self.render_rows(rows, fields)).encode(self.charset)
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """Одна JSON-запись на строку (application/x-ndjson)"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    file_extension = 'ndjson'
+
+    def render_rows(self, rows, fields):
+        for row in rows:
+            yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи в буфер"""
+
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(StreamingRenderer):
+    """CSV с заголовком из имен полей сериализатора"""
+    media_type = 'text/csv'
+    format = 'csv'
+    file_extension = 'csv'
+
+    def render_rows(self, rows, fields):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([row.get(field) for field in fields])
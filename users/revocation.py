@@ -0,0 +1,25 @@
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+
+# Пользователи, которым больше нельзя доверять по claims access-токена
+REVOKED_USER_KEY = 'users:revoked:{}'
+REVOKED_INACTIVE = 'inactive'
+REVOKED_DELETED = 'deleted'
+
+
+def revoke_user_tokens(user_ids, reason=REVOKED_INACTIVE):
+    """
+    Отзывает уже выданные access-токены пользователей (деактивация, удаление).
+    Запись хранится, пока действуют выданные до этого access-токены.
+    """
+    timeout = int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    cache.set_many({REVOKED_USER_KEY.format(user_id): reason for user_id in user_ids}, timeout)
+
+
+def restore_user_tokens(user_ids):
+    cache.delete_many([REVOKED_USER_KEY.format(user_id) for user_id in user_ids])
+
+
+def get_revocation(user_id):
+    """Причина отзыва токенов пользователя (REVOKED_INACTIVE, REVOKED_DELETED) или None"""
+    return cache.get(REVOKED_USER_KEY.format(user_id))
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import cache
+
+MODERATORS_GROUP = 'Модераторы'
+
+ROLES_CACHE_PREFIX = 'users:roles'
+ROLES_GENERATION_KEY = f'{ROLES_CACHE_PREFIX}:generation'
+
+
+def _roles_cache_key(user_id):
+    # Поколение меняется при изменении самих групп, что сбрасывает кэш всех пользователей
+    generation = cache.get_or_set(ROLES_GENERATION_KEY, 1, None)
+    return f'{ROLES_CACHE_PREFIX}:{generation}:{user_id}'
+
+
+def get_user_roles(user):
+    """
+    Возвращает множество названий групп пользователя.
+    Результат кэшируется на ROLES_CACHE_TIMEOUT секунд.
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+
+    key = _roles_cache_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, roles, settings.ROLES_CACHE_TIMEOUT)
+    return roles
+
+
+def get_request_roles(request):
+    """
+    Возвращает роли текущего пользователя, запоминая их на объекте запроса,
+    чтобы все проверки прав в рамках запроса обходились одним обращением
+    """
+    roles = getattr(request, '_user_roles', None)
+    if roles is None:
+        # Роли из access-токена (см. users.authentication) не требуют запросов
+        roles = getattr(request.user, '_token_roles', None)
+        if roles is None:
+            roles = get_user_roles(request.user)
+        request._user_roles = roles
+    return roles
+
+
+def is_moderator(request):
+    return MODERATORS_GROUP in get_request_roles(request)
+
+
+def invalidate_user_roles(user_ids):
+    generation = cache.get_or_set(ROLES_GENERATION_KEY, 1, None)
+    cache.delete_many([f'{ROLES_CACHE_PREFIX}:{generation}:{user_id}' for user_id in user_ids])
+
+
+def invalidate_all_roles():
+    try:
+        cache.incr(ROLES_GENERATION_KEY)
+    except ValueError:
+        cache.set(ROLES_GENERATION_KEY, 1, None)
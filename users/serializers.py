@@ -3,9 +3,10 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from .models import User, Payment
 from lms.models import Course, Lesson
+from lms.fieldsets import SparseFieldsetsMixin
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     user_email = serializers.CharField(source='user.email', read_only=True)
     course_title = serializers.CharField(source='paid_course.title', read_only=True)
     lesson_title = serializers.CharField(source='paid_lesson.title', read_only=True)
@@ -14,7 +15,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
-        read_only_fields = ('created_at',)
+        read_only_fields = ('created_at', 'payment_session')
     
     def validate(self, data):
         paid_course = data.get('paid_course')
@@ -28,7 +29,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         return data
 
 
-class PaymentListSerializer(serializers.ModelSerializer):
+class PaymentListSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     user_email = serializers.CharField(source='user.email', read_only=True)
     course_title = serializers.CharField(source='paid_course.title', read_only=True)
     lesson_title = serializers.CharField(source='paid_lesson.title', read_only=True)
@@ -40,7 +41,7 @@ class PaymentListSerializer(serializers.ModelSerializer):
                  'payment_method', 'payment_method_display', 'payment_date')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, validators=[validate_password])
     password_confirm = serializers.CharField(write_only=True)
     
@@ -60,7 +61,7 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserUpdateSerializer(serializers.ModelSerializer):
+class UserUpdateSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'email', 'first_name', 'last_name', 'phone', 'city', 'avatar')
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+from .revocation import REVOKED_DELETED, restore_user_tokens, revoke_user_tokens
+from .roles import invalidate_all_roles, invalidate_user_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def reset_roles_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups.add(...) / remove(...) / clear()
+        invalidate_user_roles([instance.pk])
+    elif pk_set:
+        # group.user_set.add(...) / remove(...)
+        invalidate_user_roles(pk_set)
+    else:
+        # group.user_set.clear() - список пользователей неизвестен
+        invalidate_all_roles()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def reset_roles_on_group_change(sender, **kwargs):
+    invalidate_all_roles()
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_deactivation(sender, instance, **kwargs):
+    # Access-токены читаются без обращения к БД, поэтому отзыв хранится в кэше
+    if instance.is_active:
+        # Отзыв снимается только после фиксации активации: при откате
+        # транзакции пользователь остается неактивным
+        transaction.on_commit(lambda: restore_user_tokens([instance.pk]))
+    else:
+        revoke_user_tokens([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def revoke_tokens_on_delete(sender, instance, **kwargs):
+    revoke_user_tokens([instance.pk], REVOKED_DELETED)
@@ -1,3 +1,316 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from lms.models import Course, Lesson
+from .models import User, Payment
+from .roles import MODERATORS_GROUP, get_user_roles
+
+
+class RoleResolverTest(APITestCase):
+    """Тесты определения ролей пользователя"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        cache.clear()
+        self.owner = User.objects.create_user(
+            email='owner@test.com',
+            password='testpass123'
+        )
+        self.moderator = User.objects.create_user(
+            email='moderator@test.com',
+            password='testpass123'
+        )
+        self.group = Group.objects.create(name=MODERATORS_GROUP)
+        self.moderator.groups.add(self.group)
+        self.course = Course.objects.create(
+            title='Course',
+            description='Description',
+            owner=self.owner
+        )
+    
+    def test_roles_resolved_once_per_request(self):
+        """Группы пользователя загружаются одним запросом на весь запрос"""
+        self.client.force_authenticate(user=self.moderator)
+        url = reverse('course-detail', kwargs={'pk': self.course.pk})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(url, {'title': 'Updated'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        group_queries = [query for query in context.captured_queries if 'auth_group' in query['sql']]
+        self.assertEqual(len(group_queries), 1)
+    
+    def test_roles_cached_between_requests(self):
+        """Роли берутся из кэша в следующих запросах"""
+        get_user_roles(self.moderator)
+        with self.assertNumQueries(0):
+            self.assertIn(MODERATORS_GROUP, get_user_roles(self.moderator))
+    
+    def test_cache_invalidated_on_membership_change(self):
+        """Изменение состава группы сбрасывает кэш ролей"""
+        self.assertIn(MODERATORS_GROUP, get_user_roles(self.moderator))
+        self.group.user_set.remove(self.moderator)
+        self.assertNotIn(MODERATORS_GROUP, get_user_roles(self.moderator))
+        self.moderator.groups.add(self.group)
+        self.assertIn(MODERATORS_GROUP, get_user_roles(self.moderator))
+    
+    def test_cache_invalidated_on_group_rename(self):
+        """Переименование группы сбрасывает кэш всех пользователей"""
+        self.assertIn(MODERATORS_GROUP, get_user_roles(self.moderator))
+        self.group.name = 'Бывшие модераторы'
+        self.group.save()
+        self.assertNotIn(MODERATORS_GROUP, get_user_roles(self.moderator))
+
+
+class RoleClaimsTokenTest(APITestCase):
+    """Тесты ролей в JWT access-токенах"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        cache.clear()
+        self.moderator = User.objects.create_user(
+            email='moderator@test.com',
+            password='testpass123'
+        )
+        self.moderator.groups.add(Group.objects.create(name=MODERATORS_GROUP))
+        self.course = Course.objects.create(
+            title='Course',
+            description='Description',
+            owner=User.objects.create_user(email='owner@test.com', password='testpass123')
+        )
+    
+    def login(self):
+        response = self.client.post(reverse('login'), {'email': 'moderator@test.com', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['tokens']
+    
+    def test_access_token_contains_roles(self):
+        """Роли есть только в access-токене"""
+        tokens = self.login()
+        access = AccessToken(tokens['access'])
+        self.assertTrue(access['is_moderator'])
+        self.assertEqual(access['groups'], [MODERATORS_GROUP])
+        self.assertNotIn('groups', RefreshToken(tokens['refresh']))
+    
+    def test_token_endpoints_issue_roles(self):
+        """Стандартные эндпоинты токенов тоже выдают роли"""
+        response = self.client.post(reverse('token_obtain_pair'), {'email': 'moderator@test.com', 'password': 'testpass123'})
+        self.assertTrue(AccessToken(response.data['access'])['is_moderator'])
+        response = self.client.post(reverse('token_refresh'), {'refresh': response.data['refresh']})
+        self.assertTrue(AccessToken(response.data['access'])['is_moderator'])
+    
+    def test_safe_request_authorized_from_token(self):
+        """Чтение не загружает пользователя и его группы из БД"""
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('course-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('FROM "users_user"', sql)
+        self.assertNotIn('auth_group', sql)
+    
+    @override_settings(JWT_ROLE_CLAIMS_DB_CHECK_UNSAFE=True)
+    def test_unsafe_request_checks_db(self):
+        """Изменяющий запрос проверяет пользователя по БД"""
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        url = reverse('course-detail', kwargs={'pk': self.course.pk})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(url, {'title': 'Updated'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertIn('FROM "users_user"', sql)
+    
+    def test_deactivated_user_token_rejected(self):
+        """После деактивации выданный access-токен не принимается, после активации - снова принимается"""
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.moderator.is_active = False
+        self.moderator.save()
+        for url in (reverse('course-list'), reverse('user-list')):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        
+        self.moderator.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.moderator.save()
+        self.assertEqual(self.client.get(reverse('course-list')).status_code, status.HTTP_200_OK)
+    
+    def test_deleted_user_token_rejected(self):
+        """Access-токен удаленного пользователя не принимается"""
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.moderator.delete()
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['code'], 'user_not_found')
+
+
+class PaymentSparseFieldsetsTest(APITestCase):
+    """Тесты выборочных полей для платежей"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            email='user@test.com',
+            password='testpass123'
+        )
+        course = Course.objects.create(
+            title='Course',
+            description='Description',
+            owner=self.user
+        )
+        Payment.objects.create(
+            user=self.user,
+            payment_date=timezone.now(),
+            paid_course=course,
+            amount=100,
+            payment_method='cash'
+        )
+        self.client.force_authenticate(user=self.user)
+    
+    def test_fields_with_related_source(self):
+        """Поля из связанных моделей подгружаются тем же запросом через JOIN"""
+        # count для пагинации и сама страница
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('payment-list'), {'fields': 'id,course_title,amount'})
+        payment = response.data['results'][0]
+        self.assertEqual(set(payment), {'id', 'course_title', 'amount'})
+        self.assertEqual(payment['course_title'], 'Course')
+
+
+class PaymentExportTest(APITestCase):
+    """Тесты пагинации и потоковой выгрузки платежей"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        other = User.objects.create_user(email='other@test.com', password='testpass123')
+        self.courses = [
+            Course.objects.create(title=f'Course {i}', description='Description', owner=self.user)
+            for i in range(3)
+        ]
+        for i, course in enumerate(self.courses):
+            Payment.objects.create(
+                user=self.user,
+                payment_date=timezone.now() - timedelta(days=i),
+                paid_course=course,
+                amount=100 + i,
+                payment_method='cash' if i else 'transfer'
+            )
+        Payment.objects.create(
+            user=other, payment_date=timezone.now(), paid_course=self.courses[0], amount=1, payment_method='cash'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('payment-list')
+    
+    def export(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+    
+    def test_default_pagination(self):
+        """Обычный список платежей разбит на страницы"""
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+    
+    def test_ndjson_export(self):
+        """NDJSON: все платежи пользователя с учетом фильтров и сортировки, без пагинации"""
+        lines = self.export({'format': 'ndjson', 'ordering': 'amount', 'page_size': 1}).splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['amount'] for row in rows], ['100.00', '101.00', '102.00'])
+        self.assertEqual(rows[0]['course_title'], 'Course 0')
+        
+        lines = self.export({'format': 'ndjson', 'payment_method': 'cash'}).splitlines()
+        self.assertEqual(len(lines), 2)
+    
+    def test_csv_export(self):
+        """CSV: заголовок из полей сериализатора, работают поиск и ?fields="""
+        rows = list(csv.reader(io.StringIO(self.export({'format': 'csv', 'search': 'Course 2'}))))
+        self.assertEqual(rows[0][:3], ['id', 'user_email', 'course_title'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2], 'Course 2')
+        
+        rows = list(csv.reader(io.StringIO(self.export({'format': 'csv', 'fields': 'id,amount'}))))
+        self.assertEqual(rows[0], ['id', 'amount'])
+        self.assertEqual(len(rows), 4)
+    
+    def test_export_query_count(self):
+        """Связанные поля выгрузки читаются тем же запросом"""
+        response = self.client.get(self.url, {'format': 'ndjson'})
+        with CaptureQueriesContext(connection) as context:
+            b''.join(response.streaming_content)
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+class PaymentQueryBudgetTest(APITestCase):
+    """Число запросов к платежам не зависит от количества записей"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+    
+    def create_payments(self, count):
+        for i in range(count):
+            course = Course.objects.create(title=f'Course {i}', description='Description', owner=self.user)
+            lesson = Lesson.objects.create(
+                title=f'Lesson {i}', description='Description', course=course, owner=self.user,
+                video_url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+            )
+            Payment.objects.create(
+                user=self.user, payment_date=timezone.now(), paid_course=course, amount=100, payment_method='cash'
+            )
+            Payment.objects.create(
+                user=self.user, payment_date=timezone.now(), paid_lesson=lesson, amount=10, payment_method='cash'
+            )
+    
+    def test_list_query_budget(self):
+        """Список: count и страница с JOIN пользователя, курса и урока"""
+        url = reverse('payment-list')
+        for count in (1, 10):
+            self.create_payments(count)
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {'page_size': 100})
+            payment = response.data['results'][0]
+            self.assertEqual(payment['user_email'], 'user@test.com')
+            self.assertIn(payment['lesson_title'], {f'Lesson {i}' for i in range(count)})
+        
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'search': 'Lesson 3'})
+        self.assertEqual(response.data['count'], 1)
+    
+    def test_list_selects_only_serializer_columns(self):
+        """Из связанных таблиц выбираются только нужные колонки"""
+        self.create_payments(1)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('payment-list'))
+        sql = context.captured_queries[-1]['sql']
+        self.assertIn('"users_user"."email"', sql)
+        self.assertIn('"lms_lesson"."title"', sql)
+        self.assertNotIn('"users_user"."password"', sql)
+        self.assertNotIn('"lms_course"."description"', sql)
+    
+    def test_detail_query_budget(self):
+        """Детальный ответ платежа - один запрос"""
+        self.create_payments(1)
+        payment = Payment.objects.filter(paid_lesson__isnull=False).get()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('payment-detail', kwargs={'pk': payment.pk}))
+        self.assertEqual(response.data['lesson_title'], 'Lesson 0')
+        self.assertNotIn('course_title', response.data)
@@ -0,0 +1,39 @@
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User
+from .roles import MODERATORS_GROUP, get_user_roles
+
+
+def get_role_claims(roles):
+    return {
+        'is_moderator': MODERATORS_GROUP in roles,
+        'groups': sorted(roles),
+    }
+
+
+class RoleRefreshToken(RefreshToken):
+    """
+    Refresh-токен, выпускающий access-токены с ролями пользователя.
+
+    Сам refresh-токен ролей не содержит: они заново определяются при каждом
+    выпуске access-токена, поэтому устаревшие роли живут не дольше
+    ACCESS_TOKEN_LIFETIME.
+    """
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = User(**{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]})
+        for claim, value in get_role_claims(get_user_roles(user)).items():
+            access[claim] = value
+        return access
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RoleRefreshToken
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RoleRefreshToken
@@ -1,17 +1,30 @@
 from rest_framework import viewsets, filters, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import User, Payment
+from lms.paginators import KeysetPaginationMixin
+from lms.fieldsets import SparseFieldsetsViewMixin, get_serializer_columns
 from .serializers import PaymentSerializer, PaymentListSerializer, UserSerializer, UserUpdateSerializer, LoginSerializer
+from .paginators import PaymentPagination, PaymentKeysetPagination
+from .renderers import StreamingRenderer, NDJSONRenderer, CSVRenderer
+from .tokens import RoleRefreshToken
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(SparseFieldsetsViewMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaymentPagination
+    keyset_pagination_class = PaymentKeysetPagination
+    # ?format=ndjson и ?format=csv выгружают весь отфильтрованный список потоком
+    renderer_classes = [JSONRenderer, BrowsableAPIRenderer, NDJSONRenderer, CSVRenderer]
+    sparse_required_fields = ('id', 'payment_date')
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter, filters.SearchFilter]
     
     filterset_fields = {
@@ -29,18 +42,46 @@ class PaymentViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         # Пользователи видят только свои платежи
-        return Payment.objects.filter(user=self.request.user)
+        queryset = Payment.objects.filter(user=self.request.user)
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        # Поля user_email, course_title и lesson_title читаются тем же запросом:
+        # связи присоединяются через JOIN, и из всех таблиц выбираются только
+        # колонки, нужные текущему сериализатору (с учетом ?fields=)
+        columns, relations = get_serializer_columns(self.get_response_fields(), Payment)
+        return queryset.select_related(*relations).only(*self.sparse_required_fields, *columns)
     
     def get_serializer_class(self):
         if self.action == 'list':
             return PaymentListSerializer
         return PaymentSerializer
     
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, StreamingRenderer):
+            return super().list(request, *args, **kwargs)
+        
+        # Выгрузка без пагинации: записи читаются серверным курсором пачками
+        # и сразу отдаются клиенту, поэтому память не зависит от числа платежей
+        serializer = self.get_serializer()
+        fields = [name for name, field in serializer.fields.items() if not field.write_only]
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = (
+            serializer.to_representation(payment)
+            for payment in queryset.iterator(chunk_size=settings.PAYMENT_EXPORT_CHUNK_SIZE)
+        )
+        response = StreamingHttpResponse(
+            renderer.render_rows(rows, fields),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="payments.{renderer.file_extension}"'
+        return response
+    
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsetsViewMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]
     
@@ -54,8 +95,8 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if self.action == 'list':
             # Пользователи могут видеть только свой профиль
-            return User.objects.filter(id=self.request.user.id)
-        return User.objects.all()
+            return self.apply_sparse_fields(User.objects.filter(id=self.request.user.id))
+        return self.apply_sparse_fields(User.objects.all())
     
     def perform_create(self, serializer):
         serializer.save()
@@ -86,7 +127,7 @@ class RegisterView(generics.CreateAPIView):
         user = serializer.save()
         
         # Создаем JWT токены
-        refresh = RefreshToken.for_user(user)
+        refresh = RoleRefreshToken.for_user(user)
         
         return Response({
             'user': UserSerializer(user).data,
@@ -107,7 +148,7 @@ class LoginView(generics.GenericAPIView):
         user = serializer.validated_data['user']
         
         # Создаем JWT токены
-        refresh = RefreshToken.for_user(user)
+        refresh = RoleRefreshToken.for_user(user)
         
         return Response({
             'user': UserSerializer(user).data,